@@ -0,0 +1,10 @@
+import os
+
+from src.query_cache import QueryCache
+
+
+# Shared by the report crud functions; the pipeline empties it after each dbt run
+report_cache = QueryCache(
+    maxsize=int(os.getenv("API_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("API_CACHE_TTL", "300"))
+)
@@ -1,75 +1,172 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
+from api.cache import report_cache
+
 
 # Endpoint 1: Top Products (term frequency)
-def get_top_products(db: Session, limit: int):
-    query = text("""
-        SELECT
-            LOWER(word) AS term,
-            COUNT(*) AS frequency
-        FROM (
-            SELECT
-                unnest(string_to_array(message_text, ' ')) AS word
-            FROM fct_messages
-            WHERE message_text IS NOT NULL
-        ) t
-        WHERE length(word) > 4
-        GROUP BY term
-        ORDER BY frequency DESC
-        LIMIT :limit
-    """)
-    return db.execute(query, {"limit": limit}).fetchall()
+# Reads the agg_term_frequency mart (tokenized, stopwords removed, counts per channel per day)
+TOP_PRODUCTS_SQL = """
+    SELECT
+        t.term,
+        SUM(t.term_count)::bigint AS frequency
+    FROM agg_term_frequency t
+    {joins}
+    WHERE true
+    {filters}
+    GROUP BY t.term
+    ORDER BY frequency DESC, t.term
+    LIMIT :limit
+"""
+
+
+def top_products_query(limit, channel=None, date_from=None, date_to=None):
+    joins, filters = [], []
+    params = {"limit": limit}
+    if channel:
+        joins.append("JOIN dim_channels c ON c.channel_key = t.channel_key")
+        filters.append("AND c.channel_name = :channel")
+        params["channel"] = channel
+    if date_from:
+        filters.append("AND t.full_date >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        filters.append("AND t.full_date <= :date_to")
+        params["date_to"] = date_to
+    sql = TOP_PRODUCTS_SQL.format(joins="\n    ".join(joins), filters="\n    ".join(filters))
+    return text(sql), params
+
+
+@report_cache.cached("top_products")
+def get_top_products(db: Session, limit: int, channel=None, date_from=None, date_to=None):
+    query, params = top_products_query(limit, channel, date_from, date_to)
+    return db.execute(query, params).fetchall()
 
 
 # Endpoint 2: Channel Activity
-def get_channel_activity(db: Session, channel_name: str):
-    query = text("""
-        SELECT
-            c.channel_name,
-            d.full_date::text,
-            COUNT(*) AS message_count
-        FROM fct_messages f
-        JOIN dim_channels c ON f.channel_key = c.channel_key
-        JOIN dim_dates d ON f.date_key = d.date_key
-        WHERE c.channel_name = :channel
-        GROUP BY c.channel_name, d.full_date
-        ORDER BY d.full_date
-    """)
-    return db.execute(query, {"channel": channel_name}).fetchall()
+# Reads the agg_channel_daily_activity mart; week/month roll the daily rows up
+ACTIVITY_GRANULARITIES = ("day", "week", "month")
+
+CHANNEL_ACTIVITY_SQL = """
+    SELECT
+        c.channel_name,
+        date_trunc('{granularity}', a.full_date)::date::text AS period,
+        SUM(a.message_count)::bigint AS message_count,
+        SUM(a.total_views)::bigint AS total_views,
+        (SUM(a.total_views)::numeric / NULLIF(SUM(a.message_count), 0))::float AS avg_views,
+        SUM(a.total_forwards)::bigint AS total_forwards,
+        SUM(a.image_count)::bigint AS image_count
+    FROM agg_channel_daily_activity a
+    JOIN dim_channels c ON a.channel_key = c.channel_key
+    WHERE c.channel_name = :channel
+    GROUP BY c.channel_name, period
+    ORDER BY period
+"""
+
+
+def channel_activity_query(granularity):
+    if granularity not in ACTIVITY_GRANULARITIES:
+        raise ValueError(f"granularity must be one of {ACTIVITY_GRANULARITIES}")
+    return text(CHANNEL_ACTIVITY_SQL.format(granularity=granularity))
+
+
+@report_cache.cached("channel_activity")
+def get_channel_activity(db: Session, channel_name: str, granularity: str = "day"):
+    return db.execute(channel_activity_query(granularity), {"channel": channel_name}).fetchall()
 
 
 # Endpoint 3: Message Search
-def search_messages(db: Session, query_text: str, limit: int):
-    query = text("""
-        SELECT
-            f.message_id,
-            c.channel_name,
-            f.message_text,
-            d.full_date::text
-        FROM fct_messages f
-        JOIN dim_channels c ON f.channel_key = c.channel_key
-        JOIN dim_dates d ON f.date_key = d.date_key
-        WHERE f.message_text ILIKE :query
-        ORDER BY d.full_date DESC
-        LIMIT :limit
-    """)
-    return db.execute(
-        query,
-        {"query": f"%{query_text}%", "limit": limit}
-    ).fetchall()
+# Served by the fct_message_search mart: GIN indexes on a 'simple' tsvector (word matches)
+# and on trigrams of the text (substring matches, as the old ILIKE did). Rank = full-text
+# cover density + trigram word similarity, so exact words outrank partial matches.
+SEARCH_MESSAGES_SQL = """
+    WITH q AS (
+        SELECT plainto_tsquery('simple', :query) AS tsq
+    )
+    SELECT
+        s.message_id,
+        s.channel_name,
+        s.message_text,
+        s.full_date::text,
+        (ts_rank_cd(s.search_vector, q.tsq) + word_similarity(:query, s.message_text))::float AS rank
+    FROM fct_message_search s, q
+    WHERE (s.search_vector @@ q.tsq OR s.message_text ILIKE :pattern)
+    {filters}
+    ORDER BY rank DESC, s.full_date DESC, s.message_id DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+
+def search_messages_query(query_text, limit, offset=0, channel=None, date_from=None, date_to=None):
+    # Filters are added only when given, so each combination gets its own plan
+    filters = []
+    params = {
+        "query": query_text,
+        # escape LIKE wildcards: the query is matched literally
+        "pattern": "%" + query_text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%",
+        "limit": limit,
+        "offset": offset,
+    }
+    if channel:
+        filters.append("AND s.channel_name = :channel")
+        params["channel"] = channel
+    if date_from:
+        filters.append("AND s.full_date >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        filters.append("AND s.full_date <= :date_to")
+        params["date_to"] = date_to
+    return text(SEARCH_MESSAGES_SQL.format(filters="\n    ".join(filters))), params
+
+
+def search_messages(db: Session, query_text: str, limit: int, offset: int = 0, channel=None,
+                    date_from=None, date_to=None):
+    query, params = search_messages_query(query_text, limit, offset, channel, date_from, date_to)
+    return db.execute(query, params).fetchall()
 
 
 # Endpoint 4: Visual Content Stats
+VISUAL_CONTENT_QUERY = text("""
+    SELECT
+        c.channel_name,
+        COUNT(*) AS total_images,
+        AVG(f.confidence)::numeric(10,4) AS avg_confidence
+    FROM fct_image_detections f
+    JOIN dim_channels c ON f.channel_key = c.channel_key
+    GROUP BY c.channel_name
+    ORDER BY total_images DESC
+""")
+
+
+@report_cache.cached("visual_content_stats")
 def get_visual_content_stats(db: Session):
-    query = text("""
-        SELECT
-            c.channel_name,
-            COUNT(*) AS total_images,
-            AVG(f.confidence)::numeric(10,4) AS avg_confidence
-        FROM fct_image_detections f
-        JOIN dim_channels c ON f.channel_key = c.channel_key
-        GROUP BY c.channel_name
-        ORDER BY total_images DESC
-    """)
-    return db.execute(query).fetchall()
+    return db.execute(VISUAL_CONTENT_QUERY).fetchall()
+
+
+# Async variants (API_DB_MODE=async): same queries, awaited on an AsyncSession.
+# They share cache keys with the sync functions; only one mode runs at a time.
+@report_cache.cached("top_products")
+async def get_top_products_async(db: AsyncSession, limit: int, channel=None, date_from=None, date_to=None):
+    query, params = top_products_query(limit, channel, date_from, date_to)
+    result = await db.execute(query, params)
+    return result.fetchall()
+
+
+@report_cache.cached("channel_activity")
+async def get_channel_activity_async(db: AsyncSession, channel_name: str, granularity: str = "day"):
+    result = await db.execute(channel_activity_query(granularity), {"channel": channel_name})
+    return result.fetchall()
+
+
+async def search_messages_async(db: AsyncSession, query_text: str, limit: int, offset: int = 0, channel=None,
+                                date_from=None, date_to=None):
+    query, params = search_messages_query(query_text, limit, offset, channel, date_from, date_to)
+    result = await db.execute(query, params)
+    return result.fetchall()
+
+
+@report_cache.cached("visual_content_stats")
+async def get_visual_content_stats_async(db: AsyncSession):
+    result = await db.execute(VISUAL_CONTENT_QUERY)
+    return result.fetchall()
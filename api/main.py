@@ -1,16 +1,38 @@
-from fastapi import FastAPI, Depends, HTTPException
+import os
+from contextlib import asynccontextmanager
+from datetime import date
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
-from api.database import SessionLocal
+from api.cache import report_cache
+from api.database import DB_MODE, SessionLocal, AsyncSessionLocal, async_engine
 from api import schemas, crud
 
+# If set, cache invalidation requires this value in the X-Cache-Token header
+CACHE_TOKEN = os.getenv("API_CACHE_TOKEN")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
 app = FastAPI(
     title="Medical Telegram Analytics API",
     description="Task 4 Analytical API powered by dbt marts",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# The same four endpoints exist twice; API_DB_MODE picks which router is mounted
+sync_router = APIRouter()
+async_router = APIRouter()
+
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -20,72 +42,49 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 # -----------------------------
-# Endpoint 1: Top Products
+# Response shaping (shared by both modes)
 # -----------------------------
-@app.get(
-    "/api/reports/top-products",
-    response_model=List[schemas.TopProduct],
-    description="Returns most frequently mentioned products/terms"
-)
-def top_products(limit: int = 10, db: Session = Depends(get_db)):
-    rows = crud.get_top_products(db, limit)
+def top_products_response(rows):
     return [{"term": r[0], "frequency": r[1]} for r in rows]
 
 
-# -----------------------------
-# Endpoint 2: Channel Activity
-# -----------------------------
-@app.get(
-    "/api/channels/{channel_name}/activity",
-    response_model=List[schemas.ChannelActivity],
-    description="Returns posting activity trend for a channel"
-)
-def channel_activity(channel_name: str, db: Session = Depends(get_db)):
-    rows = crud.get_channel_activity(db, channel_name)
+def channel_activity_response(rows):
     if not rows:
         raise HTTPException(status_code=404, detail="Channel not found")
     return [
         {
             "channel_name": r[0],
             "date": r[1],
-            "message_count": r[2]
+            "message_count": r[2],
+            "total_views": r[3],
+            "avg_views": r[4],
+            "total_forwards": r[5],
+            "image_count": r[6]
         }
         for r in rows
     ]
 
 
-# -----------------------------
-# Endpoint 3: Message Search
-# -----------------------------
-@app.get(
-    "/api/search/messages",
-    response_model=List[schemas.MessageSearchResult],
-    description="Search messages containing a keyword"
-)
-def search_messages(query: str, limit: int = 20, db: Session = Depends(get_db)):
-    rows = crud.search_messages(db, query, limit)
+def search_messages_response(rows):
     return [
         {
             "message_id": r[0],
             "channel_name": r[1],
             "message_text": r[2],
-            "message_date": r[3]
+            "message_date": r[3],
+            "rank": r[4]
         }
         for r in rows
     ]
 
 
-# -----------------------------
-# Endpoint 4: Visual Content Stats
-# -----------------------------
-@app.get(
-    "/api/reports/visual-content",
-    response_model=List[schemas.VisualContentStat],
-    description="Returns image usage statistics across channels"
-)
-def visual_content_stats(db: Session = Depends(get_db)):
-    rows = crud.get_visual_content_stats(db)
+def visual_content_response(rows):
     return [
         {
             "channel_name": r[0],
@@ -94,3 +93,140 @@ def visual_content_stats(db: Session = Depends(get_db)):
         }
         for r in rows
     ]
+
+
+TOP_PRODUCTS = dict(
+    path="/api/reports/top-products",
+    response_model=List[schemas.TopProduct],
+    description="Returns most frequently mentioned products/terms, optionally for one channel and/or date range"
+)
+CHANNEL_ACTIVITY = dict(
+    path="/api/channels/{channel_name}/activity",
+    response_model=List[schemas.ChannelActivity],
+    description="Returns posting activity trend for a channel, per day, week or month"
+)
+SEARCH_MESSAGES = dict(
+    path="/api/search/messages",
+    response_model=List[schemas.MessageSearchResult],
+    description="Full-text search over messages, ranked by relevance, with optional channel/date filters"
+)
+VISUAL_CONTENT = dict(
+    path="/api/reports/visual-content",
+    response_model=List[schemas.VisualContentStat],
+    description="Returns image usage statistics across channels"
+)
+
+
+# -----------------------------
+# Endpoint 1: Top Products
+# -----------------------------
+@sync_router.get(**TOP_PRODUCTS)
+def top_products(
+    limit: int = Query(10, ge=1, le=500),
+    channel: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: Session = Depends(get_db)
+):
+    return top_products_response(crud.get_top_products(db, limit, channel, date_from, date_to))
+
+
+@async_router.get(**TOP_PRODUCTS)
+async def top_products_async(
+    limit: int = Query(10, ge=1, le=500),
+    channel: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    return top_products_response(await crud.get_top_products_async(db, limit, channel, date_from, date_to))
+
+
+# -----------------------------
+# Endpoint 2: Channel Activity
+# -----------------------------
+@sync_router.get(**CHANNEL_ACTIVITY)
+def channel_activity(
+    channel_name: str,
+    granularity: str = Query("day", pattern="^(day|week|month)$"),
+    db: Session = Depends(get_db)
+):
+    return channel_activity_response(crud.get_channel_activity(db, channel_name, granularity))
+
+
+@async_router.get(**CHANNEL_ACTIVITY)
+async def channel_activity_async(
+    channel_name: str,
+    granularity: str = Query("day", pattern="^(day|week|month)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return channel_activity_response(await crud.get_channel_activity_async(db, channel_name, granularity))
+
+
+# -----------------------------
+# Endpoint 3: Message Search
+# -----------------------------
+@sync_router.get(**SEARCH_MESSAGES)
+def search_messages(
+    query: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10_000),
+    channel: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: Session = Depends(get_db)
+):
+    rows = crud.search_messages(db, query, limit, offset, channel, date_from, date_to)
+    return search_messages_response(rows)
+
+
+@async_router.get(**SEARCH_MESSAGES)
+async def search_messages_async(
+    query: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10_000),
+    channel: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    rows = await crud.search_messages_async(db, query, limit, offset, channel, date_from, date_to)
+    return search_messages_response(rows)
+
+
+# -----------------------------
+# Endpoint 4: Visual Content Stats
+# -----------------------------
+@sync_router.get(**VISUAL_CONTENT)
+def visual_content_stats(db: Session = Depends(get_db)):
+    return visual_content_response(crud.get_visual_content_stats(db))
+
+
+@async_router.get(**VISUAL_CONTENT)
+async def visual_content_stats_async(db: AsyncSession = Depends(get_async_db)):
+    return visual_content_response(await crud.get_visual_content_stats_async(db))
+
+
+app.include_router(async_router if DB_MODE == "async" else sync_router)
+
+
+# -----------------------------
+# Report cache
+# -----------------------------
+def check_cache_token(x_cache_token: Optional[str] = Header(None)):
+    if CACHE_TOKEN and x_cache_token != CACHE_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid cache token")
+
+
+@app.post(
+    "/api/cache/invalidate",
+    description="Drops cached report results (all, or one report by name); called by the pipeline after dbt run",
+    dependencies=[Depends(check_cache_token)]
+)
+def invalidate_cache(name: Optional[str] = None):
+    return {"invalidated": report_cache.invalidate(name)}
+
+
+@app.get("/api/cache/stats", description="Report cache size, hit rate and per-key stats")
+def cache_stats():
+    return report_cache.stats()
@@ -9,8 +9,12 @@ class TopProduct(BaseModel):
 
 class ChannelActivity(BaseModel):
     channel_name: str
-    date: str
+    date: str  # first day of the day/week/month
     message_count: int
+    total_views: Optional[int] = None
+    avg_views: Optional[float] = None
+    total_forwards: Optional[int] = None
+    image_count: Optional[int] = None
 
 
 class MessageSearchResult(BaseModel):
@@ -18,6 +22,7 @@ class MessageSearchResult(BaseModel):
     channel_name: str
     message_text: str
     message_date: str
+    rank: Optional[float] = None
 
 
 class VisualContentStat(BaseModel):
@@ -0,0 +1,391 @@
+# benchmarks/run_benchmarks.py
+# Offline benchmark of the warehouse hot paths on synthetic data:
+#
+#   load_raw    src/load_raw_to_postgres.py  (COPY + merge of scraper CSVs)
+#   transform   every dbt model (benchmarks/transforms.py), full build then an incremental run
+#   detect      DetectionEngine over synthetic JPEGs with a stub model -> prediction files
+#   load_yolo   src/load_yolo_to_postgres.py (prediction files -> raw_yolo_json upserts)
+#   crud        api/crud.py report queries: latency percentiles
+#
+# It creates a throwaway database on the given server, and drops it at the end (--keep to
+# inspect it). Results go to benchmarks/results/<scale>_<time>.json; --baseline compares
+# against an earlier result and exits 1 on a regression beyond --tolerance.
+#
+#   python benchmarks/run_benchmarks.py --dsn "host=localhost user=postgres password=..." --scale small
+#   python benchmarks/run_benchmarks.py ... --save-baseline          # benchmarks/baselines/small.json
+#   python benchmarks/run_benchmarks.py ... --baseline benchmarks/baselines/small.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+from pathlib import Path
+
+import psycopg2
+from psycopg2.extensions import make_dsn, parse_dsn
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))   # pipeline scripts import each other as siblings
+sys.path.insert(0, str(ROOT))           # api package
+
+from synthetic import (channel_names, iter_messages, write_message_csvs, write_images,  # noqa: E402
+                       StubBackend)
+from transforms import ModelRunner, has_trgm  # noqa: E402
+
+SCALES = {
+    # messages, images, channels
+    "small": {"messages": 10_000, "images": 1_000, "channels": 3},
+    "large": {"messages": 1_000_000, "images": 50_000, "channels": 10},
+}
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+BASELINES_DIR = ROOT / "benchmarks" / "baselines"
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+def percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))], 3)
+    return {"p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99),
+            "mean_ms": round(statistics.fmean(ordered), 3), "max_ms": round(ordered[-1], 3)}
+
+
+def stage_result(tracker):
+    total = tracker.records[0]
+    return {
+        "wall_seconds": total["wall_seconds"],
+        "items": total["items"],
+        "items_per_second": total["items_per_second"],
+        "bytes_written": total["bytes_written"],
+        # All stages run in this one process: its peak only says which stage raised it
+        "process_peak_rss_mb": total["process_peak_rss_mb"],
+        "peak_rss_growth_mb": total["peak_rss_growth_mb"],
+    }
+
+
+def create_database(server_dsn, name):
+    conn = psycopg2.connect(server_dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'CREATE DATABASE "{name}"')
+    conn.close()
+    return make_dsn(server_dsn, dbname=name)
+
+
+def drop_database(server_dsn, name):
+    conn = psycopg2.connect(server_dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    conn.close()
+
+
+# ----------------------------
+# Stages
+# ----------------------------
+def bench_load_raw(conn, csv_paths, work_dir, tracker_cls):
+    import load_raw_to_postgres as loader
+
+    loader.LOADED_FILES_PATH = str(work_dir / "loaded_files.json")  # keep the real ledger untouched
+    with conn.cursor() as cur:
+        cur.execute(loader.CREATE_TABLE_SQL)
+    conn.commit()
+    with tracker_cls("bench_load_raw", unit="rows") as tracker:
+        staged, merged, written = loader.load_csv_files(conn, csv_paths, {})
+        tracker.add(items=staged, bytes_written=written)
+        tracker.set(rows_merged=merged)
+    return stage_result(tracker)
+
+
+def bench_transforms(conn, runner, tracker_cls, label, full_refresh):
+    with tracker_cls(f"bench_transform_{label}", unit="models") as tracker:
+        timings = runner.run_all(full_refresh=full_refresh)
+        tracker.add(items=len(timings))
+    result = stage_result(tracker)
+    result["models"] = {name: {"seconds": round(seconds, 3)} for name, seconds in timings.items()}
+    return result
+
+
+def bench_detect(image_root, pred_dir, tracker_cls, batch_size, seconds_per_image):
+    from detection_engine import DetectionEngine, list_images
+    from detection_sinks import PredictionFileSink, add_bytes_written
+
+    sinks = [PredictionFileSink(pred_dir)]
+    engine = DetectionEngine(StubBackend(seconds_per_image), sinks, batch_size=batch_size)
+    with tracker_cls("bench_detect", unit="images") as tracker:
+        stats = engine.run(tracker.count(list_images(image_root)))
+        add_bytes_written(tracker, sinks)
+    result = stage_result(tracker)
+    result["model_images_per_second"] = stats["model_images_per_second"]
+    return result
+
+
+def bench_load_yolo(conn, pred_dir, work_dir, tracker_cls):
+    import load_yolo_to_postgres as yolo_loader
+    from detection_sinks import PostgresSink, add_bytes_written
+    from enrichment_manifest import EnrichmentManifest
+
+    yolo_loader.PRED_DIR = Path(pred_dir)
+    manifest = EnrichmentManifest(str(work_dir / "manifest_load_yolo.json"), "bench")
+    sink = PostgresSink(conn, batch_size=yolo_loader.DB_BATCH_SIZE)
+    with tracker_cls("bench_load_yolo", unit="images") as tracker:
+        yolo_loader.load_prediction_files(sink, manifest, tracker=tracker)
+        add_bytes_written(tracker, [sink])
+        tracker.set(detections=sink.rows)
+    result = stage_result(tracker)
+    result["detections"] = sink.rows
+    return result
+
+
+def bench_crud(dsn, channels, iterations, search_enabled):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from api import crud
+    from synthetic import PRODUCTS
+
+    engine = create_engine("postgresql+psycopg2://", creator=lambda: psycopg2.connect(dsn))
+    db = sessionmaker(bind=engine)()
+    # __wrapped__: the uncached crud functions - the benchmark measures the queries
+    queries = {
+        "top_products": lambda i: crud.get_top_products.__wrapped__(db, 10),
+        "top_products_channel": lambda i: crud.get_top_products.__wrapped__(db, 10, channels[i % len(channels)]),
+        "channel_activity_day": lambda i: crud.get_channel_activity.__wrapped__(db, channels[i % len(channels)]),
+        "channel_activity_month": lambda i: crud.get_channel_activity.__wrapped__(
+            db, channels[i % len(channels)], "month"),
+        "visual_content_stats": lambda i: crud.get_visual_content_stats.__wrapped__(db),
+    }
+    if search_enabled:
+        queries["search_messages"] = lambda i: crud.search_messages(db, PRODUCTS[i % len(PRODUCTS)], 20)
+        queries["search_messages_substring"] = lambda i: crud.search_messages(
+            db, PRODUCTS[i % len(PRODUCTS)][:5], 20)
+
+    results = {}
+    try:
+        for name, run_query in queries.items():
+            run_query(0)  # warm-up: plan and buffer cache
+            samples = []
+            for i in range(iterations):
+                start = time.perf_counter()
+                run_query(i)
+                samples.append((time.perf_counter() - start) * 1000)
+            results[name] = percentiles(samples)
+            print(f"  {name:<28} p50 {results[name]['p50_ms']:>8.2f} ms   p95 {results[name]['p95_ms']:>8.2f} ms")
+    finally:
+        db.close()
+        engine.dispose()
+    return results
+
+
+# ----------------------------
+# Baseline comparison
+# ----------------------------
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def higher_is_better(metric):
+    return metric.endswith("per_second")
+
+
+def duration_ms(metric, value):
+    if metric.endswith("_ms"):
+        return value
+    if metric.endswith("seconds"):
+        return value * 1000
+    return None
+
+
+def compare(current, baseline, tolerance, noise_floor_ms):
+    """Returns (rows, regressions) for metrics present in both runs.
+
+    Durations below `noise_floor_ms` in both runs are listed but never count as regressions.
+    """
+    rows, regressions = [], []
+    current_flat, baseline_flat = flatten(current["stages"]), flatten(baseline["stages"])
+    for metric in sorted(current_flat.keys() & baseline_flat.keys()):
+        if not (metric.endswith("_ms") or metric.endswith("seconds") or metric.endswith("per_second")
+                or metric.endswith("process_peak_rss_mb")):
+            continue
+        old, new = baseline_flat[metric], current_flat[metric]
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better(metric) else change
+        rows.append((metric, old, new, change))
+        longest = duration_ms(metric, max(old, new))
+        if longest is not None and longest < noise_floor_ms:
+            continue
+        if worse > tolerance:
+            regressions.append(metric)
+    return rows, regressions
+
+
+# ----------------------------
+# Main
+# ----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of loader, transforms, detection and API queries")
+    parser.add_argument("--dsn", default=os.getenv("BENCH_DSN"),
+                        help="libpq connection string of a local Postgres server (a throwaway database is created)")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--messages", type=int, help="override the scale's message count")
+    parser.add_argument("--images", type=int, help="override the scale's image count")
+    parser.add_argument("--channels", type=int, help="override the scale's channel count")
+    parser.add_argument("--delta", type=float, default=0.01,
+                        help="share of new messages loaded before the incremental transform run")
+    parser.add_argument("--iterations", type=int, default=100, help="runs per API query")
+    parser.add_argument("--batch-size", type=int, default=16, help="detection batch size")
+    parser.add_argument("--stub-ms-per-image", type=float, default=0.0,
+                        help="simulated inference time of the stub model")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["detect", "crud"])
+    parser.add_argument("--baseline", help="result JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown (0.15 = 15%%)")
+    parser.add_argument("--noise-floor-ms", type=float, default=50.0,
+                        help="durations shorter than this in both runs are not compared")
+    parser.add_argument("--save-baseline", action="store_true", help=f"also write {BASELINES_DIR}/<scale>.json")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database and synthetic files")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("--dsn (or BENCH_DSN) is required")
+
+    scale = dict(SCALES[args.scale])
+    for key in ("messages", "images", "channels"):
+        if getattr(args, key):
+            scale[key] = getattr(args, key)
+
+    work_dir = Path(tempfile.mkdtemp(prefix="medical_bench_"))
+    os.environ["STAGE_METRICS_PATH"] = str(work_dir / "stage_metrics.jsonl")  # not the pipeline's log
+    from instrumentation import StageTracker
+
+    db_name = f"medical_bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    dsn = create_database(args.dsn, db_name)
+    print(f"Benchmark database {db_name}, files in {work_dir}")
+    print(f"Scale {args.scale}: {scale}")
+
+    results = {
+        "scale": args.scale,
+        "sizes": scale,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "server": parse_dsn(args.dsn).get("host", "local"),
+        "stages": {},
+        "warnings": [],
+    }
+    stages = results["stages"]
+    conn = psycopg2.connect(dsn)
+    try:
+        # ----------------------------
+        # Synthetic data
+        # ----------------------------
+        channels = channel_names(scale["channels"])
+        t0 = time.perf_counter()
+        csv_paths, photos = write_message_csvs(work_dir / "csv", iter_messages(scale["messages"], channels))
+        delta_count = int(scale["messages"] * args.delta)
+        delta_paths, _ = write_message_csvs(
+            work_dir / "csv_delta",
+            iter_messages(delta_count, channels, days=2, seed=43, start_id=scale["messages"] + 1),
+            prefix="telegram_flat_delta")
+        print(f"Generated {scale['messages']} + {delta_count} messages in {time.perf_counter() - t0:.1f}s")
+
+        # ----------------------------
+        # Raw load, transforms (full, then incremental after a delta load)
+        # ----------------------------
+        print("load_raw...")
+        stages["load_raw"] = bench_load_raw(conn, csv_paths, work_dir, StageTracker)
+
+        runner = ModelRunner(conn)
+        runner.seed("stopwords")
+        runner.on_run_start()
+        if "detect" in args.skip:
+            from detection_sinks import ensure_raw_yolo_schema
+            ensure_raw_yolo_schema(conn)  # stg_raw_yolo_json needs the table
+
+        if "detect" not in args.skip:
+            # ----------------------------
+            # Detection (stub model) and detection loading
+            # ----------------------------
+            t0 = time.perf_counter()
+            write_images(work_dir / "images", photos, scale["images"])
+            print(f"Generated {min(scale['images'], len(photos))} images in {time.perf_counter() - t0:.1f}s")
+            print("detect...")
+            stages["detect"] = bench_detect(work_dir / "images", work_dir / "predictions", StageTracker,
+                                            args.batch_size, args.stub_ms_per_image / 1000)
+            print("load_yolo...")
+            stages["load_yolo"] = bench_load_yolo(conn, work_dir / "predictions", work_dir, StageTracker)
+
+        print("transform (full)...")
+        stages["transform_full"] = bench_transforms(conn, runner, StageTracker, "full", full_refresh=True)
+        print("load_raw (delta) + transform (incremental)...")
+        stages["load_raw_delta"] = bench_load_raw(conn, delta_paths, work_dir, StageTracker)
+        stages["transform_incremental"] = bench_transforms(conn, runner, StageTracker, "incremental",
+                                                           full_refresh=False)
+        results["warnings"].extend(runner.warnings)
+
+        # ----------------------------
+        # API queries
+        # ----------------------------
+        if "crud" not in args.skip:
+            print("crud...")
+            search_enabled = has_trgm(conn)
+            if not search_enabled:
+                results["warnings"].append("search_messages skipped: needs pg_trgm")
+            stages["crud"] = bench_crud(dsn, channels, args.iterations, search_enabled)
+    finally:
+        conn.close()
+        if not args.keep:
+            drop_database(args.dsn, db_name)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # ----------------------------
+    # Report
+    # ----------------------------
+    for warning in results["warnings"]:
+        print(f"WARNING: {warning}")
+    print("\nStage                      items       items/s    wall s   written MB   RSS +MB")
+    for name, stage in stages.items():
+        if "items_per_second" in stage:
+            print(f"  {name:<22} {stage['items']:>9} {stage['items_per_second']:>12.1f} "
+                  f"{stage['wall_seconds']:>9.2f} {stage['bytes_written'] / (1024 * 1024):>12.1f} "
+                  f"{stage['peak_rss_growth_mb'] or 0:>9.1f}")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    result_path = RESULTS_DIR / f"{args.scale}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    result_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"\nResults: {result_path}")
+    if args.save_baseline:
+        BASELINES_DIR.mkdir(parents=True, exist_ok=True)
+        baseline_path = BASELINES_DIR / f"{args.scale}.json"
+        baseline_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Baseline saved: {baseline_path}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("sizes") != results["sizes"]:
+            print(f"WARNING: baseline sizes {baseline.get('sizes')} differ from this run's {results['sizes']}")
+        rows, regressions = compare(results, baseline, args.tolerance, args.noise_floor_ms)
+        print(f"\nCompared with {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for metric, old, new, change in rows:
+            flag = "  REGRESSION" if metric in regressions else ""
+            print(f"  {metric:<52} {old:>12.3f} -> {new:>12.3f}  {change:+7.1%}{flag}")
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed beyond {args.tolerance:.0%}")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
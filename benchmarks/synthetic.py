@@ -0,0 +1,144 @@
+# benchmarks/synthetic.py
+# Synthetic Telegram messages, channel images and a stub detector, so the pipeline can be
+# benchmarked offline (no Telegram account, no YOLO weights). Everything is seeded: the same
+# scale always produces the same data.
+
+import os
+import csv
+import random
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Same columns as the scraper's CSV output (src/scraper.py CSV_COLUMNS)
+CSV_COLUMNS = ["message_id", "date", "text", "views", "forwards", "media_type", "channel_username"]
+
+PRODUCTS = [
+    "paracetamol", "amoxicillin", "ibuprofen", "omeprazole", "metformin", "cetirizine", "vitamin",
+    "sunscreen", "moisturizer", "serum", "glucometer", "thermometer", "insulin", "ciprofloxacin",
+    "azithromycin", "diclofenac", "lotion", "shampoo", "toner", "cleanser",
+]
+AMHARIC = ["መድሃኒት", "ዋጋ", "ብር", "አዲስ", "ይደውሉ", "አለ", "ቅናሽ", "ጤና", "ፋርማሲ", "ክሬም"]
+FILLER = ["the", "and", "for", "with", "available", "now", "price", "call", "order", "delivery",
+          "original", "quality", "stock", "new", "best", "contact", "inbox", "tablets", "mg", "ml"]
+
+
+def channel_names(count):
+    base = ["CheMed123", "lobelia4cosmetics", "tikvahpharma"]
+    return (base + [f"bench_channel_{i}" for i in range(len(base), count)])[:count]
+
+
+def message_text(rng):
+    words = rng.choices(PRODUCTS, k=rng.randint(1, 3))
+    words += rng.choices(FILLER, k=rng.randint(3, 12))
+    words += rng.choices(AMHARIC, k=rng.randint(0, 4))
+    rng.shuffle(words)
+    text = " ".join(words)
+    if rng.random() < 0.6:
+        text += f" {rng.randint(50, 5000)} ብር"
+    if rng.random() < 0.2:
+        text += f" {rng.choice(PRODUCTS).capitalize()}, {rng.randint(100, 1000)}mg!"
+    return text
+
+
+def iter_messages(count, channels, days=180, photo_share=0.3, seed=42, start_id=1):
+    """Yields scraper-shaped message dicts, spread over channels and the last `days` days."""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    per_channel = {channel: start_id for channel in channels}
+    for _ in range(count):
+        channel = rng.choice(channels)
+        message_id = per_channel[channel]
+        per_channel[channel] += 1
+        is_photo = rng.random() < photo_share
+        yield {
+            "message_id": message_id,
+            "date": (now - timedelta(seconds=rng.randint(0, days * 86400))).isoformat(),
+            "text": message_text(rng) if rng.random() < 0.95 else "",
+            "views": int(rng.paretovariate(1.5) * 100),
+            "forwards": rng.randint(0, 30),
+            "media_type": "MessageMediaPhoto" if is_photo else "None",
+            "channel_username": channel,
+        }
+
+
+def write_message_csvs(out_dir, messages, rows_per_file=200_000, prefix="telegram_flat_bench"):
+    """Writes messages as scraper-style CSV files; returns (paths, photo messages as (channel, id))."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths, photos = [], []
+    f = writer = None
+    for i, message in enumerate(messages):
+        if i % rows_per_file == 0:
+            if f is not None:
+                f.close()
+            path = os.path.join(out_dir, f"{prefix}_{len(paths):04d}.csv")
+            paths.append(path)
+            f = open(path, "w", encoding="utf-8", newline="")
+            writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+            writer.writeheader()
+        writer.writerow(message)
+        if message["media_type"] == "MessageMediaPhoto":
+            photos.append((message["channel_username"], message["message_id"]))
+    if f is not None:
+        f.close()
+    return paths, photos
+
+
+def write_images(image_root, photos, count, size=160, duplicate_share=0.05, seed=7):
+    """JPEGs at <image_root>/<channel>/<message_id>.jpg for up to `count` photo messages.
+
+    Random blobs on a noisy background; a small share are exact copies of earlier
+    images, as reposts are on the real channels.
+    """
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    written = []
+    for channel, message_id in photos[:count]:
+        channel_dir = os.path.join(image_root, channel)
+        os.makedirs(channel_dir, exist_ok=True)
+        path = os.path.join(channel_dir, f"{message_id}.jpg")
+        if written and rng.random() < duplicate_share:
+            image = cv2.imread(written[int(rng.integers(len(written)))])
+        else:
+            image = rng.integers(0, 255, (size, size, 3), dtype=np.uint8)
+            for _ in range(int(rng.integers(1, 4))):
+                x, y = (int(v) for v in rng.integers(0, size - 40, 2))
+                w, h = (int(v) for v in rng.integers(20, 40, 2))
+                color = tuple(int(c) for c in rng.integers(0, 255, 3))
+                cv2.rectangle(image, (x, y), (x + w, y + h), color, -1)
+        cv2.imwrite(path, image)
+        written.append(path)
+    return written
+
+
+class StubBackend:
+    """Stands in for detection_backends' YOLO backends: same predict() contract, no model.
+
+    Returns 0-4 deterministic boxes per image (derived from its pixels) after an optional
+    fixed delay per batch, to model inference cost.
+    """
+
+    def __init__(self, seconds_per_image=0.0):
+        self.seconds_per_image = seconds_per_image
+
+    def predict(self, images):
+        import time
+
+        if self.seconds_per_image:
+            time.sleep(self.seconds_per_image * len(images))
+        outputs = []
+        for image in images:
+            h, w = image.shape[:2]
+            seed = int(image[::16, ::16].sum())
+            rng = random.Random(seed)
+            detections = []
+            for _ in range(seed % 5):
+                x1, y1 = rng.uniform(0, w / 2), rng.uniform(0, h / 2)
+                detections.append({
+                    "class_id": rng.choice([0, 39, 41, 67]),  # person, bottle, cup, cell phone
+                    "confidence": round(rng.uniform(0.25, 0.99), 4),
+                    "bbox": [round(x1, 1), round(y1, 1), round(x1 + w / 4, 1), round(y1 + h / 4, 1)],
+                })
+            outputs.append((detections, None))
+        return outputs
@@ -0,0 +1,175 @@
+# benchmarks/transforms.py
+# Runs the dbt models of medical_warehouse/ straight against Postgres, without dbt:
+# the model SQL is rendered with Jinja (config/ref/source/var/is_incremental/this and the
+# project macros) and materialized the way dbt-postgres does it (view, table, incremental
+# delete+insert), so the benchmark times the SQL the warehouse really runs.
+
+import csv
+import time
+from pathlib import Path
+
+import jinja2
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent / "medical_warehouse"
+
+# Dependency order of the project's models
+MODELS = [
+    "staging/stg_telegram_messages",
+    "staging/stg_raw_yolo_json",
+    "staging/stg_image_detections",
+    "staging/stg_yolo_images",
+    "marts/dim_channels",
+    "marts/dim_dates",
+    "marts/fct_messages",
+    "marts/fct_image_detections",
+    "marts/fct_message_search",
+    "marts/agg_term_frequency",
+    "marts/agg_channel_daily_activity",
+]
+
+
+class Relation:
+    """What {{ this }} / ref() render to."""
+
+    def __init__(self, name, schema="public"):
+        self.name = self.identifier = name
+        self.schema = schema
+
+    def __str__(self):
+        return f'"{self.schema}"."{self.name}"'
+
+
+class ModelRunner:
+    def __init__(self, conn, variables=None, project_dir=PROJECT_DIR):
+        self.conn = conn
+        self.variables = variables or {}
+        self.project_dir = Path(project_dir)
+        self.env = jinja2.Environment(undefined=jinja2.StrictUndefined)
+        self.macro_sources = [p.read_text(encoding="utf-8")
+                              for p in sorted((self.project_dir / "macros").glob("*.sql"))]
+        self.warnings = []
+
+    # -----------------------------
+    # Rendering
+    # -----------------------------
+    def var(self, name, default=None):
+        return self.variables.get(name, default)
+
+    def context(self, model, incremental):
+        ctx = {
+            "this": Relation(model),
+            "ref": lambda name: Relation(name),
+            "source": lambda source_name, table: Relation(table),
+            "var": self.var,
+            "is_incremental": lambda: incremental,
+        }
+        for source in self.macro_sources:
+            module = self.env.from_string(source).make_module(ctx)
+            ctx.update({name: getattr(module, name) for name in dir(module) if not name.startswith("_")})
+        return ctx
+
+    def render(self, model_path, incremental):
+        model = Path(model_path).name
+        config = {}
+
+        def capture_config(**kwargs):
+            config.update(kwargs)
+            return ""
+
+        ctx = self.context(model, incremental)
+        ctx["config"] = capture_config
+        source = (self.project_dir / "models" / f"{model_path}.sql").read_text(encoding="utf-8")
+        sql = self.env.from_string(source).render(ctx)
+        hooks = {}
+        for kind in ("pre_hook", "post_hook"):
+            kind_hooks = config.get(kind) or []
+            if isinstance(kind_hooks, str):
+                kind_hooks = [kind_hooks]
+            # Like dbt, skip hooks that render to nothing (e.g. {% if is_incremental() %} on a first build)
+            rendered = [self.env.from_string(h).render(ctx).strip() for h in kind_hooks]
+            hooks[kind] = [h for h in rendered if h]
+        return model, config, sql, hooks
+
+    # -----------------------------
+    # Materialization
+    # -----------------------------
+    def execute(self, sql):
+        with self.conn.cursor() as cur:
+            cur.execute(sql)
+        self.conn.commit()
+
+    def exists(self, model):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s)", (f"public.{model}",))
+            return cur.fetchone()[0] is not None
+
+    def run_hooks(self, model, hooks, kind="post-hook"):
+        for hook in hooks:
+            try:
+                self.execute(hook)
+            except Exception as e:  # e.g. pg_trgm missing on this server
+                self.conn.rollback()
+                self.warnings.append(f"{model}: {kind} failed: {str(e).splitlines()[0]}")
+
+    def run_model(self, model_path, full_refresh=False):
+        model = Path(model_path).name
+        incremental = False
+        # Decide from the config how to build; incremental models render differently once they exist
+        _, config, _, _ = self.render(model_path, incremental=False)
+        materialized = config.get("materialized", "view")  # the project default (dbt_project.yml)
+        if materialized == "incremental" and not full_refresh and self.exists(model):
+            incremental = True
+        model, config, sql, hooks = self.render(model_path, incremental)
+
+        self.run_hooks(model, hooks["pre_hook"], "pre-hook")
+        if materialized == "view":
+            self.execute(f'DROP VIEW IF EXISTS "{model}" CASCADE; CREATE VIEW "{model}" AS {sql}')
+        elif not incremental:
+            self.execute(f'DROP TABLE IF EXISTS "{model}" CASCADE; CREATE TABLE "{model}" AS {sql}')
+        else:
+            keys = config["unique_key"]
+            keys = [keys] if isinstance(keys, str) else keys
+            match = " AND ".join(f't."{k}" = s."{k}"' for k in keys)
+            self.execute(f"""
+                DROP TABLE IF EXISTS "{model}__dbt_tmp";
+                CREATE TEMP TABLE "{model}__dbt_tmp" AS {sql};
+                DELETE FROM "{model}" t USING "{model}__dbt_tmp" s WHERE {match};
+                INSERT INTO "{model}" SELECT * FROM "{model}__dbt_tmp";
+                DROP TABLE "{model}__dbt_tmp";
+            """)
+        self.run_hooks(model, hooks["post_hook"])
+        return incremental
+
+    def seed(self, name):
+        path = self.project_dir / "seeds" / f"{name}.csv"
+        with open(path, encoding="utf-8", newline="") as f:
+            header = next(csv.reader(f))
+        columns = ", ".join(f'"{c}" text' for c in header)
+        with self.conn.cursor() as cur:
+            cur.execute(f'DROP TABLE IF EXISTS "{name}" CASCADE; CREATE TABLE "{name}" ({columns})')
+            with open(path, encoding="utf-8") as f:
+                cur.copy_expert(f'COPY "{name}" FROM STDIN WITH (FORMAT csv, HEADER true)', f)
+        self.conn.commit()
+
+    def on_run_start(self):
+        try:
+            self.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except Exception as e:
+            self.conn.rollback()
+            self.warnings.append(f"pg_trgm unavailable, trigram index and search ranking skipped: "
+                                 f"{str(e).splitlines()[0]}")
+
+    def run_all(self, full_refresh=False):
+        """Builds every model in order; returns {model: seconds}."""
+        timings = {}
+        for model_path in MODELS:
+            start = time.perf_counter()
+            self.run_model(model_path, full_refresh=full_refresh)
+            timings[Path(model_path).name] = time.perf_counter() - start
+        return timings
+
+
+def has_trgm(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cur.fetchone() is not None
@@ -0,0 +1,42 @@
+{#
+    Post-hook adding a primary key and indexes to a mart, e.g.
+
+        post_hook="{{ create_indexes(primary_key=['channel_key'], indexes=[['channel_name']]) }}"
+
+    Each entry of `indexes` is a column list, or a dict with `columns` and optional
+    `unique` / `type` (btree by default; gin, ...). An index is only created when the table
+    has none on the same columns, so incremental runs can repeat the hook. Indexes are left
+    unnamed: during a table rebuild the old table (and its index names) still exists under
+    dbt's backup name. Set the var create_indexes to false to skip all of them.
+#}
+{% macro create_indexes(primary_key=none, indexes=[], analyze=true) -%}
+{%- if var('create_indexes', true) %}
+DO $$
+BEGIN
+    {%- if primary_key %}
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = '"{{ this.schema }}"."{{ this.identifier }}"'::regclass AND contype = 'p'
+    ) THEN
+        ALTER TABLE {{ this }} ADD PRIMARY KEY ({{ primary_key | join(', ') }});
+    END IF;
+    {%- endif %}
+    {%- for index in indexes %}
+        {%- set spec = index if index is mapping else {'columns': index} %}
+        {%- set columns = spec['columns'] | join(', ') %}
+        {%- set method = spec.get('type', 'btree') %}
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE schemaname = '{{ this.schema }}' AND tablename = '{{ this.identifier }}'
+          AND indexdef LIKE '%USING {{ method }} ({{ columns }})'
+    ) THEN
+        CREATE {{ 'UNIQUE ' if spec.get('unique') }}INDEX ON {{ this }} USING {{ method }} ({{ columns }});
+    END IF;
+    {%- endfor %}
+END
+$$;
+    {%- if analyze %}
+ANALYZE {{ this }};
+    {%- endif %}
+{%- endif %}
+{%- endmacro %}
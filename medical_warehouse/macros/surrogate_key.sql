@@ -0,0 +1,12 @@
+{#
+    Deterministic surrogate key: the first 64 bits of md5 over the given columns, as a bigint.
+    The same natural key always hashes to the same value, so rebuilding a dimension never
+    changes the keys the (incremental) facts already hold.
+#}
+{% macro surrogate_key(columns) -%}
+    ('x' || left(md5(concat_ws('|'
+        {%- for column in columns -%}
+            , coalesce({{ column }}::text, '')
+        {%- endfor -%}
+    )), 16))::bit(64)::bigint
+{%- endmacro %}
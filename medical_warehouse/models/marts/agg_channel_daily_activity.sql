@@ -0,0 +1,36 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['channel_key', 'date_key'],
+    on_schema_change='append_new_columns',
+    post_hook="{{ create_indexes(primary_key=['channel_key', 'date_key'], indexes=[
+        ['channel_key', 'full_date'],
+        ['loaded_at']
+    ]) }}"
+) }}
+
+-- One row per channel per day, backing /api/channels/{channel}/activity.
+-- Incremental runs recompute only the (channel, day) pairs that have a message loaded since
+-- the last run (fct_messages.loaded_at); delete+insert replaces those rows whole.
+
+SELECT
+    f.channel_key,
+    f.date_key,
+    d.full_date,
+    COUNT(*) AS message_count,
+    COALESCE(SUM(f.view_count), 0) AS total_views,
+    AVG(f.view_count)::numeric(12,2) AS avg_views,
+    COALESCE(SUM(f.forward_count), 0) AS total_forwards,
+    COUNT(*) FILTER (WHERE f.has_image) AS image_count,
+    MAX(f.loaded_at) AS loaded_at
+FROM {{ ref('fct_messages') }} f
+JOIN {{ ref('dim_dates') }} d ON f.date_key = d.date_key
+WHERE f.channel_key IS NOT NULL
+{% if is_incremental() %}
+  AND (f.channel_key, f.date_key) IN (
+      SELECT channel_key, date_key
+      FROM {{ ref('fct_messages') }}
+      WHERE loaded_at >= (SELECT COALESCE(MAX(loaded_at), '1900-01-01'::timestamptz) FROM {{ this }})
+  )
+{% endif %}
+GROUP BY f.channel_key, f.date_key, d.full_date
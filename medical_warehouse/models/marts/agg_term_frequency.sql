@@ -0,0 +1,69 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['channel_key', 'date_key'],
+    on_schema_change='append_new_columns',
+    post_hook="{{ create_indexes(indexes=[
+        {'columns': ['channel_key', 'date_key', 'term'], 'unique': true},
+        ['channel_key', 'full_date'],
+        ['full_date'],
+        ['loaded_at']
+    ]) }}"
+) }}
+
+-- Term counts per channel per day, backing /api/reports/top-products.
+-- Tokens are runs of Latin letters/digits or Ethiopic syllables (U+1200-U+135F, which
+-- leaves out Ethiopic punctuation such as ። and ፣), so "Paracetamol," and "paracetamol" count as one term.
+-- Incremental runs rebuild only the (channel, day) pairs that have a message loaded since the
+-- last run (fct_messages.loaded_at); delete+insert replaces those pairs whole.
+
+WITH messages AS (
+    SELECT
+        f.channel_key,
+        f.date_key,
+        d.full_date,
+        LOWER(f.message_text) AS message_text,
+        f.loaded_at
+    FROM {{ ref('fct_messages') }} f
+    JOIN {{ ref('dim_dates') }} d ON f.date_key = d.date_key
+    WHERE f.message_text IS NOT NULL
+    {% if is_incremental() %}
+      AND (f.channel_key, f.date_key) IN (
+          SELECT channel_key, date_key
+          FROM {{ ref('fct_messages') }}
+          WHERE loaded_at >= (SELECT COALESCE(MAX(loaded_at), '1900-01-01'::timestamptz) FROM {{ this }})
+      )
+    {% endif %}
+),
+
+-- Newest load per pair: the next run's high-water mark
+pair_loads AS (
+    SELECT channel_key, date_key, MAX(loaded_at) AS loaded_at
+    FROM messages
+    GROUP BY channel_key, date_key
+),
+
+tokens AS (
+    SELECT
+        m.channel_key,
+        m.date_key,
+        m.full_date,
+        t.match[1] AS term
+    FROM messages m
+    CROSS JOIN LATERAL regexp_matches(m.message_text, '([a-z0-9\u1200-\u135f]+)', 'g') AS t(match)
+)
+
+SELECT
+    t.channel_key,
+    t.date_key,
+    t.full_date,
+    t.term,
+    COUNT(*) AS term_count,
+    p.loaded_at
+FROM tokens t
+JOIN pair_loads p ON p.channel_key = t.channel_key AND p.date_key = t.date_key
+WHERE t.term !~ '^[0-9]+$'
+  -- Ethiopic syllables carry a consonant and a vowel each, so two are already a word
+  AND (char_length(t.term) >= 3 OR (char_length(t.term) = 2 AND t.term ~ '[\u1200-\u135f]'))
+  AND t.term NOT IN (SELECT term FROM {{ ref('stopwords') }})
+GROUP BY t.channel_key, t.date_key, t.full_date, t.term, p.loaded_at
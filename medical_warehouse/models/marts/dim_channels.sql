@@ -1,7 +1,12 @@
-{{ config(materialized='table') }}
+{{ config(
+    materialized='table',
+    post_hook="{{ create_indexes(primary_key=['channel_key'], indexes=[{'columns': ['channel_name'], 'unique': true}]) }}"
+) }}
 
+-- channel_key is a hash of the channel name: stable across runs and environments,
+-- so facts built earlier keep pointing at the right channel.
 SELECT 
-    ROW_NUMBER() OVER () AS channel_key,
+    {{ surrogate_key(['channel_name']) }} AS channel_key,
     channel_name,
     MIN(message_date) AS first_post_date,
     MAX(message_date) AS last_post_date,
@@ -1,13 +1,35 @@
-{{ config(materialized='table') }}
+{{ config(
+    materialized='table',
+    post_hook="{{ create_indexes(primary_key=['date_key'], indexes=[{'columns': ['full_date'], 'unique': true}]) }}"
+) }}
 
-SELECT DISTINCT
-    TO_CHAR(message_date,'YYYYMMDD')::int AS date_key,
-    message_date::date AS full_date,
-    EXTRACT(DOW FROM message_date)::int AS day_of_week,
-    TO_CHAR(message_date, 'Day') AS day_name,
-    EXTRACT(WEEK FROM message_date)::int AS week_of_year,
-    EXTRACT(MONTH FROM message_date)::int AS month,
-    EXTRACT(QUARTER FROM message_date)::int AS quarter,
-    EXTRACT(YEAR FROM message_date)::int AS year,
-    CASE WHEN EXTRACT(DOW FROM message_date) IN (0,6) THEN true ELSE false END AS is_weekend
-FROM {{ ref('stg_telegram_messages') }}
+-- Date spine: every day from the first message (or var date_spine_start, if earlier)
+-- through today (or the last message, if later), so days without posts exist and
+-- existing rows never change.
+WITH bounds AS (
+    SELECT
+        COALESCE(
+            LEAST({{ "DATE '" ~ var('date_spine_start') ~ "'" if var('date_spine_start', none) else 'NULL::date' }},
+                  MIN(message_date)::date),
+            CURRENT_DATE
+        ) AS start_date,
+        GREATEST(MAX(message_date)::date, CURRENT_DATE) AS end_date
+    FROM {{ ref('stg_telegram_messages') }}
+),
+
+spine AS (
+    SELECT generate_series(b.start_date, b.end_date, INTERVAL '1 day')::date AS full_date
+    FROM bounds b
+)
+
+SELECT
+    TO_CHAR(full_date, 'YYYYMMDD')::int AS date_key,
+    full_date,
+    EXTRACT(DOW FROM full_date)::int AS day_of_week,
+    TO_CHAR(full_date, 'Day') AS day_name,
+    EXTRACT(WEEK FROM full_date)::int AS week_of_year,
+    EXTRACT(MONTH FROM full_date)::int AS month,
+    EXTRACT(QUARTER FROM full_date)::int AS quarter,
+    EXTRACT(YEAR FROM full_date)::int AS year,
+    CASE WHEN EXTRACT(DOW FROM full_date) IN (0,6) THEN true ELSE false END AS is_weekend
+FROM spine
@@ -1,14 +1,66 @@
-DROP TABLE IF EXISTS fct_image_detections;
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['channel_key', 'file_name'],
+    on_schema_change='append_new_columns',
+    pre_hook="{% if is_incremental() %}
+        DELETE FROM {{ this }} f
+        USING {{ ref('stg_yolo_images') }} i
+        WHERE i.loaded_at >= (SELECT COALESCE(MAX(loaded_at), '1900-01-01'::timestamptz) FROM {{ this }})
+          AND f.channel_key = {{ surrogate_key(['i.channel_name']) }}
+          AND f.file_name = i.file_name
+    {% endif %}",
+    post_hook="{{ create_indexes(indexes=[
+        {'columns': ['channel_key', 'file_name', 'box_index'], 'unique': true},
+        ['message_id'],
+        ['date_key'],
+        ['loaded_at']
+    ]) }}"
+) }}
 
-CREATE TABLE fct_image_detections AS
+-- Incremental per image: when any box of an image was (re)loaded, all of the image's boxes
+-- are replaced, so an image re-detected with fewer boxes loses the stale ones.
+-- (delete+insert on purpose: the key is per image, not per row, which merge does not allow.)
+-- delete+insert only replaces images that still have rows, so the pre-hook first deletes every
+-- image whose detections were replaced (stg_yolo_images): one re-detected with no boxes is gone.
+-- Detections can land before their message (the image branch runs independently of the raw
+-- message load), so images whose message was loaded since the last run are rebuilt as well:
+-- that fills in the date_key the earlier run could not find.
+WITH detections AS (
+    SELECT *
+    FROM {{ ref('stg_image_detections') }}
+    {% if is_incremental() %}
+    WHERE (channel_name, file_name) IN (
+        SELECT channel_name, file_name
+        FROM {{ ref('stg_image_detections') }}
+        WHERE loaded_at >= (SELECT COALESCE(MAX(loaded_at), '1900-01-01'::timestamptz) FROM {{ this }})
+        UNION
+        SELECT channel_name, file_name
+        FROM {{ ref('stg_yolo_images') }}
+        WHERE loaded_at >= (SELECT COALESCE(MAX(loaded_at), '1900-01-01'::timestamptz) FROM {{ this }})
+        UNION
+        SELECT i.channel_name, i.file_name
+        FROM {{ ref('stg_telegram_messages') }} m
+        JOIN {{ ref('stg_image_detections') }} i
+            ON i.channel_name = m.channel_name AND i.message_id = m.message_id
+        WHERE m.loaded_at >= (SELECT COALESCE(MAX(loaded_at), '1900-01-01'::timestamptz) FROM {{ this }})
+    )
+    {% endif %}
+)
+
+-- channel_key is hashed from the detection's own channel name (as in dim_channels), so it is
+-- never NULL and the delete+insert key always matches the rows it replaces.
 SELECT
     s.message_id,
-    c.channel_key,
+    {{ surrogate_key(['s.channel_name']) }} AS channel_key,
     d.date_key,
     s.class_id,
     s.confidence,
-    s.image_category
-FROM stg_image_detections s
-LEFT JOIN dim_channels c ON c.channel_name = s.channel_name
-LEFT JOIN stg_telegram_messages m ON m.message_id = s.message_id
-LEFT JOIN dim_dates d ON d.full_date = m.message_date::date;
+    s.image_category,
+    s.file_name,
+    s.box_index,
+    s.loaded_at
+FROM detections s
+LEFT JOIN {{ ref('stg_telegram_messages') }} m
+    ON m.channel_name = s.channel_name AND m.message_id = s.message_id
+LEFT JOIN {{ ref('dim_dates') }} d ON d.full_date = m.message_date::date
@@ -0,0 +1,40 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy=var('incremental_strategy', 'delete+insert'),
+    unique_key=['channel_name', 'message_id'],
+    on_schema_change='append_new_columns',
+    post_hook=[
+        "DELETE FROM {{ this }} WHERE message_text IS NULL OR message_text = ''",
+        "{{ create_indexes(indexes=[
+            {'columns': ['channel_name', 'message_id'], 'unique': true},
+            {'columns': ['search_vector'], 'type': 'gin'},
+            {'columns': ['message_text gin_trgm_ops'], 'type': 'gin'},
+            ['channel_name', 'full_date'],
+            ['loaded_at']
+        ]) }}"
+    ]
+) }}
+
+-- Search index for /api/search/messages.
+-- 'simple' text search config: no stemming or stop words, so Amharic (Ethiopic script)
+-- and English tokens are indexed alike; the trigram index covers substrings and typos.
+-- Incremental runs only compute tsvectors for messages loaded since the last run, and the
+-- GIN indexes are created once and then maintained in place. Changed messages whose text
+-- is now empty replace their old row and are then removed by the first post-hook.
+SELECT
+    f.message_id,
+    c.channel_name,
+    d.full_date,
+    f.message_text,
+    f.view_count,
+    to_tsvector('simple', COALESCE(f.message_text, '')) AS search_vector,
+    f.loaded_at
+FROM {{ ref('fct_messages') }} f
+JOIN {{ ref('dim_channels') }} c ON f.channel_key = c.channel_key
+JOIN {{ ref('dim_dates') }} d ON f.date_key = d.date_key
+{% if is_incremental() %}
+WHERE f.loaded_at >= (SELECT COALESCE(MAX(loaded_at), '1900-01-01'::timestamptz) FROM {{ this }})
+{% else %}
+WHERE f.message_text IS NOT NULL
+  AND f.message_text <> ''
+{% endif %}
@@ -1,6 +1,16 @@
-DROP TABLE IF EXISTS fct_messages;
+{{ config(
+    materialized='incremental',
+    incremental_strategy=var('incremental_strategy', 'delete+insert'),
+    unique_key=['channel_key', 'message_id'],
+    on_schema_change='append_new_columns',
+    post_hook="{{ create_indexes(indexes=[
+        {'columns': ['channel_key', 'message_id'], 'unique': true},
+        ['channel_key', 'date_key'],
+        ['date_key'],
+        ['loaded_at']
+    ]) }}"
+) }}
 
-CREATE TABLE fct_messages AS
 SELECT
     m.message_id,
     c.channel_key,
@@ -9,7 +19,11 @@ SELECT
     m.message_length,
     m.view_count,
     m.forward_count,
-    m.has_image
-FROM stg_telegram_messages m
-LEFT JOIN dim_channels c ON c.channel_name = m.channel_name
-LEFT JOIN dim_dates d ON d.full_date = m.message_date::date;
+    m.has_image,
+    m.loaded_at
+FROM {{ ref('stg_telegram_messages') }} m
+LEFT JOIN {{ ref('dim_channels') }} c ON c.channel_name = m.channel_name
+LEFT JOIN {{ ref('dim_dates') }} d ON d.full_date = m.message_date::date
+{% if is_incremental() %}
+WHERE m.loaded_at >= (SELECT COALESCE(MAX(loaded_at), '1900-01-01'::timestamptz) FROM {{ this }})
+{% endif %}
@@ -1,12 +1,14 @@
-DROP VIEW IF EXISTS stg_raw_yolo_json;
+{{ config(materialized='view') }}
 
-CREATE VIEW stg_raw_yolo_json AS
 SELECT
+    id,
     message_id::integer,
     class_id::integer,
     confidence::double precision,
     bbox::text,
     channel_name::text,
     image_category::text,
-    file_name::text
-FROM raw_yolo_json;
+    file_name::text,
+    box_index::integer,
+    loaded_at
+FROM {{ source('raw', 'raw_yolo_json') }}
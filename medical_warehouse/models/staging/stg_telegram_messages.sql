@@ -1,6 +1,13 @@
-DROP TABLE IF EXISTS stg_telegram_messages;
+{{ config(
+    materialized='incremental',
+    incremental_strategy=var('incremental_strategy', 'delete+insert'),
+    unique_key=['channel_name', 'message_id'],
+    on_schema_change='append_new_columns',
+    post_hook="{{ create_indexes(indexes=[{'columns': ['channel_name', 'message_id'], 'unique': true}, ['loaded_at']]) }}"
+) }}
 
-CREATE TABLE stg_telegram_messages AS
+-- Incremental: only raw rows inserted or updated since the last run (loaded_at is bumped by
+-- the loader's upsert). >= re-reads the boundary batch, which the unique key makes harmless.
 SELECT
     message_id::integer,
     channel_username AS channel_name,
@@ -9,5 +16,9 @@ SELECT
     views::integer AS view_count,
     forwards::integer AS forward_count,
     CASE WHEN media_type IS NOT NULL AND media_type <> '' THEN true ELSE false END AS has_image,
-    LENGTH(text) AS message_length
-FROM telegram_messages;
+    LENGTH(text) AS message_length,
+    loaded_at
+FROM {{ source('raw', 'telegram_messages') }}
+{% if is_incremental() %}
+WHERE loaded_at >= (SELECT COALESCE(MAX(loaded_at), '1900-01-01'::timestamptz) FROM {{ this }})
+{% endif %}
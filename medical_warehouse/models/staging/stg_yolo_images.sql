@@ -0,0 +1,9 @@
+{{ config(materialized='view') }}
+
+-- Images whose detections were (re)loaded, including those re-detected with no boxes
+SELECT
+    channel_name::text,
+    file_name::text,
+    box_count::integer,
+    loaded_at
+FROM {{ source('raw', 'raw_yolo_images') }}
@@ -0,0 +1,12 @@
+-- Fails for every combination of the columns that appears more than once
+-- (message ids repeat across channels, so facts are unique per channel + message)
+{% test unique_combination_of_columns(model, combination_of_columns) %}
+
+select
+    {{ combination_of_columns | join(', ') }},
+    count(*) as n_rows
+from {{ model }}
+group by {{ combination_of_columns | join(', ') }}
+having count(*) > 1
+
+{% endtest %}
@@ -1,41 +1,243 @@
-﻿from dagster import op, job
-import subprocess
+﻿from dagster import (
+    AssetCheckResult,
+    AssetExecutionContext,
+    AssetSelection,
+    AutomationCondition,
+    BackfillPolicy,
+    Definitions,
+    MaterializeResult,
+    RunRequest,
+    StaticPartitionsDefinition,
+    asset,
+    asset_check,
+    define_asset_job,
+    schedule,
+)
+import os
 import sys
+import urllib.request
+from pathlib import Path
 
-@op
-def scrape_telegram_data():
-    subprocess.check_call([sys.executable, 'src/scraper.py'])
-
-@op
-def load_raw_to_postgres():
-    subprocess.check_call([sys.executable, 'src/load_raw_to_postgres.py'])
-
-@op
-def download_images():
-    subprocess.check_call([sys.executable, 'src/download_images.py'])
-
-@op
-def run_yolo_enrichment():
-    subprocess.check_call([sys.executable, 'src/run_yolo.py'])
-
-@op
-def load_yolo_results():
-    subprocess.check_call([sys.executable, 'src/load_yolo_to_postgres.py'])
-
-@op
-def run_dbt_transformations():
-    subprocess.check_call(['dbt', 'run'])
-
-@op
-def run_dbt_tests():
-    subprocess.check_call(['dbt', 'test'])
-
-@job
-def telegram_data_pipeline():
-    scrape_telegram_data()
-    load_raw_to_postgres()
-    download_images()
-    run_yolo_enrichment()
-    load_yolo_results()
-    run_dbt_transformations()
-    run_dbt_tests()
+# The pipeline imports the scripts in src/ (they import each other as siblings) and, like
+# them, expects to run from the repository root: data/, output/ and logs/ are relative paths
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+DBT_PROJECT_DIR = os.getenv("DBT_PROJECT_DIR", "medical_warehouse")
+
+# One partition per channel (same list as src/scraper.py and src/download_images.py)
+CHANNELS = [
+    c.strip() for c in os.getenv("PIPELINE_CHANNELS", "CheMed123,lobelia4cosmetics,tikvahpharma").split(",")
+    if c.strip()
+]
+channel_partitions = StaticPartitionsDefinition(CHANNELS)
+
+# When the scheduled extraction runs (scrape + image download, all channels)
+EXTRACT_CRON = os.getenv("PIPELINE_EXTRACT_CRON", "0 */6 * * *")
+
+# Caches of the running APIs (comma-separated; list every API process - each uvicorn worker has
+# its own cache). The mart API (api/main.py) is emptied after every successful dbt run, the
+# raw-table API (src/api.py, /analytics) after every raw message or detection load.
+CACHE_INVALIDATE_URLS = os.getenv(
+    "CACHE_INVALIDATE_URLS",
+    "http://127.0.0.1:8000/api/cache/invalidate"
+)
+RAW_CACHE_INVALIDATE_URLS = os.getenv(
+    "RAW_CACHE_INVALIDATE_URLS",
+    "http://127.0.0.1:8001/cache/invalidate"
+)
+CACHE_TOKEN = os.getenv("API_CACHE_TOKEN")
+
+
+def invalidate_api_caches(log, urls=CACHE_INVALIDATE_URLS):
+    for url in [u.strip() for u in urls.split(",") if u.strip()]:
+        headers = {"X-Cache-Token": CACHE_TOKEN} if CACHE_TOKEN else {}
+        request = urllib.request.Request(url, method="POST", headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                log.info(f"Invalidated API cache at {url}: {response.read().decode()}")
+        except OSError as e:
+            # API not running: nothing cached to go stale; its TTL covers any other case
+            log.warning(f"Could not invalidate API cache at {url}: {e}")
+
+
+def run_dbt(args):
+    from dbt.cli.main import dbtRunner
+
+    result = dbtRunner().invoke(args + ["--project-dir", DBT_PROJECT_DIR])
+    if result.exception is not None:
+        raise result.exception
+    return result
+
+
+def run_stage(context, stage, func, *args):
+    """Call a script's entry point; returns its result and its StageTracker metrics as metadata."""
+    import instrumentation
+
+    instrumentation.set_run_id(context.run_id)  # logs/stage_metrics.jsonl lines carry the Dagster run id
+    result = func(*args)
+    return result, instrumentation.metadata_from_records(instrumentation.pop_completed(stage))
+
+
+def channel_stats_metadata(stats):
+    # {channel: {name: number}} -> flat "channel.name" metadata entries
+    return {f"{channel}.{key}": value for channel, values in stats.items()
+            for key, value in values.items() if isinstance(value, (int, float))}
+
+
+# ----------------------------
+# Assets
+# ----------------------------
+# Graph (per channel partition unless noted):
+#
+#   scraped_messages -> raw_telegram_messages --------------------\
+#                                                                  +-> warehouse (dbt, all channels)
+#   downloaded_images -> yolo_predictions -> raw_yolo_detections -/
+#
+# The two roots run on the schedule below; everything downstream is eager: a partition
+# materializes as soon as its own upstream partition changed (and nothing upstream is
+# still running), so a channel's detection starts when that channel's images land and
+# the download branch overlaps the raw load. Scripts lock the state files and Telegram session
+# they rewrite (src/file_lock.py), so overlapping runs of one script take turns; the Dagster
+# concurrency keys (see README) only keep such runs from queueing on those locks.
+# Runs covering several channels (schedule, backfills) execute as a single run, so one
+# Telegram client / one model load serves all of them.
+
+@asset(
+    partitions_def=channel_partitions,
+    backfill_policy=BackfillPolicy.single_run(),
+    op_tags={"dagster/concurrency_key": "telegram_scraper"},
+    description="New messages scraped per channel (data/raw: NDJSON, CSV, Parquet lake)",
+)
+def scraped_messages(context: AssetExecutionContext):
+    import scraper
+
+    channel_stats, metrics = run_stage(context, "scrape", scraper.run, context.partition_keys)
+    stats = {s["channel"]: s for s in channel_stats}
+    return MaterializeResult(metadata={**channel_stats_metadata(stats), **metrics})
+
+
+@asset(
+    partitions_def=channel_partitions,
+    backfill_policy=BackfillPolicy.single_run(),
+    deps=[scraped_messages],
+    automation_condition=AutomationCondition.eager(),
+    op_tags={"dagster/concurrency_key": "raw_loader"},
+    description="public.telegram_messages, merged from the channel's new raw files",
+)
+def raw_telegram_messages(context: AssetExecutionContext):
+    import load_raw_to_postgres
+
+    result, metrics = run_stage(context, "load_raw", load_raw_to_postgres.main, context.partition_keys)
+    invalidate_api_caches(context.log, RAW_CACHE_INVALIDATE_URLS)
+    return MaterializeResult(metadata={**result, **metrics})
+
+
+@asset(
+    partitions_def=channel_partitions,
+    backfill_policy=BackfillPolicy.single_run(),
+    op_tags={"dagster/concurrency_key": "telegram_downloader"},
+    description="Channel photos under data/raw/images/<channel>",
+)
+def downloaded_images(context: AssetExecutionContext):
+    import download_images
+
+    stats, metrics = run_stage(context, "download_images", download_images.run, context.partition_keys)
+    return MaterializeResult(metadata={**channel_stats_metadata(stats), **metrics})
+
+
+@asset(
+    partitions_def=channel_partitions,
+    backfill_policy=BackfillPolicy.single_run(),
+    deps=[downloaded_images],
+    automation_condition=AutomationCondition.eager(),
+    op_tags={"dagster/concurrency_key": "yolo"},
+    description="YOLO predictions (output/yolo) for the channel's new or changed images",
+)
+def yolo_predictions(context: AssetExecutionContext):
+    import run_yolo
+
+    stats, metrics = run_stage(context, "yolo", run_yolo.main, context.partition_keys)
+    return MaterializeResult(metadata={
+        **{key: value for key, value in stats.items() if isinstance(value, (int, float))},
+        **metrics,
+    })
+
+
+@asset(
+    partitions_def=channel_partitions,
+    backfill_policy=BackfillPolicy.single_run(),
+    deps=[yolo_predictions],
+    automation_condition=AutomationCondition.eager(),
+    op_tags={"dagster/concurrency_key": "yolo_loader"},
+    description="public.raw_yolo_json, loaded from the channel's prediction files",
+)
+def raw_yolo_detections(context: AssetExecutionContext):
+    import load_yolo_to_postgres
+
+    result, metrics = run_stage(context, "load_yolo", load_yolo_to_postgres.main, context.partition_keys)
+    invalidate_api_caches(context.log, RAW_CACHE_INVALIDATE_URLS)
+    return MaterializeResult(metadata={**result, **metrics})
+
+
+@asset(
+    deps=[raw_telegram_messages, raw_yolo_detections],
+    automation_condition=AutomationCondition.eager(),
+    op_tags={"dagster/concurrency_key": "dbt"},
+    description="dbt seeds and models in medical_warehouse/ (incremental: only newly loaded rows are processed)",
+)
+def warehouse(context: AssetExecutionContext):
+    from instrumentation import StageTracker
+
+    def dbt_run():
+        # Seeds first: models ref them (stopwords), and a fresh deployment has none loaded yet
+        seed = run_dbt(["seed"])
+        if not seed.success:
+            raise RuntimeError("dbt seed failed")
+        with StageTracker("dbt_run", unit="models") as tracker:
+            result = run_dbt(["run"])
+            tracker.add(items=len(result.result))
+            tracker.set(success=result.success)
+        return result
+
+    result, metrics = run_stage(context, "dbt_run", dbt_run)
+    if not result.success:
+        raise RuntimeError("dbt run failed")
+    invalidate_api_caches(context.log)
+    return MaterializeResult(metadata=metrics)
+
+
+@asset_check(asset=warehouse, description="dbt test")
+def warehouse_dbt_tests():
+    result = run_dbt(["test"])
+    failures = [r.node.name for r in result.result if r.status in ("fail", "error")]
+    return AssetCheckResult(passed=result.success, metadata={"failed_tests": ", ".join(failures) or "none"})
+
+
+# ----------------------------
+# Jobs and schedule
+# ----------------------------
+extract_job = define_asset_job(
+    "telegram_extract",
+    selection=AssetSelection.assets(scraped_messages, downloaded_images),
+    partitions_def=channel_partitions,
+)
+
+
+@schedule(job=extract_job, cron_schedule=EXTRACT_CRON)
+def extract_schedule():
+    # One run over every channel partition
+    return RunRequest(tags={
+        "dagster/asset_partition_range_start": CHANNELS[0],
+        "dagster/asset_partition_range_end": CHANNELS[-1],
+    })
+
+
+defs = Definitions(
+    assets=[scraped_messages, raw_telegram_messages, downloaded_images, yolo_predictions,
+            raw_yolo_detections, warehouse],
+    asset_checks=[warehouse_dbt_tests],
+    jobs=[extract_job],
+    schedules=[extract_schedule],
+)
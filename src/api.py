@@ -1,20 +1,65 @@
-from fastapi import FastAPI, HTTPException
+import os
+import io
+import csv
+import json
+import base64
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Optional
 from pydantic import BaseModel
-import psycopg2
+
+from db_pool import ConnectionPool, PoolTimeout
+from query_cache import QueryCache
+
+# ===============================
+# Database Connection Pool
+# ===============================
+
+DB_CONFIG = {
+    "host": os.getenv("API_DB_HOST", "localhost"),
+    "dbname": os.getenv("API_DB_NAME", "postgres"),
+    "user": os.getenv("API_DB_USER", "postgres"),
+    "password": os.getenv("API_DB_PASSWORD", "newpassword123"),
+    "port": int(os.getenv("API_DB_PORT", "5432")),
+}
+
+POOL_MIN_SIZE = int(os.getenv("API_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("API_POOL_MAX_SIZE", "10"))        # keep well below Postgres max_connections
+POOL_TIMEOUT = float(os.getenv("API_POOL_TIMEOUT", "5"))          # seconds to wait for a free connection
+POOL_MAX_IDLE = float(os.getenv("API_POOL_MAX_IDLE", "300"))      # close extra idle connections after this
+POOL_MAX_LIFETIME = float(os.getenv("API_POOL_MAX_LIFETIME", "3600"))
+POOL_CHECK_AFTER = float(os.getenv("API_POOL_CHECK_AFTER", "30"))  # ping connections idle longer than this
+
+pool = None
 
 # ===============================
-# Database Connection
+# Analytics Result Cache
 # ===============================
 
+# Emptied by the pipeline after each raw load (the /analytics queries read the raw tables)
+analytics_cache = QueryCache(
+    maxsize=int(os.getenv("API_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("API_CACHE_TTL", "300"))
+)
+CACHE_TOKEN = os.getenv("API_CACHE_TOKEN")
+
+
 def get_db_connection():
-    return psycopg2.connect(
-        host="localhost",
-        dbname="postgres",
-        user="postgres",
-        password="newpassword123",
-        port=5432
-    )
+    """Borrow a pooled connection: `with get_db_connection() as conn: ...` returns it to the pool."""
+    return pool.connection()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global pool
+    pool = ConnectionPool(min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                          max_idle=POOL_MAX_IDLE, max_lifetime=POOL_MAX_LIFETIME,
+                          check_after=POOL_CHECK_AFTER, **DB_CONFIG).open()
+    try:
+        yield
+    finally:
+        pool.close()
 
 # ===============================
 # FastAPI App
@@ -23,9 +68,15 @@ def get_db_connection():
 app = FastAPI(
     title="Medical Telegram Analytics API",
     description="Task 4 Analytics API for Telegram Messages and YOLO Image Detections",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
 # ===============================
 # Pydantic Schemas
 # ===============================
@@ -59,32 +110,103 @@ class DetectionAnalytics(BaseModel):
     total_detections: int
     avg_confidence: float
 
+# ===============================
+# Pagination & Streaming Export
+# ===============================
+
+MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "1000"))
+EXPORT_FETCH_SIZE = int(os.getenv("API_EXPORT_FETCH_SIZE", "5000"))  # rows per server-side cursor fetch
+
+
+def encode_cursor(values):
+    """Opaque page cursor: the sort key of the last row returned."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def cursor_value_matches(value, kind):
+    if isinstance(value, bool):  # JSON true/false would pass as int
+        return False
+    if kind is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, kind)
+
+
+def decode_cursor(cursor, types):
+    """Values of a cursor from encode_cursor, checked against `types` (one Python type per sort key).
+
+    Anything else is a 400: a malformed cursor must not reach the query as a type error.
+    """
+    if cursor is None:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        values = None
+    if (not isinstance(values, list) or len(values) != len(types)
+            or not all(cursor_value_matches(v, kind) for v, kind in zip(values, types))):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def stream_export(name, query, columns, format):
+    """StreamingResponse over a named (server-side) cursor: memory stays at one fetch of rows."""
+
+    def rows():
+        with get_db_connection() as conn:
+            with conn.cursor(name=f"export_{name}") as cur:
+                cur.itersize = EXPORT_FETCH_SIZE
+                cur.execute(query)
+                if format == "csv":
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    writer.writerow(columns)
+                while True:
+                    batch = cur.fetchmany(EXPORT_FETCH_SIZE)
+                    if not batch:
+                        break
+                    if format == "csv":
+                        writer.writerows(batch)
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                    else:
+                        yield "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in batch)
+            conn.rollback()  # end the read transaction the named cursor needed
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(rows(), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{name}.{format}"'
+    })
+
 # ===============================
 # Messages Endpoints
 # ===============================
 
 @app.get("/messages", response_model=List[Message])
-def get_messages(limit: int = 20):
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT
-            message_id,
-            channel_username,
-            text,
-            date,
-            views,
-            forwards,
-            media_type
-        FROM telegram_messages
-        ORDER BY message_id DESC
-        LIMIT %s
-    """, (limit,))
+def get_messages(response: Response, limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None):
+    # Newest first. Pass the X-Next-Cursor header of a page as `cursor` to get the next one.
+    after = decode_cursor(cursor, (int, str)) or []
+    keyset = "WHERE (message_id, channel_username) < (%s, %s)" if after else ""
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT
+                message_id,
+                channel_username,
+                text,
+                date::text,
+                views,
+                forwards,
+                media_type
+            FROM telegram_messages
+            {keyset}
+            ORDER BY message_id DESC, channel_username DESC
+            LIMIT %s
+        """, (*after, limit))
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+        rows = cur.fetchall()
+
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor([rows[-1][0], rows[-1][1]])
 
     return [
         Message(
@@ -99,32 +221,51 @@ def get_messages(limit: int = 20):
         for row in rows
     ]
 
+@app.get("/messages/export")
+def export_messages(format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    # The whole table, streamed in primary-key order as rows come off a server-side cursor
+    return stream_export(
+        "messages",
+        """
+        SELECT message_id, channel_username, text, date::text, views, forwards, media_type
+        FROM telegram_messages
+        ORDER BY channel_username, message_id
+        """,
+        list(Message.model_fields),
+        format
+    )
+
 # ===============================
 # YOLO Image Detections Endpoints
 # ===============================
 
 @app.get("/image-detections", response_model=List[ImageDetection])
-def get_image_detections(limit: int = 20):
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT
-            message_id,
-            class_id,
-            confidence,
-            bbox,
-            channel_name,
-            image_category,
-            file_name
-        FROM raw_yolo_json
-        ORDER BY confidence DESC
-        LIMIT %s
-    """, (limit,))
+def get_image_detections(response: Response, limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+                         cursor: Optional[str] = None):
+    # Highest confidence first; paged like /messages, on (confidence, id)
+    after = decode_cursor(cursor, (float, int)) or []
+    keyset = "AND (confidence, id) < (%s, %s)" if after else ""
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT
+                message_id,
+                class_id,
+                confidence,
+                bbox,
+                channel_name,
+                image_category,
+                file_name,
+                id
+            FROM raw_yolo_json
+            WHERE confidence IS NOT NULL {keyset}
+            ORDER BY confidence DESC, id DESC
+            LIMIT %s
+        """, (*after, limit))
+
+        rows = cur.fetchall()
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor([rows[-1][2], rows[-1][7]])
 
     return [
         ImageDetection(
@@ -139,30 +280,42 @@ def get_image_detections(limit: int = 20):
         for row in rows
     ]
 
+@app.get("/image-detections/export")
+def export_image_detections(format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    return stream_export(
+        "image_detections",
+        """
+        SELECT message_id, class_id, confidence, bbox, channel_name, image_category, file_name
+        FROM raw_yolo_json
+        ORDER BY id
+        """,
+        list(ImageDetection.model_fields),
+        format
+    )
+
 # ===============================
 # Analytics Endpoints
 # ===============================
 
-@app.get("/analytics/channels", response_model=List[ChannelAnalytics])
-def channel_analytics():
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT
-            channel_username,
-            COUNT(*) AS total_messages,
-            AVG(views)::numeric(10,2) AS avg_views,
-            MAX(date) AS last_message_date
-        FROM telegram_messages
-        GROUP BY channel_username
-        ORDER BY total_messages DESC
-    """)
+def fetch_channel_analytics():
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT
+                channel_username,
+                COUNT(*) AS total_messages,
+                AVG(views)::numeric(10,2) AS avg_views,
+                MAX(date)::text AS last_message_date
+            FROM telegram_messages
+            GROUP BY channel_username
+            ORDER BY total_messages DESC
+        """)
+        return cur.fetchall()
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
 
+@app.get("/analytics/channels", response_model=List[ChannelAnalytics])
+def channel_analytics():
+    # Full-table aggregate: served from the cache until the TTL or the next pipeline run
+    rows = analytics_cache.get_or_compute(("channel_analytics",), fetch_channel_analytics)
     return [
         ChannelAnalytics(
             channel_username=row[0],
@@ -173,26 +326,24 @@ def channel_analytics():
         for row in rows
     ]
 
-@app.get("/analytics/image-detections", response_model=List[DetectionAnalytics])
-def detection_analytics():
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT
-            image_category,
-            COUNT(*) AS total_detections,
-            AVG(confidence)::numeric(10,4) AS avg_confidence
-        FROM raw_yolo_json
-        WHERE image_category IS NOT NULL
-        GROUP BY image_category
-        ORDER BY total_detections DESC
-    """)
+def fetch_detection_analytics():
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT
+                image_category,
+                COUNT(*) AS total_detections,
+                AVG(confidence)::numeric(10,4) AS avg_confidence
+            FROM raw_yolo_json
+            WHERE image_category IS NOT NULL
+            GROUP BY image_category
+            ORDER BY total_detections DESC
+        """)
+        return cur.fetchall()
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
 
+@app.get("/analytics/image-detections", response_model=List[DetectionAnalytics])
+def detection_analytics():
+    rows = analytics_cache.get_or_compute(("detection_analytics",), fetch_detection_analytics)
     return [
         DetectionAnalytics(
             image_category=row[0],
@@ -201,3 +352,29 @@ def detection_analytics():
         )
         for row in rows
     ]
+
+
+# ===============================
+# Pool Stats
+# ===============================
+
+@app.get("/pool/stats")
+def pool_stats():
+    return pool.stats()
+
+
+# ===============================
+# Cache Invalidation & Stats
+# ===============================
+
+@app.post("/cache/invalidate")
+def invalidate_cache(name: Optional[str] = None, x_cache_token: Optional[str] = Header(None)):
+    # Called by the pipeline after each successful dbt run
+    if CACHE_TOKEN and x_cache_token != CACHE_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid cache token")
+    return {"invalidated": analytics_cache.invalidate(name)}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return analytics_cache.stats()
@@ -0,0 +1,195 @@
+# src/db_pool.py
+# Thread-safe psycopg2 connection pool for the raw-table API (src/api.py).
+# FastAPI runs sync endpoints on a threadpool, so checkouts block on a Condition.
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """No connection became free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """Keeps between `min_size` and `max_size` open connections.
+
+    - checkout waits up to `timeout` seconds for a free connection, then raises PoolTimeout
+    - a connection idle for more than `check_after` seconds is pinged (SELECT 1) before reuse
+    - idle connections above `min_size` are closed after `max_idle` seconds,
+      and every connection is replaced after `max_lifetime` seconds
+    - connections come back rolled back, so a failed request can't leak an open transaction
+    """
+
+    def __init__(self, min_size=2, max_size=10, timeout=5.0, max_idle=300.0, max_lifetime=3600.0,
+                 check_after=30.0, **connect_kwargs):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.connect_kwargs = connect_kwargs
+
+        self._idle = deque()   # (conn, last_used); right end = most recently returned
+        self._created = {}     # id(conn) -> created_at, for every open connection
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.counters = {
+            "checkouts": 0, "timeouts": 0, "created": 0, "recycled": 0, "failed_checks": 0,
+            "wait_seconds": 0.0,
+        }
+
+    def open(self):
+        for _ in range(self.min_size):
+            conn = self._connect()
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+        return self
+
+    def _connect(self):
+        with self._cond:
+            self._size += 1
+        try:
+            conn = psycopg2.connect(**self.connect_kwargs)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created[id(conn)] = time.monotonic()
+            self.counters["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        # Caller holds the lock
+        self._created.pop(id(conn), None)
+        self._size -= 1
+        self.counters["recycled"] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._cond.notify()
+
+    def _expired(self, conn, now):
+        return now - self._created.get(id(conn), now) > self.max_lifetime
+
+    def _prune(self, now):
+        # Oldest-returned connections sit on the left
+        while self._idle:
+            conn, last_used = self._idle[0]
+            too_idle = now - last_used > self.max_idle and self._size > self.min_size
+            if not (too_idle or self._expired(conn, now) or conn.closed):
+                break
+            self._idle.popleft()
+            self._discard(conn)
+
+    def _healthy(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                candidate = None
+                while candidate is None:
+                    now = time.monotonic()
+                    self._prune(now)
+                    if self._idle:
+                        candidate = self._idle.pop()
+                    elif self._size < self.max_size:
+                        break
+                    else:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            self.counters["timeouts"] += 1
+                            raise PoolTimeout(f"No database connection free after {self.timeout}s "
+                                              f"(pool size {self.max_size})")
+                        self._waiting += 1
+                        try:
+                            self._cond.wait(remaining)
+                        finally:
+                            self._waiting -= 1
+
+            if candidate is None:
+                conn = self._connect()
+            else:
+                conn, last_used = candidate
+                if time.monotonic() - last_used > self.check_after and not self._healthy(conn):
+                    with self._cond:
+                        self.counters["failed_checks"] += 1
+                        self._discard(conn)
+                    continue
+            with self._cond:
+                self.counters["checkouts"] += 1
+                self.counters["wait_seconds"] += time.monotonic() - start
+            return conn
+
+    def putconn(self, conn):
+        with self._cond:
+            if self._closed or conn.closed:
+                self._discard(conn)
+                return
+        try:
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            usable = True
+        except psycopg2.Error:
+            usable = False
+        with self._cond:
+            if usable and not self._expired(conn, time.monotonic()):
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+            else:
+                self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            checkouts = self.counters["checkouts"]
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": checkouts,
+                "timeouts": self.counters["timeouts"],
+                "created": self.counters["created"],
+                "recycled": self.counters["recycled"],
+                "failed_checks": self.counters["failed_checks"],
+                "avg_wait_ms": round(self.counters["wait_seconds"] / checkouts * 1000, 3) if checkouts else 0.0,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._discard(conn)
+            self._cond.notify_all()
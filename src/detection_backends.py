@@ -0,0 +1,173 @@
+# src/detection_backends.py
+# Model backends for the detection engine. A backend turns a list of decoded
+# BGR images into one (detections, result) pair per image, where detections
+# is a list of {"class_id", "confidence", "bbox": [x1, y1, x2, y2]} dicts in
+# original-image pixels and result is the ultralytics Results (or None).
+
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# NMS IoU threshold. ultralytics' predict() default, passed to both backends so they keep
+# the same overlapping boxes.
+IOU_THRESHOLD = 0.7
+
+
+def detections_from_result(result):
+    return [
+        {
+            "class_id": int(box.cls),
+            "confidence": float(box.conf),
+            "bbox": box.xyxy[0].tolist()
+        }
+        for box in result.boxes
+    ]
+
+
+def limit_threads(threads):
+    """Cap the math libraries to `threads` so N worker processes don't oversubscribe the CPU."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    cv2.setNumThreads(1)  # decoding is already parallel across workers
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        pass  # torch missing (ONNX-only install) or interop threads already fixed
+
+
+class UltralyticsBackend:
+    """PyTorch YOLO through ultralytics - the default."""
+
+    name = "ultralytics"
+
+    def __init__(self, weights, conf=0.25, iou=IOU_THRESHOLD, threads=None):
+        from ultralytics import YOLO
+
+        if threads:
+            limit_threads(threads)
+        self.model = YOLO(weights)
+        self.conf = conf
+        self.iou = iou
+
+    def predict(self, images):
+        results = self.model(images, conf=self.conf, iou=self.iou, verbose=False)
+        return [(detections_from_result(result), result) for result in results]
+
+
+class OnnxBackend:
+    """YOLOv8 exported to ONNX, run with ONNX Runtime on CPU.
+
+    Pre/post-processing mirrors ultralytics: letterbox to `imgsz`, then
+    confidence filter and class-aware NMS on the (4 + classes, anchors) output.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path, conf=0.25, iou=IOU_THRESHOLD, imgsz=640, threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            limit_threads(threads)
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), sess_options=options,
+                                            providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Exports without dynamic=True have a fixed batch of 1
+        self.fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+        self.conf = conf
+        self.iou = iou
+        self.imgsz = imgsz
+
+    def letterbox(self, image):
+        height, width = image.shape[:2]
+        ratio = min(self.imgsz / height, self.imgsz / width)
+        new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+        pad_x, pad_y = (self.imgsz - new_w) / 2, (self.imgsz - new_h) / 2
+        resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        canvas = np.full((self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+        top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+        canvas[top:top + new_h, left:left + new_w] = resized
+        blob = canvas[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0  # BGR->RGB, HWC->CHW
+        return blob, ratio, left, top
+
+    def postprocess(self, output, ratio, pad_x, pad_y, shape):
+        predictions = output.T  # (anchors, 4 + classes)
+        scores = predictions[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences >= self.conf
+        if not keep.any():
+            return []
+        boxes, class_ids, confidences = predictions[keep, :4], class_ids[keep], confidences[keep]
+
+        xyxy = np.empty_like(boxes)
+        xyxy[:, 0] = boxes[:, 0] - boxes[:, 2] / 2
+        xyxy[:, 1] = boxes[:, 1] - boxes[:, 3] / 2
+        xyxy[:, 2] = boxes[:, 0] + boxes[:, 2] / 2
+        xyxy[:, 3] = boxes[:, 1] + boxes[:, 3] / 2
+
+        # Class-aware NMS: shift each class into its own region so boxes of different classes never overlap
+        offsets = class_ids[:, None].astype(np.float32) * (self.imgsz * 2)
+        shifted = xyxy + offsets
+        rects = np.column_stack([shifted[:, :2], shifted[:, 2:] - shifted[:, :2]]).tolist()
+        kept = cv2.dnn.NMSBoxes(rects, confidences.tolist(), self.conf, self.iou)
+        kept = np.array(kept).flatten()
+
+        height, width = shape
+        detections = []
+        for i in kept[np.argsort(-confidences[kept])]:
+            x1, y1, x2, y2 = xyxy[i]
+            detections.append({
+                "class_id": int(class_ids[i]),
+                "confidence": float(confidences[i]),
+                "bbox": [
+                    float(np.clip((x1 - pad_x) / ratio, 0, width)),
+                    float(np.clip((y1 - pad_y) / ratio, 0, height)),
+                    float(np.clip((x2 - pad_x) / ratio, 0, width)),
+                    float(np.clip((y2 - pad_y) / ratio, 0, height)),
+                ],
+            })
+        return detections
+
+    def predict(self, images):
+        prepared = [self.letterbox(image) for image in images]
+        step = self.fixed_batch or len(prepared)
+        outputs = []
+        for start in range(0, len(prepared), step):
+            blob = np.stack([p[0] for p in prepared[start:start + step]])
+            outputs.extend(self.session.run(None, {self.input_name: blob})[0])
+        return [
+            (self.postprocess(output, ratio, pad_x, pad_y, image.shape[:2]), None)
+            for output, (_, ratio, pad_x, pad_y), image in zip(outputs, prepared, images)
+        ]
+
+
+def onnx_path_for(weights, imgsz=640):
+    """The .onnx next to the .pt weights, exported once with ultralytics if missing."""
+    weights = Path(weights)
+    if weights.suffix == ".onnx":
+        return weights
+    onnx_path = weights.with_suffix(".onnx")
+    if not onnx_path.exists():
+        from ultralytics import YOLO
+
+        print(f"Exporting {weights} to ONNX...")
+        onnx_path = Path(YOLO(str(weights)).export(format="onnx", imgsz=imgsz, dynamic=True))
+    return onnx_path
+
+
+def create_backend(name, weights, conf=0.25, threads=None, imgsz=640, iou=IOU_THRESHOLD):
+    if name == "onnx":
+        return OnnxBackend(onnx_path_for(weights, imgsz), conf=conf, iou=iou, imgsz=imgsz, threads=threads)
+    if name == "ultralytics":
+        return UltralyticsBackend(weights, conf=conf, iou=iou, threads=threads)
+    raise ValueError(f"Unknown detection backend: {name!r} (expected 'ultralytics' or 'onnx')")
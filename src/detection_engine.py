@@ -0,0 +1,290 @@
+# src/detection_engine.py
+# Single-pass YOLO detection: every image goes through the model once and the
+# result is handed to each sink (prediction files, annotated images, Postgres...).
+# DetectionEngine runs in-process; ShardedDetectionEngine spreads shards over worker processes.
+
+import os
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import islice
+from pathlib import Path
+
+import cv2
+
+IMAGE_ROOT = Path("data/raw/images")
+
+
+class ImageResult:
+    """What a sink receives for one image.
+
+    `detections` is a list of {"class_id", "confidence", "bbox"} dicts.
+    `image` (decoded BGR array) is only set when the image was decoded in this
+    process, `result` (ultralytics Results) only when the ultralytics backend ran it here. `source_path` is
+    the file the result was read from (the image, or a prediction file).
+    """
+
+    def __init__(self, channel_name, img_path, detections, image=None, result=None, source_path=None):
+        self.channel_name = channel_name
+        self.img_path = Path(img_path)
+        self.detections = detections
+        self.image = image
+        self.result = result
+        self.source_path = Path(source_path) if source_path else self.img_path
+
+    @property
+    def file_name(self):
+        return self.img_path.name
+
+    @property
+    def message_id(self):
+        # Images are saved as <message_id>.jpg (or <prefix>_<message_id>.jpg)
+        return int(self.img_path.stem.split("_")[-1])
+
+
+def list_images(image_root=IMAGE_ROOT, channels=None):
+    for channel_dir in sorted(Path(image_root).iterdir()):
+        if not channel_dir.is_dir():
+            continue
+        if channels and channel_dir.name not in channels:
+            continue
+        for img_path in sorted(channel_dir.glob("*.jpg")):
+            yield channel_dir.name, img_path
+
+
+def decode_image(item):
+    channel_name, img_path = item
+    return channel_name, img_path, cv2.imread(str(img_path))  # BGR, as ultralytics expects
+
+
+def prefetch_decoded(items, workers, lookahead):
+    # Reads and decodes run in a thread pool while the model works on the previous batch.
+    # At most `lookahead` images are in flight, so memory stays bounded.
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(decode_image, item))
+            if len(pending) >= lookahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batched(decoded, batch_size):
+    batch = []
+    for channel_name, img_path, image in decoded:
+        if image is None:
+            print(f"Skipping unreadable image: {img_path}")
+            continue
+        batch.append((channel_name, img_path, image))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class DetectionEngine:
+    """Runs a backend (see detection_backends) over decoded batches and hands each image to the sinks."""
+
+    def __init__(self, backend, sinks, batch_size=16, decode_workers=4, prefetch_batches=2, cache=None):
+        self.backend = backend
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.prefetch_batches = prefetch_batches
+        self.cache = cache  # optional phash_cache.PerceptualHashCache
+        self.cache_hits = 0
+        self.inferred = 0
+        self.inference_seconds = 0.0
+
+    def emit(self, image_result):
+        for sink in self.sinks:
+            sink.handle(image_result)
+
+    def skip_cached(self, decoded):
+        # Near-duplicates of images we already ran are answered from the cache and never batched
+        for channel_name, img_path, image in decoded:
+            if image is not None and self.cache is not None:
+                detections = self.cache.lookup(image)
+                if detections is not None:
+                    self.cache_hits += 1
+                    self.emit(ImageResult(channel_name, img_path, detections, image=image))
+                    continue
+            yield channel_name, img_path, image
+
+    def process(self, items, progress=True):
+        """Detect and emit every item; sinks stay open."""
+        start_time = time.perf_counter()
+        decoded = prefetch_decoded(items, self.decode_workers, self.batch_size * self.prefetch_batches)
+        for batch in batched(self.skip_cached(decoded), self.batch_size):
+            t0 = time.perf_counter()
+            outputs = self.backend.predict([image for _, _, image in batch])
+            self.inference_seconds += time.perf_counter() - t0
+
+            for (channel_name, img_path, image), (detections, result) in zip(batch, outputs):
+                if self.cache is not None:
+                    self.cache.store(image, detections)
+                self.emit(ImageResult(channel_name, img_path, detections, image=image, result=result))
+
+            self.inferred += len(batch)
+            if progress:
+                processed = self.inferred + self.cache_hits
+                elapsed = time.perf_counter() - start_time
+                print(f"Processed {processed} images ({processed / elapsed:.1f} img/s, "
+                      f"{self.cache_hits} from cache)")
+
+    def run(self, items):
+        start_time = time.perf_counter()
+        try:
+            self.process(items)
+        finally:
+            for sink in self.sinks:
+                sink.close()
+            if self.cache is not None:
+                self.cache.save()
+        return run_stats(self.inferred, self.cache_hits, time.perf_counter() - start_time,
+                         self.inference_seconds)
+
+
+def run_stats(inferred, cache_hits, elapsed, inference_seconds, workers=1):
+    processed = inferred + cache_hits
+    return {
+        "images": processed,
+        "inferred": inferred,
+        "cache_hits": cache_hits,
+        "cache_hit_rate": round(cache_hits / processed, 4) if processed else 0.0,
+        "elapsed_seconds": round(elapsed, 2),
+        "images_per_second": round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+        # inference_seconds is summed over workers running side by side
+        "model_images_per_second": round(inferred * workers / inference_seconds, 2) if inference_seconds > 0 else 0.0,
+    }
+
+
+# ----------------------------
+# Process-pool mode: one backend per worker process
+# ----------------------------
+class _Collector:
+    def __init__(self):
+        self.results = []
+
+    def handle(self, image_result):
+        self.results.append((image_result.channel_name, str(image_result.img_path), image_result.detections))
+
+    def close(self):
+        pass
+
+
+_worker_engine = None
+
+
+def _init_worker(backend_name, weights, conf, iou, imgsz, threads, batch_size, cache_config):
+    global _worker_engine
+    from detection_backends import create_backend
+    from phash_cache import PerceptualHashCache
+
+    backend = create_backend(backend_name, weights, conf=conf, threads=threads, imgsz=imgsz, iou=iou)
+    cache = PerceptualHashCache(*cache_config, track_new=True) if cache_config else None
+    # Decoding threads mostly wait on disk; the backend gets the worker's CPU share
+    _worker_engine = DetectionEngine(backend, [_Collector()], batch_size=batch_size,
+                                     decode_workers=2, prefetch_batches=2, cache=cache)
+
+
+def _detect_shard(shard):
+    engine = _worker_engine
+    collector = engine.sinks[0]
+    collector.results = []
+    inferred, hits, seconds = engine.inferred, engine.cache_hits, engine.inference_seconds
+    engine.process(shard, progress=False)
+    return {
+        "results": collector.results,
+        "inferred": engine.inferred - inferred,
+        "cache_hits": engine.cache_hits - hits,
+        "inference_seconds": engine.inference_seconds - seconds,
+        "new_cache_entries": engine.cache.drain_new() if engine.cache is not None else [],
+    }
+
+
+class ShardedDetectionEngine:
+    """Splits the images into shards and runs them on a pool of worker processes.
+
+    Each worker loads its own backend, limited to `threads_per_worker` threads
+    (default: cores / workers) so the processes don't oversubscribe the CPU.
+    Workers return detections only; the sinks run here, in the parent, and get
+    ImageResults without a decoded image (annotated images are re-read from disk).
+    New perceptual-hash cache entries from the workers are merged into `cache`.
+    """
+
+    def __init__(self, backend_name, weights, sinks, conf=0.25, workers=None, threads_per_worker=None,
+                 batch_size=16, shard_size=None, imgsz=640, cache=None, iou=0.7):
+        self.backend_name = backend_name
+        self.weights = weights
+        self.sinks = sinks
+        self.conf = conf
+        self.iou = iou
+        self.workers = workers or os.cpu_count() or 1
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.batch_size = batch_size
+        self.shard_size = shard_size or batch_size * 4
+        self.imgsz = imgsz
+        self.cache = cache
+
+    def shards(self, items):
+        shard = []
+        for item in items:
+            shard.append(item)
+            if len(shard) == self.shard_size:
+                yield shard
+                shard = []
+        if shard:
+            yield shard
+
+    def run(self, items):
+        inferred = cache_hits = 0
+        inference_seconds = 0.0
+        start_time = time.perf_counter()
+        cache_config = None
+        if self.cache is not None:
+            cache_config = (self.cache.path, self.cache.signature, self.cache.max_entries, self.cache.max_distance)
+        initargs = (self.backend_name, self.weights, self.conf, self.iou, self.imgsz, self.threads_per_worker,
+                    self.batch_size, cache_config)
+        print(f"Running {self.backend_name} on {self.workers} worker processes "
+              f"x {self.threads_per_worker} threads")
+
+        # spawn: a forked copy of a parent that already loaded torch/cv2 thread pools can deadlock
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=initargs)
+        try:
+            shards = self.shards(items)
+            pending = set()
+            while True:
+                # Keep two shards per worker in flight so results stream back without queueing the whole set
+                for shard in islice(shards, self.workers * 2 - len(pending)):
+                    pending.add(pool.submit(_detect_shard, shard))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard_result = future.result()
+                    for channel_name, img_path, detections in shard_result["results"]:
+                        for sink in self.sinks:
+                            sink.handle(ImageResult(channel_name, img_path, detections))
+                    if self.cache is not None:
+                        self.cache.merge(shard_result["new_cache_entries"])
+                    inferred += shard_result["inferred"]
+                    cache_hits += shard_result["cache_hits"]
+                    inference_seconds += shard_result["inference_seconds"]
+
+                processed = inferred + cache_hits
+                elapsed = time.perf_counter() - start_time
+                print(f"Processed {processed} images ({processed / elapsed:.1f} img/s, "
+                      f"{cache_hits} from cache)")
+        finally:
+            pool.shutdown(cancel_futures=True)
+            for sink in self.sinks:
+                sink.close()
+            if self.cache is not None:
+                self.cache.save()
+        return run_stats(inferred, cache_hits, time.perf_counter() - start_time, inference_seconds,
+                         workers=self.workers)
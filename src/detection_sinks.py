@@ -0,0 +1,340 @@
+# src/detection_sinks.py
+# Where detection results go. Each sink has handle(image_result) and close().
+
+import json
+import queue
+import threading
+import zlib
+from pathlib import Path
+
+import cv2
+from psycopg2.extras import execute_values
+
+from detection_engine import ImageResult
+
+# Image category: placeholder until we have logic based on class_id
+DEFAULT_IMAGE_CATEGORY = "product_display"
+
+
+class WrittenBytes:
+    """Bytes a sink wrote, per channel. Sinks may run on several BackgroundWriter threads."""
+
+    def __init__(self):
+        self.by_channel = {}
+        self._lock = threading.Lock()
+
+    def add(self, channel, size):
+        with self._lock:
+            self.by_channel[channel] = self.by_channel.get(channel, 0) + size
+
+    @property
+    def total(self):
+        return sum(self.by_channel.values())
+
+
+def add_bytes_written(tracker, sinks):
+    """Report what the sinks (and the sinks inside BackgroundWriters) wrote to a StageTracker."""
+    for sink in sinks:
+        if isinstance(sink, BackgroundWriter):
+            add_bytes_written(tracker, sink.sinks)
+        elif getattr(sink, "written", None) is not None:
+            for channel, size in sink.written.by_channel.items():
+                tracker.add(bytes_written=size, channel=channel)
+
+
+class PredictionFileSink:
+    """output/yolo/predictions/<channel>_<image stem>.json - a list of detections (compact JSON)."""
+
+    def __init__(self, pred_dir):
+        self.pred_dir = Path(pred_dir)
+        self.pred_dir.mkdir(parents=True, exist_ok=True)
+        self.written = WrittenBytes()
+
+    def handle(self, image_result):
+        pred_file = self.pred_dir / f"{image_result.channel_name}_{image_result.img_path.stem}.json"
+        payload = json.dumps(image_result.detections, separators=(",", ":"))
+        with open(pred_file, "w") as f:
+            f.write(payload)
+        self.written.add(image_result.channel_name, len(payload))
+
+    def close(self):
+        pass
+
+
+def draw_detections(image, detections):
+    canvas = image.copy()
+    for det in detections:
+        x1, y1, x2, y2 = (int(v) for v in det["bbox"])
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(canvas, f"{det['class_id']} {det['confidence']:.2f}", (x1, max(y1 - 4, 10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+    return canvas
+
+
+class AnnotatedImageSink:
+    """output/yolo/annotated/<channel>_<image name> with the detected boxes drawn.
+
+    `sample_rate` < 1 renders only that fraction of images. The choice is a
+    hash of the file name, so reruns annotate the same images.
+    """
+
+    def __init__(self, annotated_dir, sample_rate=1.0):
+        self.annotated_dir = Path(annotated_dir)
+        self.annotated_dir.mkdir(parents=True, exist_ok=True)
+        self.sample_rate = sample_rate
+        self.written = WrittenBytes()
+
+    def selected(self, image_result):
+        if self.sample_rate >= 1.0:
+            return True
+        key = f"{image_result.channel_name}/{image_result.file_name}".encode("utf-8")
+        return zlib.crc32(key) % 10_000 < self.sample_rate * 10_000
+
+    def handle(self, image_result):
+        if not self.selected(image_result):
+            return
+        annotated_path = self.annotated_dir / f"{image_result.channel_name}_{image_result.file_name}"
+        if image_result.result is not None:
+            image_result.result.save(filename=str(annotated_path))
+        else:
+            # Cache hit, ONNX backend or worker process: no ultralytics result, draw the boxes ourselves
+            image = image_result.image
+            if image is None and image_result.img_path.exists():
+                image = cv2.imread(str(image_result.img_path))
+            if image is None:
+                return
+            cv2.imwrite(str(annotated_path), draw_detections(image, image_result.detections))
+        self.written.add(image_result.channel_name, annotated_path.stat().st_size)
+
+    def close(self):
+        pass
+
+
+class BackgroundWriter:
+    """Runs the wrapped sinks on writer threads fed by a bounded queue.
+
+    The inference loop only pays for a queue put; JPEG encoding and file
+    writes happen off the main thread. For each image the wrapped sinks run
+    in order on one thread, so a ManifestSink placed last still marks an
+    image only after its files exist. When the queue is full, handle()
+    blocks, which bounds memory. Writer errors are re-raised in the caller.
+    """
+
+    def __init__(self, sinks, max_queue=64, threads=1):
+        self.sinks = sinks
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            image_result = self.queue.get()
+            try:
+                if image_result is None:
+                    return
+                if self.error is None:
+                    for sink in self.sinks:
+                        sink.handle(image_result)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def handle(self, image_result):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(image_result)
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        for sink in self.sinks:
+            sink.close()
+        if self.error is not None:
+            raise self.error
+
+
+RAW_YOLO_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS raw_yolo_json (
+    id              BIGSERIAL PRIMARY KEY,
+    message_id      BIGINT,
+    class_id        INTEGER,
+    confidence      DOUBLE PRECISION,
+    bbox            TEXT,
+    channel_name    TEXT,
+    image_category  TEXT,
+    file_name       TEXT,
+    box_index       INTEGER,
+    loaded_at       TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+ALTER TABLE raw_yolo_json ADD COLUMN IF NOT EXISTS id BIGSERIAL;
+ALTER TABLE raw_yolo_json ADD COLUMN IF NOT EXISTS box_index INTEGER;
+ALTER TABLE raw_yolo_json ADD COLUMN IF NOT EXISTS loaded_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+-- Rows from the old one-insert-per-box loader have no box_index: number them once
+UPDATE raw_yolo_json r
+SET box_index = n.box_index
+FROM (
+    SELECT ctid, ROW_NUMBER() OVER (PARTITION BY channel_name, file_name ORDER BY ctid) - 1 AS box_index
+    FROM raw_yolo_json
+    WHERE box_index IS NULL
+) n
+WHERE r.ctid = n.ctid;
+
+-- file names are <message_id>.jpg, which repeat across channels, so the channel is part of the key
+CREATE UNIQUE INDEX IF NOT EXISTS raw_yolo_json_image_box_uidx
+    ON raw_yolo_json (channel_name, file_name, box_index);
+
+-- Incremental dbt runs read only rows loaded since the last run
+CREATE INDEX IF NOT EXISTS raw_yolo_json_loaded_at_idx
+    ON raw_yolo_json (loaded_at);
+
+-- Keyset pagination of GET /image-detections (highest confidence first)
+CREATE INDEX IF NOT EXISTS raw_yolo_json_confidence_idx
+    ON raw_yolo_json (confidence, id);
+
+-- One marker per image, bumped whenever its detections are replaced. An image re-detected
+-- with no boxes has no raw_yolo_json rows left; its marker tells dbt to drop the old ones.
+CREATE TABLE IF NOT EXISTS raw_yolo_images (
+    channel_name    TEXT        NOT NULL,
+    file_name       TEXT        NOT NULL,
+    box_count       INTEGER     NOT NULL,
+    loaded_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (channel_name, file_name)
+);
+CREATE INDEX IF NOT EXISTS raw_yolo_images_loaded_at_idx
+    ON raw_yolo_images (loaded_at);
+"""
+
+UPSERT_SQL = """
+INSERT INTO raw_yolo_json (
+    message_id, class_id, confidence, bbox, channel_name, image_category, file_name, box_index
+) VALUES %s
+ON CONFLICT (channel_name, file_name, box_index) DO UPDATE SET
+    message_id = EXCLUDED.message_id,
+    class_id = EXCLUDED.class_id,
+    confidence = EXCLUDED.confidence,
+    bbox = EXCLUDED.bbox,
+    image_category = EXCLUDED.image_category,
+    loaded_at = now()
+RETURNING channel_name, pg_column_size(raw_yolo_json.*)
+"""
+
+# A re-detected image may now have fewer boxes: drop the leftovers
+DELETE_STALE_SQL = """
+DELETE FROM raw_yolo_json r
+USING (VALUES %s) AS v (channel_name, file_name, box_count)
+WHERE r.channel_name = v.channel_name
+  AND r.file_name = v.file_name
+  AND r.box_index >= v.box_count
+"""
+
+MARK_IMAGES_SQL = """
+INSERT INTO raw_yolo_images (channel_name, file_name, box_count) VALUES %s
+ON CONFLICT (channel_name, file_name) DO UPDATE SET
+    box_count = EXCLUDED.box_count,
+    loaded_at = now()
+"""
+
+
+def ensure_raw_yolo_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute(RAW_YOLO_SCHEMA_SQL)
+    conn.commit()
+
+
+class PostgresSink:
+    """Buffers raw_yolo_json rows and writes them with multi-row upserts.
+
+    Each flush is one transaction covering whole images, keyed on
+    (channel_name, file_name, box_index), so reruns update rows instead of
+    duplicating them; every image also gets its raw_yolo_images marker.
+    `on_commit(source_paths)` runs after each commit.
+    Safe to use from several BackgroundWriter threads.
+    """
+
+    def __init__(self, conn, image_category=DEFAULT_IMAGE_CATEGORY, batch_size=5000, on_commit=None):
+        self.conn = conn
+        self.on_commit = on_commit
+        self.image_category = image_category
+        self.batch_size = batch_size
+        self.rows = 0
+        self.images = 0
+        self.batches = 0
+        self.written = WrittenBytes()  # row data upserted, per channel
+        self._rows = []
+        self._images = []
+        self._sources = []
+        self._lock = threading.RLock()
+        ensure_raw_yolo_schema(conn)
+
+    def handle(self, image_result):
+        with self._lock:
+            self._handle(image_result)
+
+    def _handle(self, image_result):
+        for box_index, det in enumerate(image_result.detections):
+            self._rows.append((
+                image_result.message_id,
+                det["class_id"],
+                det["confidence"],
+                json.dumps(det["bbox"]),  # store as text
+                image_result.channel_name,
+                self.image_category,
+                image_result.file_name,
+                box_index
+            ))
+        self._images.append((image_result.channel_name, image_result.file_name,
+                             len(image_result.detections)))
+        self._sources.append(image_result.source_path)
+        if len(self._rows) >= self.batch_size or len(self._images) >= self.batch_size:
+            self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._images:
+            return
+        with self.conn.cursor() as cur:
+            written = []
+            if self._rows:
+                written = execute_values(cur, UPSERT_SQL, self._rows, page_size=self.batch_size, fetch=True)
+            execute_values(cur, DELETE_STALE_SQL, self._images, page_size=self.batch_size)
+            execute_values(cur, MARK_IMAGES_SQL, self._images, page_size=self.batch_size)
+        self.conn.commit()
+        for channel, size in written:
+            self.written.add(channel, size)
+        if self.on_commit:
+            self.on_commit(self._sources)
+        self.rows += len(self._rows)
+        self.images += len(self._images)
+        self.batches += 1
+        self._rows = []
+        self._images = []
+        self._sources = []
+
+    def close(self):
+        self.flush()
+
+
+def iter_prediction_files(pred_dir, channels=None, include=None):
+    """Rebuild ImageResults from existing prediction files, without touching the model.
+
+    `include(pred_file)` can filter files, e.g. EnrichmentManifest.needs_processing.
+    """
+    for pred_file in sorted(Path(pred_dir).glob("*.json")):
+        # <channel>_<image stem>.json; channel names may themselves contain "_"
+        channel_name, _, stem = pred_file.stem.rpartition("_")
+        if not channel_name or (channels and channel_name not in channels):
+            continue
+        if include and not include(pred_file):
+            continue
+        with open(pred_file, encoding="utf-8") as f:
+            detections = json.load(f)
+        yield ImageResult(channel_name, f"{stem}.jpg", detections, source_path=pred_file)
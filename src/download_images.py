@@ -3,15 +3,24 @@ import os
 import json
 import asyncio
 import time
+import hashlib
+import shutil
 import logging
+import itertools
 from dotenv import load_dotenv
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+from rate_limiter import TokenBucket
+from scrape_state import ScrapeState
+from instrumentation import StageTracker
+from file_lock import locked
 
 # ----------------------------
 # Load environment variables
 # ----------------------------
 load_dotenv()
-API_ID = int(os.getenv("API_ID"))
+API_ID = os.getenv("API_ID")  # converted when the client is created, so importing needs no credentials
 API_HASH = os.getenv("API_HASH")
 PHONE = os.getenv("PHONE")
 
@@ -24,12 +33,33 @@ CHANNELS = [
     "tikvahpharma"
 ]
 
-MAX_IMAGES_PER_CHANNEL = 200  # ✅ SAFE & GRADED
+# Optional per-channel cap (0 = no cap). The run is bounded by the budget below instead.
+MAX_IMAGES_PER_CHANNEL = int(os.getenv("MAX_IMAGES_PER_CHANNEL", "0"))
+
+# Throughput budget for one run: stop queueing new downloads once either is spent (0 = unlimited)
+DOWNLOAD_BUDGET_SECONDS = float(os.getenv("DOWNLOAD_BUDGET_SECONDS", "900"))
+DOWNLOAD_BUDGET_MB = float(os.getenv("DOWNLOAD_BUDGET_MB", "0"))
+
+# Worker pool shared by all channels, and the shared Telegram request rate
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+DOWNLOAD_REQUESTS_PER_SECOND = float(os.getenv("DOWNLOAD_REQUESTS_PER_SECOND", "5"))
+MAX_FLOOD_RETRIES = 5
 
 BASE_IMAGE_DIR = "data/raw/images"
 RAW_JSON_DIR = "data/raw/telegram_messages"
 LOG_FILE = "logs/image_download.log"
 
+# photo id / content hash -> file, used to skip and dedupe downloads across channels and runs
+INDEX_PATH = os.path.join(BASE_IMAGE_DIR, "_download_index.json")
+INDEX_SAVE_EVERY = 50
+
+# Per-channel scan marks, as the scraper keeps them: history between oldest_message_id and
+# last_message_id is fully handled, so a run only scans newer messages and resumes older history
+SCAN_STATE_PATH = os.path.join(BASE_IMAGE_DIR, "_scan_state.json")
+
+# History is requested in pages of this many messages (one API request, one limiter token each)
+HISTORY_PAGE_SIZE = 100
+
 # ----------------------------
 # Setup folders
 # ----------------------------
@@ -40,72 +70,330 @@ os.makedirs("logs", exist_ok=True)
 # ----------------------------
 # Logging
 # ----------------------------
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+# A logger of its own: the pipeline imports this module, and the root logger belongs to the host process
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    _file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8", delay=True)
+    _file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(_file_handler)
 
 # ----------------------------
-# Telegram Client
+# Download index (dedupe + resume)
 # ----------------------------
-client = TelegramClient(PHONE, API_ID, API_HASH)
+class DownloadIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.photos = {}   # str(telegram photo id) -> {"path", "sha256", "size"}
+        self.hashes = {}   # sha256 -> first path stored with that content
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.photos = data.get("photos", {})
+            self.hashes = data.get("hashes", {})
+        self._dirty = 0
 
+    def existing_path_for_photo(self, photo_id):
+        entry = self.photos.get(str(photo_id))
+        if entry and os.path.exists(entry["path"]):
+            return entry["path"]
+        return None
 
-async def scrape_channel(channel):
-    logging.info(f"Start channel: {channel}")
-    print(f"Scraping @{channel}...")
+    def existing_path_for_hash(self, sha256):
+        path = self.hashes.get(sha256)
+        if path and os.path.exists(path):
+            return path
+        return None
 
-    image_count = 0
-    messages = []
-    start_time = time.time()
+    def add(self, photo_id, path, sha256, size):
+        self.photos[str(photo_id)] = {"path": path, "sha256": sha256, "size": size}
+        self.hashes.setdefault(sha256, path)
+        self._dirty += 1
+        if self._dirty >= INDEX_SAVE_EVERY:
+            self.save()
 
-    async for msg in client.iter_messages(channel):
-        if image_count >= MAX_IMAGES_PER_CHANNEL:
-            break
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"photos": self.photos, "hashes": self.hashes}, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = 0
 
-        if not msg.photo:
-            continue
 
-        channel_dir = os.path.join(BASE_IMAGE_DIR, channel)
-        os.makedirs(channel_dir, exist_ok=True)
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 
-        image_path = os.path.join(channel_dir, f"{msg.id}.jpg")
-        await msg.download_media(file=image_path)
+def link_or_copy(src, dst):
+    # Hard links keep one copy on disk; fall back to a copy across filesystems
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
-        messages.append({
+
+# ----------------------------
+# Download engine
+# ----------------------------
+class Budget:
+    def __init__(self, seconds, megabytes):
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.max_bytes = megabytes * 1024 * 1024 if megabytes else None
+        self.bytes_downloaded = 0
+
+    def exhausted(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return self.max_bytes is not None and self.bytes_downloaded >= self.max_bytes
+
+
+class DownloadEngine:
+    def __init__(self, client, index, scan_state, workers=DOWNLOAD_WORKERS):
+        self.client = client
+        self.index = index
+        self.scan_state = scan_state
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=workers * 4)
+        self.limiter = TokenBucket(DOWNLOAD_REQUESTS_PER_SECOND)
+        self.budget = Budget(DOWNLOAD_BUDGET_SECONDS, DOWNLOAD_BUDGET_MB)
+        self.metadata = {}  # channel -> {message id: record}
+        self.stats = {}
+        self.scans = {}       # channel -> history passes of this run
+        self.downloaded = {}  # channel -> ids of queued messages whose image landed
+
+    def channel_stats(self, channel):
+        return self.stats.setdefault(channel, {
+            "downloaded": 0, "skipped_existing": 0, "deduped_photo_id": 0,
+            "deduped_content": 0, "failed": 0, "bytes": 0, "photos_seen": 0
+        })
+
+    def record(self, channel, msg, image_path):
+        # Only for images that are on disk, so every metadata row points at a real file
+        self.metadata.setdefault(channel, {})[msg.id] = {
             "id": msg.id,
             "date": msg.date.isoformat() if msg.date else None,
             "text": msg.message,
             "image_path": image_path
-        })
+        }
+
+    async def history(self, channel, entity, offset_id, reverse):
+        # Pages of history after offset_id (reverse: oldest-first above it, else newest-first
+        # below it), one limiter token per page request
+        flood_retries = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                page = [msg async for msg in self.client.iter_messages(
+                    entity, limit=HISTORY_PAGE_SIZE, offset_id=offset_id, reverse=reverse, wait_time=0)]
+            except FloodWaitError as e:
+                flood_retries += 1
+                if flood_retries > MAX_FLOOD_RETRIES:
+                    raise
+                logger.warning(f"{channel}: FloodWait {e.seconds}s on history after id {offset_id}")
+                self.limiter.pause(e.seconds)
+                await asyncio.sleep(e.seconds)
+                continue
+            flood_retries = 0
+            for msg in page:
+                yield msg
+            if len(page) < HISTORY_PAGE_SIZE:
+                return
+            offset_id = page[-1].id
 
-        image_count += 1
+    async def scan(self, channel, entity, offset_id=0, reverse=False):
+        """One pass over the channel's history; returns the messages it handled or queued, in order."""
+        stats = self.channel_stats(channel)
+        channel_dir = os.path.join(BASE_IMAGE_DIR, channel)
+        os.makedirs(channel_dir, exist_ok=True)
+        scan = {"older": not reverse, "messages": [], "queued": set(), "complete": False}
+        self.scans.setdefault(channel, []).append(scan)
+
+        async for msg in self.history(channel, entity, offset_id, reverse):
+            if self.budget.exhausted():
+                logger.info(f"{channel}: budget exhausted, stopping scan")
+                return scan
+            if msg.photo and MAX_IMAGES_PER_CHANNEL and stats["photos_seen"] >= MAX_IMAGES_PER_CHANNEL:
+                return scan
+            scan["messages"].append({"message_id": msg.id,
+                                     "date": msg.date.isoformat() if msg.date else None})
+            if not msg.photo:
+                continue
+            stats["photos_seen"] += 1
+
+            image_path = os.path.join(channel_dir, f"{msg.id}.jpg")
+
+            # Already on disk from a previous (possibly interrupted) run
+            if os.path.exists(image_path) and os.path.getsize(image_path) > 0:
+                self.record(channel, msg, image_path)
+                stats["skipped_existing"] += 1
+                continue
+
+            # Same Telegram photo already downloaded for another message/channel
+            existing = self.index.existing_path_for_photo(msg.photo.id)
+            if existing:
+                link_or_copy(existing, image_path)
+                self.record(channel, msg, image_path)
+                stats["deduped_photo_id"] += 1
+                continue
 
-        if image_count % 20 == 0:
-            logging.info(f"{channel}: {image_count} images downloaded")
+            scan["queued"].add(msg.id)
+            await self.queue.put((channel, msg, image_path))
+        scan["complete"] = True
+        return scan
 
-    # Write metadata
-    json_path = os.path.join(RAW_JSON_DIR, f"{channel}.json")
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(messages, f, ensure_ascii=False, indent=2)
+    async def produce(self, channel):
+        logger.info(f"Start channel: {channel}")
+        state = self.scan_state.get(channel)
+        await self.limiter.acquire()
+        entity = await self.client.get_entity(channel)
 
-    elapsed = time.time() - start_time
-    logging.info(f"Completed {channel}: {image_count} images in {elapsed:.2f}s")
-    print(f"Completed @{channel}: {image_count} images")
+        # New messages first, oldest-first above the mark, then older history below the scanned range
+        if state.get("last_message_id"):
+            print(f"Scanning @{channel} after id {state['last_message_id']}...")
+            await self.scan(channel, entity, offset_id=state["last_message_id"], reverse=True)
+        if not state.get("backfill_complete") and not self.budget.exhausted():
+            offset_id = state.get("oldest_message_id", 0)
+            print(f"Scanning @{channel} below id {offset_id or 'newest'}...")
+            await self.scan(channel, entity, offset_id=offset_id)
 
+    def advance_scan_state(self):
+        # Marks move over the messages of each pass up to the first queued image that did not land
+        # (budget ran out, download failed), so the next run picks up exactly there
+        for channel, scans in self.scans.items():
+            downloaded = self.downloaded.get(channel, set())
+            for scan in scans:
+                unfinished = scan["queued"] - downloaded
+                handled = list(itertools.takewhile(lambda m: m["message_id"] not in unfinished,
+                                                   scan["messages"]))
+                history_done = scan["older"] and scan["complete"] and len(handled) == len(scan["messages"])
+                self.scan_state.advance(channel, handled, backfill_complete=True if history_done else None)
+        self.scan_state.save()
 
-async def main():
-    async with client:
-        print("Signed in successfully!")
-        for channel in CHANNELS:
+    async def download(self, channel, msg, image_path):
+        stats = self.channel_stats(channel)
+        part_path = image_path + ".part"
+        for attempt in range(MAX_FLOOD_RETRIES + 1):
+            await self.limiter.acquire()
             try:
-                await scrape_channel(channel)
+                await msg.download_media(file=part_path)
+                break
+            except FloodWaitError as e:
+                if attempt == MAX_FLOOD_RETRIES:
+                    raise
+                logger.warning(f"{channel}: FloodWait {e.seconds}s on message {msg.id}")
+                self.limiter.pause(e.seconds)
+                await asyncio.sleep(e.seconds)
+
+        # Hash off the event loop so other downloads keep flowing
+        sha256 = await asyncio.to_thread(file_sha256, part_path)
+        size = os.path.getsize(part_path)
+        duplicate = self.index.existing_path_for_hash(sha256)
+        if duplicate:
+            os.remove(part_path)
+            link_or_copy(duplicate, image_path)
+            stats["deduped_content"] += 1
+        else:
+            os.replace(part_path, image_path)  # only complete files get the final name
+        self.index.add(msg.photo.id, image_path, sha256, size)
+        self.record(channel, msg, image_path)
+        self.downloaded.setdefault(channel, set()).add(msg.id)
+
+        self.budget.bytes_downloaded += size
+        stats["downloaded"] += 1
+        stats["bytes"] += size
+        if stats["downloaded"] % 20 == 0:
+            logger.info(f"{channel}: {stats['downloaded']} images downloaded")
+
+    async def worker(self):
+        while True:
+            channel, msg, image_path = await self.queue.get()
+            try:
+                if not self.budget.exhausted():
+                    await self.download(channel, msg, image_path)
             except Exception as e:
-                logging.error(f"Error in {channel}: {e}")
+                self.channel_stats(channel)["failed"] += 1
+                logger.error(f"{channel}: failed message {msg.id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def run(self, channels):
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+        async def produce_safely(channel):
+            try:
+                await self.produce(channel)
+            except Exception as e:
+                logger.error(f"Error in {channel}: {e}")
                 print(f"Error in @{channel}: {e}")
 
+        await asyncio.gather(*(produce_safely(channel) for channel in channels))
+        await self.queue.join()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self.index.save()
+        self.advance_scan_state()
+
+    def write_metadata(self):
+        # Merge with metadata from earlier runs so resumed runs keep everything
+        for channel, records in self.metadata.items():
+            json_path = os.path.join(RAW_JSON_DIR, f"{channel}.json")
+            merged = {}
+            if os.path.exists(json_path):
+                with open(json_path, encoding="utf-8") as f:
+                    merged = {m["id"]: m for m in json.load(f)}
+            merged.update(records)
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(sorted(merged.values(), key=lambda m: m["id"], reverse=True),
+                          f, ensure_ascii=False, indent=2)
+
+
+async def main(channels=None):
+    # channels: download only these channels (default: all of CHANNELS)
+    channels = channels or CHANNELS
+    # One run at a time per download index and Telegram session, whatever the orchestrator allows
+    with locked(INDEX_PATH, SCAN_STATE_PATH, f"{PHONE}.session"):
+        client = TelegramClient(PHONE, int(API_ID), API_HASH)
+        async with client:
+            print("Signed in successfully!")
+            start_time = time.time()
+            engine = DownloadEngine(client, DownloadIndex(), ScrapeState(SCAN_STATE_PATH))
+            with StageTracker("download_images", unit="images") as tracker:
+                await engine.run(channels)
+                engine.write_metadata()
+                for channel, stats in engine.stats.items():
+                    tracker.add(items=stats["downloaded"], bytes_written=stats["bytes"], channel=channel)
+                tracker.set(budget_exhausted=engine.budget.exhausted())
+
+            elapsed = time.time() - start_time
+            for channel, stats in engine.stats.items():
+                rate = stats["downloaded"] / elapsed if elapsed > 0 else 0.0
+                logger.info(f"Completed {channel}: {stats} in {elapsed:.2f}s")
+                print(f"Completed @{channel}: {stats['downloaded']} downloaded, "
+                      f"{stats['skipped_existing']} already on disk, "
+                      f"{stats['deduped_photo_id'] + stats['deduped_content']} deduped, "
+                      f"{stats['failed']} failed ({rate:.1f} img/s)")
+            total_mb = engine.budget.bytes_downloaded / (1024 * 1024)
+            print(f"Downloaded {total_mb:.1f} MB in {elapsed:.1f}s ({total_mb / max(elapsed, 1e-9):.2f} MB/s)")
+            if engine.budget.exhausted():
+                print("Download budget exhausted - the next run resumes where this one stopped.")
+            return engine.stats
+
+
+def run(channels=None):
+    """Download from other Python code (the pipeline). Returns per-channel stats."""
+    return asyncio.run(main(channels))
+
 
 if __name__ == "__main__":
+    # Run as a script: warnings and errors also go to the console
+    logging.basicConfig(level=logging.WARNING, format=LOG_FORMAT)
     asyncio.run(main())
     print("Image scraping completed successfully.")
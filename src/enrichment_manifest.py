@@ -0,0 +1,112 @@
+# src/enrichment_manifest.py
+# Remembers which inputs a YOLO stage already processed, so runs only touch new or changed files.
+
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_signature(weights, conf, backend="ultralytics", iou=0.7):
+    """Identifies the model + settings: outputs from other weights/thresholds/backends are stale."""
+    if weights and os.path.exists(weights):
+        weights_id = f"{os.path.basename(weights)}:{file_sha256(weights)[:16]}"
+    else:
+        weights_id = str(weights)  # e.g. not downloaded yet; ultralytics fetches it by name
+    signature = f"{weights_id}|conf={conf}"
+    if backend != "ultralytics":
+        signature += f"|backend={backend}"  # ONNX boxes differ slightly from PyTorch ones
+    if iou != 0.7:
+        signature += f"|iou={iou}"  # only when changed, so existing manifests stay valid
+    return signature
+
+
+class EnrichmentManifest:
+    """JSON manifest: {path: {size, mtime_ns, sha256, signature, processed_at}}.
+
+    An input is skipped when it was processed with the same signature and is
+    unchanged: same size/mtime, or (if those moved, e.g. after a copy) same hash.
+    """
+
+    def __init__(self, path, signature, save_every=200):
+        self.path = path
+        self.signature = signature
+        self.save_every = save_every
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f).get("entries", {})
+        self.skipped = 0
+        self.processed = 0
+        self._dirty = 0
+        self._lock = threading.Lock()  # marked from background writer threads
+
+    def needs_processing(self, input_path):
+        key = str(input_path)
+        entry = self.entries.get(key)
+        if entry is None or entry.get("signature") != self.signature:
+            return True
+        stat = os.stat(input_path)
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            self.skipped += 1
+            return False
+        if entry["size"] == stat.st_size and entry["sha256"] == file_sha256(input_path):
+            entry["mtime_ns"] = stat.st_mtime_ns
+            self.skipped += 1
+            return False
+        return True
+
+    def filter(self, items, path_of=lambda item: item[1]):
+        for item in items:
+            if self.needs_processing(path_of(item)):
+                yield item
+
+    def mark(self, input_path):
+        stat = os.stat(input_path)
+        entry = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_sha256(input_path),
+            "signature": self.signature,
+            "processed_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            self.entries[str(input_path)] = entry
+            self.processed += 1
+            self._dirty += 1
+            if self._dirty >= self.save_every:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"signature": self.signature, "entries": self.entries}, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = 0
+
+
+class ManifestSink:
+    """Marks each input as done. Put it last, after the sinks that write the outputs."""
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+
+    def handle(self, image_result):
+        self.manifest.mark(image_result.source_path)
+
+    def close(self):
+        self.manifest.save()
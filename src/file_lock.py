@@ -0,0 +1,66 @@
+# src/file_lock.py
+# Cross-process locks for the files a script reads at start and rewrites as a whole
+# (scrape state, load ledgers, YOLO manifests and caches, the download index, Telegram sessions).
+# A script holds the locks for its whole run, so two runs touching the same files - e.g. eager
+# partition runs next to a backfill - take turns instead of overwriting each other's copy.
+
+import os
+import time
+from contextlib import ExitStack, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_POLL_SECONDS = 1.0
+
+
+def _try_lock(f):
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def _lock(lock_path, poll_seconds):
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    # The lock file is never removed: deleting it would let a waiter lock a stale inode
+    with open(lock_path, "a+") as f:
+        waiting = False
+        while not _try_lock(f):
+            if not waiting:
+                print(f"Waiting for {lock_path} (another run holds it)...")
+                waiting = True
+            time.sleep(poll_seconds)
+        try:
+            yield
+        finally:
+            _unlock(f)
+
+
+@contextmanager
+def locked(*paths, poll_seconds=LOCK_POLL_SECONDS):
+    """Hold `<path>.lock` for every path until the block exits.
+
+    Locks are taken in sorted order, so scripts sharing some of their files cannot deadlock.
+    """
+    with ExitStack() as stack:
+        for path in sorted({str(p) for p in paths}):
+            stack.enter_context(_lock(path + ".lock", poll_seconds))
+        yield
@@ -0,0 +1,173 @@
+# src/instrumentation.py
+# Per-stage throughput and resource metrics, appended as JSON lines for trend comparison.
+#
+#   with StageTracker("download_images") as tracker:
+#       tracker.add(items=1, bytes_written=size, channel="CheMed123")
+#
+# One line per stage run ("channel": null, the totals) plus one per channel, in
+# logs/stage_metrics.jsonl. The Dagster pipeline picks up the finished stages with
+# pop_completed() and attaches them to the asset materialization.
+
+import os
+import json
+import sys
+import time
+import threading
+import uuid
+from datetime import datetime, timezone
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+STAGE_METRICS_PATH = os.getenv("STAGE_METRICS_PATH", "logs/stage_metrics.jsonl")
+
+# Groups the stages of one pipeline run; the Dagster pipeline sets its run id
+_run_id = os.getenv("PIPELINE_RUN_ID") or uuid.uuid4().hex[:12]
+
+# stage -> records of its last finished run in this process (read by the pipeline)
+_completed = {}
+_lock = threading.Lock()
+
+
+def set_run_id(run_id):
+    global _run_id
+    _run_id = run_id
+
+
+def pop_completed(stage):
+    with _lock:
+        return _completed.pop(stage, [])
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its finished children (e.g. YOLO worker processes)."""
+    if resource is not None:
+        peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+class StageTracker:
+    """Wall time, items, items/s, bytes written and memory of one stage, overall and per channel.
+
+    The OS only reports a peak RSS for the whole process (ru_maxrss), so records carry that as
+    process_peak_rss_mb, plus peak_rss_growth_mb: how far this stage raised it (0 when the
+    stage stayed below a peak an earlier stage in the same process had already reached).
+    """
+
+    def __init__(self, stage, unit="items", log_path=None):
+        self.stage = stage
+        self.unit = unit  # what `items` counts: messages, rows, images, models...
+        self.log_path = log_path or STAGE_METRICS_PATH
+        self.items = 0
+        self.bytes_written = 0
+        self.channels = {}  # channel -> {"items", "bytes_written", "wall_seconds"}
+        self.extra = {}
+        self.records = []
+        self._lock = threading.Lock()
+        self._start = None
+        self._started_at = None
+        self._peak_at_start = None
+
+    def start(self):
+        self._peak_at_start = peak_rss_mb()
+        self._start = time.perf_counter()
+        self._started_at = datetime.now(timezone.utc).isoformat()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish("failed" if exc_type else "ok")
+        return False
+
+    def _channel(self, channel):
+        return self.channels.setdefault(channel, {"items": 0, "bytes_written": 0, "wall_seconds": None})
+
+    def add(self, items=0, bytes_written=0, channel=None):
+        with self._lock:
+            self.items += items
+            self.bytes_written += bytes_written
+            if channel is not None:
+                entry = self._channel(channel)
+                entry["items"] += items
+                entry["bytes_written"] += bytes_written
+
+    def channel_time(self, channel, wall_seconds):
+        """Channels that ran concurrently with others report their own elapsed time."""
+        with self._lock:
+            self._channel(channel)["wall_seconds"] = wall_seconds
+
+    def count(self, iterable, channel_of=lambda item: item[0]):
+        """Pass items through, counting each one (and its channel) as it is consumed."""
+        for item in iterable:
+            self.add(items=1, channel=channel_of(item))
+            yield item
+
+    def set(self, **extra):
+        self.extra.update(extra)
+
+    def _record(self, channel, items, bytes_written, wall_seconds, status, peak):
+        growth = None
+        if peak is not None and self._peak_at_start is not None:
+            growth = round(max(peak - self._peak_at_start, 0.0), 1)
+        return {
+            "run_id": _run_id,
+            "stage": self.stage,
+            "channel": channel,
+            "status": status,
+            "unit": self.unit,
+            "started_at": self._started_at,
+            "wall_seconds": round(wall_seconds, 3),
+            "items": items,
+            "items_per_second": round(items / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+            "bytes_written": bytes_written,
+            "process_peak_rss_mb": peak,
+            "peak_rss_growth_mb": growth,
+        }
+
+    def finish(self, status="ok"):
+        wall = time.perf_counter() - self._start
+        peak = peak_rss_mb()
+        total = self._record(None, self.items, self.bytes_written, wall, status, peak)
+        total.update(self.extra)
+        self.records = [total] + [
+            self._record(channel, c["items"], c["bytes_written"],
+                         c["wall_seconds"] if c["wall_seconds"] is not None else wall, status, peak)
+            for channel, c in sorted(self.channels.items())
+        ]
+
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            for record in self.records:
+                f.write(json.dumps(record, default=str) + "\n")
+        with _lock:
+            _completed[self.stage] = self.records
+
+        print(f"[{self.stage}] {self.items} {self.unit} in {wall:.1f}s "
+              f"({total['items_per_second']}/s), {self.bytes_written / (1024 * 1024):.1f} MB written, "
+              f"process peak RSS {peak} MB (+{total['peak_rss_growth_mb']} MB in this stage)")
+        return self.records
+
+
+def metadata_from_records(records):
+    """Flatten stage records into Dagster metadata: totals as-is, channels as "<channel>.<metric>"."""
+    metadata = {}
+    for record in records:
+        prefix = f"{record['channel']}." if record["channel"] else ""
+        for key in ("wall_seconds", "items", "items_per_second", "bytes_written",
+                    "process_peak_rss_mb", "peak_rss_growth_mb"):
+            if record.get(key) is not None and (not prefix or "rss" not in key):
+                metadata[prefix + key] = record[key]
+    return metadata
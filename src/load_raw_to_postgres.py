@@ -1,12 +1,24 @@
 """
-Task 2 – Load raw Telegram CSV into PostgreSQL
-This creates the raw table used by dbt.
+Task 2 – Load raw Telegram messages into PostgreSQL
+This maintains the raw table used by dbt.
+
+Input is streamed into a temporary staging table with COPY and merged into
+public.telegram_messages on (channel_username, message_id), so the table,
+its types and indexes survive every run and API readers never see it missing.
+Files that were already loaded (same size and mtime) are skipped.
 """
 
-import pandas as pd
-from sqlalchemy import create_engine
-from dotenv import load_dotenv
 import os
+import io
+import csv
+import json
+import glob
+import time
+import psycopg2
+from dotenv import load_dotenv
+
+from instrumentation import StageTracker
+from file_lock import locked
 
 load_dotenv()
 
@@ -16,22 +28,259 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 
-CSV_PATH = "data/raw/csv/telegram_flat_utf8.csv"
+# Every CSV the scraper produced (the old single export telegram_flat_utf8.csv matches too)
+CSV_GLOB = os.getenv("RAW_CSV_GLOB", "data/raw/csv/telegram_flat_*.csv")
 
-engine = create_engine(
-    f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-)
+# RAW_SOURCE=lake reads the partitioned Parquet lake instead of the CSVs
+RAW_SOURCE = os.getenv("RAW_SOURCE", "csv")
+LAKE_BATCH_ROWS = int(os.getenv("RAW_LAKE_BATCH_ROWS", "50000"))
+
+# Inputs already merged, so reruns only read new files
+LOADED_FILES_PATH = "data/raw/state/loaded_files.json"
+
+COLUMNS = ["message_id", "date", "text", "views", "forwards", "media_type", "channel_username"]
+
+# One-time migration of a table written by the old pandas loader (no primary key):
+# pandas typed the columns from the CSV (date TEXT, views/forwards BIGINT or DOUBLE) and
+# appended without a key. Drop keyless rows, keep one row per key (most views, as the
+# merge does), cast the columns to the types of CREATE_TABLE_SQL and add the primary key.
+MIGRATE_TABLE_SQL = """
+DO $$
+DECLARE
+    col RECORD;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_constraint
+               WHERE conrelid = 'public.telegram_messages'::regclass AND contype = 'p') THEN
+        RETURN;
+    END IF;
+
+    DELETE FROM public.telegram_messages WHERE message_id IS NULL OR channel_username IS NULL;
+    DELETE FROM public.telegram_messages t
+    USING (
+        SELECT ctid, row_number() OVER (
+                   PARTITION BY channel_username, message_id
+                   ORDER BY views DESC NULLS LAST, ctid DESC) AS rn
+        FROM public.telegram_messages
+    ) d
+    WHERE t.ctid = d.ctid AND d.rn > 1;
+
+    FOR col IN
+        SELECT c.column_name, v.target
+        FROM information_schema.columns c
+        JOIN (VALUES ('message_id', 'bigint'), ('channel_username', 'text'),
+                     ('date', 'timestamp with time zone'), ('text', 'text'), ('views', 'integer'),
+                     ('forwards', 'integer'), ('media_type', 'text')) AS v (name, target)
+          ON v.name = c.column_name
+        WHERE c.table_schema = 'public' AND c.table_name = 'telegram_messages'
+          AND c.data_type <> v.target
+    LOOP
+        EXECUTE format('ALTER TABLE public.telegram_messages ALTER COLUMN %1$I TYPE %2$s '
+                       'USING NULLIF(%1$I::text, '''')::%2$s', col.column_name, col.target);
+    END LOOP;
 
-print("Reading CSV...")
-df = pd.read_csv(CSV_PATH)
+    ALTER TABLE public.telegram_messages ADD PRIMARY KEY (channel_username, message_id);
+    -- Created by an earlier version of this loader; the primary key replaces it
+    DROP INDEX IF EXISTS public.telegram_messages_channel_message_uidx;
+END $$;
+"""
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS public.telegram_messages (
+    message_id        BIGINT      NOT NULL,
+    channel_username  TEXT        NOT NULL,
+    date              TIMESTAMPTZ,
+    text              TEXT,
+    views             INTEGER,
+    forwards          INTEGER,
+    media_type        TEXT,
+    loaded_at         TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (channel_username, message_id)
+);
+-- Tables created by the old pandas loader: add what the merge needs
+ALTER TABLE public.telegram_messages ADD COLUMN IF NOT EXISTS loaded_at TIMESTAMPTZ NOT NULL DEFAULT now();
+""" + MIGRATE_TABLE_SQL + """
+CREATE INDEX IF NOT EXISTS telegram_messages_loaded_at_idx
+    ON public.telegram_messages (loaded_at);
+-- Keyset pagination of GET /messages (newest message_id first)
+CREATE INDEX IF NOT EXISTS telegram_messages_message_id_idx
+    ON public.telegram_messages (message_id, channel_username);
+"""
+
+CREATE_STAGE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS telegram_messages_stage
+    (LIKE public.telegram_messages INCLUDING DEFAULTS);
+TRUNCATE telegram_messages_stage;
+"""
 
-print("Writing to PostgreSQL...")
-df.to_sql(
-    "telegram_messages",
-    engine,
-    schema="public",
-    if_exists="replace",
-    index=False
+# Keep one row per key from the chunk, and only rewrite rows whose content changed.
+# %(channels)s limits the merge to some channels (NULL = all). Returns the rows written
+# and their size (row data, for the stage metrics).
+MERGE_SQL = """
+WITH merged AS (
+INSERT INTO public.telegram_messages AS t
+    (message_id, channel_username, date, text, views, forwards, media_type, loaded_at)
+SELECT DISTINCT ON (channel_username, message_id)
+    message_id, channel_username, date, text, views, forwards, media_type, now()
+FROM telegram_messages_stage
+WHERE message_id IS NOT NULL AND channel_username IS NOT NULL
+  AND (%(channels)s::text[] IS NULL OR channel_username = ANY(%(channels)s::text[]))
+ORDER BY channel_username, message_id, views DESC NULLS LAST
+ON CONFLICT (channel_username, message_id) DO UPDATE SET
+    date = EXCLUDED.date,
+    text = EXCLUDED.text,
+    views = EXCLUDED.views,
+    forwards = EXCLUDED.forwards,
+    media_type = EXCLUDED.media_type,
+    loaded_at = now()
+WHERE (t.date, t.text, t.views, t.forwards, t.media_type)
+      IS DISTINCT FROM (EXCLUDED.date, EXCLUDED.text, EXCLUDED.views, EXCLUDED.forwards, EXCLUDED.media_type)
+RETURNING pg_column_size(t.*) AS row_bytes
 )
+SELECT count(*), COALESCE(sum(row_bytes), 0) FROM merged
+"""
+
+
+def get_connection():
+    return psycopg2.connect(
+        host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD
+    )
+
+
+def load_ledger():
+    if os.path.exists(LOADED_FILES_PATH):
+        with open(LOADED_FILES_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_ledger(ledger):
+    os.makedirs(os.path.dirname(LOADED_FILES_PATH), exist_ok=True)
+    tmp_path = LOADED_FILES_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(ledger, f, indent=2)
+    os.replace(tmp_path, LOADED_FILES_PATH)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def copy_and_merge(conn, stream, columns, channels=None):
+    """COPY one chunk (a CSV stream with a header row) into staging and merge it. One transaction.
+
+    Returns (rows staged, rows inserted/updated, bytes of row data written).
+    """
+    with conn.cursor() as cur:
+        cur.execute(CREATE_STAGE_SQL)
+        cur.copy_expert(
+            f"COPY telegram_messages_stage ({', '.join(columns)}) "
+            "FROM STDIN WITH (FORMAT csv, HEADER true)",
+            stream,
+        )
+        staged = cur.rowcount
+        cur.execute(MERGE_SQL, {"channels": channels})
+        merged, written = cur.fetchone()
+    conn.commit()
+    return staged, merged, written
+
+
+def csv_columns(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        header = next(csv.reader(f), [])
+    unknown = [c for c in header if c not in COLUMNS]
+    if unknown:
+        raise ValueError(f"{path}: unexpected columns {unknown}")
+    return header
+
+
+def load_csv_files(conn, paths, ledger, channels=None):
+    # A CSV file holds every channel of its scrape run: with `channels`, the ledger
+    # records the file per channel ("<path>#<channel>"), so other channels load it later
+    total_staged = total_merged = total_written = 0
+    for path in paths:
+        signature = file_signature(path)
+        if ledger.get(path) == signature:
+            continue
+        pending = None
+        if channels:
+            pending = [c for c in channels if ledger.get(f"{path}#{c}") != signature]
+            if not pending:
+                continue
+        # psycopg2 streams the file to the server in small blocks: constant memory
+        with open(path, encoding="utf-8", newline="") as f:
+            staged, merged, written = copy_and_merge(conn, f, csv_columns(path), pending)
+        if pending:
+            ledger.update({f"{path}#{c}": signature for c in pending})
+        else:
+            ledger[path] = signature
+        save_ledger(ledger)
+        total_staged += staged
+        total_merged += merged
+        total_written += written
+        print(f"  {path}: {staged} rows staged, {merged} inserted/updated")
+    return total_staged, total_merged, total_written
+
+
+def load_lake(conn, ledger, channels=None):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+    from parquet_lake import select_files
+
+    total_staged = total_merged = total_written = 0
+    # Lake files are partitioned by channel already
+    for path in select_files(channels):
+        signature = file_signature(path)
+        if ledger.get(path) == signature:
+            continue
+        staged = merged = written = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=LAKE_BATCH_ROWS, columns=COLUMNS):
+            buffer = io.BytesIO()
+            pa_csv.write_csv(pa.Table.from_batches([batch]), buffer)
+            buffer.seek(0)
+            batch_staged, batch_merged, batch_written = copy_and_merge(conn, buffer, COLUMNS)
+            staged += batch_staged
+            merged += batch_merged
+            written += batch_written
+        ledger[path] = signature
+        save_ledger(ledger)
+        total_staged += staged
+        total_merged += merged
+        total_written += written
+        print(f"  {path}: {staged} rows staged, {merged} inserted/updated")
+    return total_staged, total_merged, total_written
+
+
+def main(channels=None):
+    # channels: load only these channels (default: all)
+    # One run at a time per ledger, whatever the orchestrator allows
+    with locked(LOADED_FILES_PATH):
+        start_time = time.time()
+        conn = get_connection()
+        try:
+            with StageTracker("load_raw", unit="rows") as tracker:
+                with conn.cursor() as cur:
+                    cur.execute(CREATE_TABLE_SQL)
+                conn.commit()
+
+                if RAW_SOURCE == "lake":
+                    print("Loading Parquet lake...")
+                    staged, merged, written = load_lake(conn, load_ledger(), channels)
+                else:
+                    paths = sorted(glob.glob(CSV_GLOB))
+                    print(f"Loading {len(paths)} CSV file(s) matching {CSV_GLOB}...")
+                    staged, merged, written = load_csv_files(conn, paths, load_ledger(), channels)
+                tracker.add(items=staged, bytes_written=written)
+                tracker.set(source=RAW_SOURCE, rows_merged=merged, channels=channels)
+        finally:
+            conn.close()
+
+        elapsed = time.time() - start_time
+        print(f"✅ public.telegram_messages merged: {staged} rows read, "
+              f"{merged} inserted/updated in {elapsed:.1f}s")
+        return {"rows_read": staged, "rows_merged": merged}
+
 
-print("✅ Raw table public.telegram_messages created")
+if __name__ == "__main__":
+    main()
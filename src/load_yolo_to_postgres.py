@@ -1,11 +1,16 @@
 import os
-import json
 import psycopg2
 from pathlib import Path
-from ultralytics import YOLO
+
+from detection_sinks import PostgresSink, iter_prediction_files, add_bytes_written
+from enrichment_manifest import EnrichmentManifest, model_signature
+from instrumentation import StageTracker
+from file_lock import locked
 
 # === CONFIG ===
 DATA_DIR = Path("data/raw/images")  # folder structure: data/raw/images/<channel_name>/*.jpg
+PRED_DIR = Path("output/yolo/predictions")  # written by src/run_yolo.py
+MANIFEST_PATH = Path("output/yolo/manifest_load_yolo.json")  # inputs already in Postgres
 DB_CONFIG = {
     "host": "localhost",
     "port": 5432,
@@ -14,56 +19,90 @@ DB_CONFIG = {
     "password": "newpassword123"
 }
 
-# Connect to Postgres
-conn = psycopg2.connect(**DB_CONFIG)
-cur = conn.cursor()
-
-# Load YOLOv8 model
-model = YOLO("yolov8n.pt")  # make sure the weights file exists
-print("YOLOv8n model loaded successfully!")
-
-# Iterate over channels
-for channel_dir in DATA_DIR.iterdir():
-    if not channel_dir.is_dir():
-        continue
-    channel_name = channel_dir.name
-    print(f"Processing channel: {channel_name}")
-
-    for img_path in channel_dir.glob("*.jpg"):
-        results = model(img_path)
-        
-        # Prepare JSON and bbox text
-        for det in results[0].boxes:
-            bbox_list = det.xyxy.tolist()[0] if hasattr(det, "xyxy") else det.xyxy
-            bbox_text = json.dumps(bbox_list)  # store as text
-
-            # Get message_id: must exist in telegram_messages
-            # Here we assume image name encodes message_id: e.g., "CheMed123_11.jpg" -> message_id=11
-            message_id = int(img_path.stem.split("_")[-1])
-
-            # Image category: placeholder or logic based on class_id
-            image_category = "product_display"
-
-            # Insert into raw_yolo_json
-            cur.execute("""
-                INSERT INTO raw_yolo_json (
-                    message_id, class_id, confidence, bbox, channel_name, image_category, file_name
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    message_id,
-                    int(det.cls[0]),  # class_id
-                    float(det.conf[0]),  # confidence
-                    bbox_text,
-                    channel_name,
-                    image_category,
-                    img_path.name
-                )
-            )
-
-        conn.commit()
-        print(f"Saved predictions for {img_path.name}")
-
-cur.close()
-conn.close()
-print("YOLO loading to Postgres completed successfully!")
+# files (default): load the prediction JSON that run_yolo.py already produced - no model needed
+# infer:           run the detection engine here and write straight to Postgres
+LOAD_MODE = os.getenv("YOLO_LOAD_MODE", "files")
+
+# Detections per multi-row upsert / transaction
+DB_BATCH_SIZE = int(os.getenv("YOLO_DB_BATCH_SIZE", "5000"))
+
+# Reload everything, ignoring the manifest (YOLO_FORCE=1)
+FORCE = os.getenv("YOLO_FORCE", "0") == "1"
+
+
+def load_prediction_files(sink, manifest, channels=None, tracker=None):
+    images = 0
+    include = None if FORCE else manifest.needs_processing
+    image_results = iter_prediction_files(PRED_DIR, channels=channels, include=include)
+    if tracker is not None:
+        image_results = tracker.count(image_results, channel_of=lambda r: r.channel_name)
+    for image_result in image_results:
+        sink.handle(image_result)
+        images += 1
+    sink.close()
+    return images
+
+
+def run_inference(sink, manifest, channels=None, tracker=None):
+    from detection_engine import list_images
+    from run_yolo import build_engine
+
+    # Same backend / worker settings as run_yolo.py (YOLO_BACKEND, YOLO_WORKERS, ...)
+    engine = build_engine([sink], manifest.signature)
+    images = list_images(DATA_DIR, channels)
+    if not FORCE:
+        images = manifest.filter(images)
+    if tracker is not None:
+        images = tracker.count(images)
+    stats = engine.run(images)
+    print(f"Detection cache hit rate: {stats['cache_hit_rate']:.1%}")
+    return stats["images"]
+
+
+def lock_paths():
+    if LOAD_MODE == "infer":
+        from run_yolo import PHASH_CACHE_PATH, USE_PHASH_CACHE
+
+        if USE_PHASH_CACHE:
+            return [MANIFEST_PATH, PHASH_CACHE_PATH]
+    return [MANIFEST_PATH]
+
+
+def main(channels=None):
+    # channels: load only these channels (default: all)
+    # One run at a time per manifest (and, with infer, the detection cache run_yolo.py shares)
+    with locked(*lock_paths()):
+        # Connect to Postgres
+        conn = psycopg2.connect(**DB_CONFIG)
+
+        # Inputs are marked done only after the batch holding them is committed
+        if LOAD_MODE == "infer":
+            from run_yolo import MODEL_WEIGHTS, CONF_THRESHOLD, BACKEND, IOU_THRESHOLD
+
+            signature = model_signature(MODEL_WEIGHTS, CONF_THRESHOLD, BACKEND, IOU_THRESHOLD)
+        else:
+            signature = "prediction-files"
+        manifest = EnrichmentManifest(str(MANIFEST_PATH), signature)
+        sink = PostgresSink(conn, batch_size=DB_BATCH_SIZE,
+                            on_commit=lambda paths: [manifest.mark(p) for p in paths])
+        try:
+            with StageTracker("load_yolo", unit="images") as tracker:
+                if LOAD_MODE == "infer":
+                    images = run_inference(sink, manifest, channels, tracker)
+                else:
+                    print(f"Loading prediction files from {PRED_DIR}")
+                    images = load_prediction_files(sink, manifest, channels, tracker)
+                add_bytes_written(tracker, [sink])
+                tracker.set(mode=LOAD_MODE, detections=sink.rows, batches=sink.batches)
+        finally:
+            manifest.save()
+            conn.close()
+
+        print(f"Saved {sink.rows} detections for {images} images in {sink.batches} batches")
+        print(f"Skipped {manifest.skipped} unchanged inputs already loaded")
+        print("YOLO loading to Postgres completed successfully!")
+        return {"images": images, "detections": sink.rows}
+
+
+if __name__ == "__main__":
+    main()
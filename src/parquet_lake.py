@@ -0,0 +1,177 @@
+# src/parquet_lake.py
+# Columnar, compressed data lake for raw Telegram messages.
+#
+# Layout (hive-style partitions, one directory per channel and message date):
+#   data/lake/messages/channel=<channel>/message_date=<YYYY-MM-DD>/part-<run_id>-<seq>.parquet
+#   data/lake/messages/_manifest.json   <- every partition with its files, row counts and id ranges
+#
+# Readers use the manifest to pick only the partitions they need, then let
+# pyarrow project columns and push filters down into the Parquet row groups.
+
+import os
+import json
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+LAKE_DIR = "data/lake/messages"
+MANIFEST_NAME = "_manifest.json"
+COMPRESSION = "zstd"
+
+MESSAGE_SCHEMA = pa.schema([
+    ("message_id", pa.int64()),
+    ("date", pa.timestamp("us", tz="UTC")),
+    ("text", pa.string()),
+    ("views", pa.int64()),
+    ("forwards", pa.int64()),
+    ("media_type", pa.string()),
+    ("channel_username", pa.string()),
+])
+
+PARTITION_SCHEMA = pa.schema([("channel", pa.string()), ("message_date", pa.string())])
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+DATASET_SCHEMA = pa.unify_schemas([MESSAGE_SCHEMA, PARTITION_SCHEMA])
+
+
+def partition_of(record):
+    date = record.get("date")
+    return record["channel_username"], (date[:10] if date else "unknown")
+
+
+def load_manifest(lake_dir=LAKE_DIR):
+    path = os.path.join(lake_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"partitions": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, lake_dir=LAKE_DIR):
+    os.makedirs(lake_dir, exist_ok=True)
+    path = os.path.join(lake_dir, MANIFEST_NAME)
+    manifest["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+class ParquetLakeWriter:
+    """Partitioned Parquet writer with the same interface as stream_writer's writers.
+
+    Records are buffered per (channel, date) partition and written once a
+    partition reaches `rows_per_file`, or when the total buffer exceeds
+    `max_buffered_rows` (largest partitions first), so memory stays bounded.
+    `flush()` writes out every buffered partition: StreamingSink calls it
+    before the scraper moves its high-water marks, so nothing the state
+    covers can be lost with the buffer.
+    """
+
+    def __init__(self, run_id, lake_dir=LAKE_DIR, rows_per_file=50_000, max_buffered_rows=100_000):
+        self.run_id = run_id
+        self.lake_dir = lake_dir
+        self.rows_per_file = rows_per_file
+        self.max_buffered_rows = max_buffered_rows
+        self.manifest = load_manifest(lake_dir)
+        self.buffers = {}
+        self.buffered_rows = 0
+        self.files = []
+        self.bytes_written = 0
+        self._seq = 0
+
+    def write_batch(self, records):
+        for record in records:
+            self.buffers.setdefault(partition_of(record), []).append(record)
+        self.buffered_rows += len(records)
+
+        for key in [k for k, rows in self.buffers.items() if len(rows) >= self.rows_per_file]:
+            self._write_partition(key)
+        while self.buffered_rows > self.max_buffered_rows:
+            self._write_partition(max(self.buffers, key=lambda k: len(self.buffers[k])))
+
+    def _write_partition(self, key):
+        rows = self.buffers.pop(key)
+        self.buffered_rows -= len(rows)
+        channel, date = key
+        partition = f"channel={channel}/message_date={date}"
+        directory = os.path.join(self.lake_dir, partition)
+        os.makedirs(directory, exist_ok=True)
+
+        self._seq += 1
+        path = os.path.join(directory, f"part-{self.run_id}-{self._seq:05d}.parquet")
+        columns = {name: [r.get(name) for r in rows] for name in MESSAGE_SCHEMA.names}
+        columns["date"] = [datetime.fromisoformat(d) if d else None for d in columns["date"]]
+        table = pa.Table.from_pydict(columns, schema=MESSAGE_SCHEMA)
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pq.write_table(table, f, compression=COMPRESSION)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        size = os.path.getsize(path)
+        self.files.append(path)
+        self.bytes_written += size
+        ids = columns["message_id"]
+        entry = self.manifest["partitions"].setdefault(
+            partition, {"channel": channel, "date": date, "rows": 0, "files": []}
+        )
+        entry["files"].append({
+            "path": os.path.relpath(path, self.lake_dir).replace(os.sep, "/"),
+            "rows": len(rows),
+            "bytes": size,
+            "min_message_id": min(ids),
+            "max_message_id": max(ids),
+        })
+        entry["rows"] += len(rows)
+        save_manifest(self.manifest, self.lake_dir)
+
+    def flush(self):
+        for key in list(self.buffers):
+            self._write_partition(key)
+
+    def close(self):
+        self.flush()
+
+
+def select_files(channels=None, start_date=None, end_date=None, lake_dir=LAKE_DIR):
+    """Partition pruning from the manifest: files for the given channels and date range."""
+    files = []
+    for entry in load_manifest(lake_dir)["partitions"].values():
+        if channels and entry["channel"] not in channels:
+            continue
+        if start_date and entry["date"] < str(start_date):
+            continue
+        if end_date and entry["date"] > str(end_date):
+            continue
+        files.extend(os.path.join(lake_dir, f["path"]) for f in entry["files"])
+    return files
+
+
+def messages_dataset(channels=None, start_date=None, end_date=None, lake_dir=LAKE_DIR):
+    files = select_files(channels, start_date, end_date, lake_dir)
+    return ds.dataset(
+        files, schema=DATASET_SCHEMA, format="parquet",
+        partitioning=PARTITIONING, partition_base_dir=lake_dir,
+    )
+
+
+def read_messages(columns=None, channels=None, start_date=None, end_date=None,
+                  filter=None, lake_dir=LAKE_DIR):
+    """Read messages as a pandas DataFrame, touching only the partitions and columns needed.
+
+    `filter` is an optional pyarrow expression pushed down to the Parquet
+    reader, e.g. `ds.field("views") > 1000`.
+    """
+    dataset = messages_dataset(channels, start_date, end_date, lake_dir)
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
+
+
+def iter_message_batches(columns=None, channels=None, start_date=None, end_date=None,
+                         filter=None, batch_size=50_000, lake_dir=LAKE_DIR):
+    """Same as read_messages but yields pyarrow RecordBatches, for constant-memory loaders."""
+    dataset = messages_dataset(channels, start_date, end_date, lake_dir)
+    yield from dataset.to_batches(columns=columns, filter=filter, batch_size=batch_size)
@@ -0,0 +1,174 @@
+# src/phash_cache.py
+# Detection cache keyed by a perceptual hash of the image.
+# Channels repost the same product photos (re-encoded, resized, recompressed);
+# a near-duplicate reuses the stored detections instead of running the model.
+
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import cv2
+
+HASH_BITS = 64
+BANDS = 8          # 8 x 8-bit bands: any two hashes within distance 7 share at least one band
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def dhash(image, hash_size=8):
+    """64-bit difference hash of a BGR image: robust to resizing and JPEG re-encoding."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def informative(value):
+    # Near-uniform images (blank, solid colour) hash to almost all 0s or 1s and would match each other
+    ones = bin(value).count("1")
+    return 4 <= ones <= HASH_BITS - 4
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def bands_of(value):
+    return [(i, (value >> (i * BAND_BITS)) & BAND_MASK) for i in range(BANDS)]
+
+
+class PerceptualHashCache:
+    """LRU cache {dhash: detections with bboxes normalised to 0..1}, persisted as JSON.
+
+    Lookups accept hashes within `max_distance` bits (at most BANDS - 1, so
+    the band index finds every candidate). Entries are only valid for the
+    model signature they were produced with. With `track_new`, stored entries
+    are also kept for drain_new(), so worker processes can hand them back.
+    """
+
+    def __init__(self, path, signature, max_entries=50_000, max_distance=5, track_new=False):
+        self.path = path
+        self.signature = signature
+        self.max_entries = max_entries
+        self.max_distance = min(max_distance, BANDS - 1)
+        self.entries = OrderedDict()
+        self.bands = [dict() for _ in range(BANDS)]
+        self.hits = 0
+        self.misses = 0
+        self.new_entries = [] if track_new else None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("signature") != self.signature:
+            print("Perceptual hash cache was built with another model - starting empty")
+            return
+        for key, detections in data.get("entries", []):
+            self._insert(int(key, 16), detections)
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "signature": self.signature,
+                    "entries": [[f"{key:016x}", dets] for key, dets in self.entries.items()],
+                }, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+
+    def _insert(self, key, detections):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        else:
+            for band, value in bands_of(key):
+                self.bands[band].setdefault(value, set()).add(key)
+        self.entries[key] = detections
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            for band, value in bands_of(evicted):
+                keys = self.bands[band][value]
+                keys.discard(evicted)
+                if not keys:
+                    del self.bands[band][value]
+
+    def _find(self, key):
+        if key in self.entries:
+            return key
+        best, best_distance = None, self.max_distance + 1
+        for band, value in bands_of(key):
+            for candidate in self.bands[band].get(value, ()):
+                distance = hamming(key, candidate)
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        return best
+
+    def lookup(self, image):
+        """Detections for a near-duplicate of `image`, scaled to its size, or None."""
+        key = dhash(image)
+        if not informative(key):
+            self.misses += 1
+            return None
+        with self._lock:
+            match = self._find(key)
+            if match is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(match)
+            normalised = self.entries[match]
+            self.hits += 1
+        height, width = image.shape[:2]
+        return [
+            {
+                "class_id": det["class_id"],
+                "confidence": det["confidence"],
+                "bbox": [det["bbox"][0] * width, det["bbox"][1] * height,
+                         det["bbox"][2] * width, det["bbox"][3] * height],
+            }
+            for det in normalised
+        ]
+
+    def store(self, image, detections):
+        height, width = image.shape[:2]
+        normalised = [
+            {
+                "class_id": det["class_id"],
+                "confidence": det["confidence"],
+                "bbox": [det["bbox"][0] / width, det["bbox"][1] / height,
+                         det["bbox"][2] / width, det["bbox"][3] / height],
+            }
+            for det in detections
+        ]
+        key = dhash(image)
+        if not informative(key):
+            return
+        with self._lock:
+            self._insert(key, normalised)
+            if self.new_entries is not None:
+                self.new_entries.append((key, normalised))
+
+    def drain_new(self):
+        with self._lock:
+            entries = self.new_entries or []
+            if self.new_entries is not None:
+                self.new_entries = []
+        return entries
+
+    def merge(self, entries):
+        """Add (key, normalised detections) pairs produced by another process."""
+        with self._lock:
+            for key, normalised in entries:
+                self._insert(key, normalised)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,217 @@
+# src/query_cache.py
+# Result cache shared by both APIs: api/cache.py (mart reports) and src/api.py (raw-table analytics).
+# Standard library only, so it imports as `query_cache` from src/ and as `src.query_cache` from the root.
+
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """One in-progress computation that concurrent callers for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class QueryCache:
+    """In-memory LRU + TTL cache for report queries.
+
+    The tables behind the reports only change when the pipeline writes them,
+    so results are kept until `ttl` seconds pass or invalidate() is called
+    (the pipeline calls it through each API after its writes). Concurrent
+    misses on the same key collapse into one query: the first caller runs
+    it, the others wait for its result. Works for sync callers (threads) and async callers
+    (event loop); a computation that overlaps an invalidate() is returned
+    to its callers but not stored.
+    """
+
+    def __init__(self, maxsize=256, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._flights = {}              # key -> _Flight (sync callers)
+        self._async_flights = {}        # key -> asyncio.Future (async callers)
+        self._key_stats = {}            # key -> {"hits", "misses", "coalesced", "queries", "last_query_ms"}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.invalidations = 0
+
+    # -----------------------------
+    # Internals (call with the lock held)
+    # -----------------------------
+    def _stats_for(self, key):
+        stats = self._key_stats.get(key)
+        if stats is None:
+            if len(self._key_stats) >= self.maxsize * 4:
+                # Forget stats of keys no longer cached so high-cardinality keys can't grow this forever
+                self._key_stats = {k: v for k, v in self._key_stats.items() if k in self._entries}
+            stats = self._key_stats[key] = {"hits": 0, "misses": 0, "coalesced": 0, "queries": 0,
+                                            "last_query_ms": None}
+        return stats
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        self._stats_for(key)["hits"] += 1
+        return True, value
+
+    def _store(self, key, value, generation, elapsed):
+        stats = self._stats_for(key)
+        stats["queries"] += 1
+        stats["last_query_ms"] = round(elapsed * 1000, 2)
+        if generation != self._generation:
+            return  # invalidated while the query ran: the result may predate the new data
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # -----------------------------
+    # Sync callers
+    # -----------------------------
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats_for(key)["misses"] += 1
+                generation = self._generation
+            else:
+                self._stats_for(key)["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        start = time.perf_counter()
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None:
+                    self._store(key, flight.value, generation, time.perf_counter() - start)
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    # -----------------------------
+    # Async callers
+    # -----------------------------
+    async def get_or_compute_async(self, key, compute):
+        """`compute` is a zero-argument coroutine function."""
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            future = self._async_flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._async_flights[key] = asyncio.get_running_loop().create_future()
+                self._stats_for(key)["misses"] += 1
+                generation = self._generation
+            else:
+                self._stats_for(key)["coalesced"] += 1
+
+        if not leader:
+            # shield: a cancelled follower must not cancel the shared result
+            return await asyncio.shield(future)
+
+        start = time.perf_counter()
+        try:
+            value = await compute()
+        except BaseException as e:
+            with self._lock:
+                del self._async_flights[key]
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # mark retrieved: there may be no followers
+            raise
+        with self._lock:
+            self._store(key, value, generation, time.perf_counter() - start)
+            del self._async_flights[key]
+        future.set_result(value)
+        return value
+
+    # -----------------------------
+    # Decorator, invalidation, stats
+    # -----------------------------
+    def cached(self, name):
+        """Cache a crud function under `name`; its first argument (the db session) is not part of the key."""
+
+        def decorator(func):
+            def make_key(args, kwargs):
+                return (name,) + tuple(args[1:]) + tuple(sorted(kwargs.items()))
+
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    return await self.get_or_compute_async(make_key(args, kwargs),
+                                                           lambda: func(*args, **kwargs))
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.get_or_compute(make_key(args, kwargs), lambda: func(*args, **kwargs))
+            return wrapper
+
+        return decorator
+
+    def invalidate(self, name=None):
+        """Drop every entry (or only those cached under `name`). Returns the number dropped."""
+        with self._lock:
+            keys = [key for key in self._entries if name is None or key[0] == name]
+            for key in keys:
+                del self._entries[key]
+            self._generation += 1
+            self.invalidations += 1
+        return len(keys)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            hits = sum(s["hits"] for s in self._key_stats.values())
+            misses = sum(s["misses"] for s in self._key_stats.values())
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": hits,
+                "misses": misses,
+                "coalesced": sum(s["coalesced"] for s in self._key_stats.values()),
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "keys": [
+                    {
+                        "key": repr(key),
+                        "cached": key in self._entries,
+                        "expires_in_seconds": round(self._entries[key][0] - now, 1) if key in self._entries else None,
+                        **stats,
+                    }
+                    for key, stats in self._key_stats.items()
+                ],
+            }
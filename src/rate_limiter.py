@@ -0,0 +1,50 @@
+# src/rate_limiter.py
+# Shared request pacing for everything that talks to a single TelegramClient.
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second with bursts up to `capacity`.
+
+    One instance is shared by every coroutine using the same client, so the
+    account-wide request rate stays bounded no matter how many channels run
+    concurrently. `pause()` blocks all callers, which is how a FloodWaitError
+    seen by one channel is propagated to the others.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.total_wait = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    delay = self.blocked_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= tokens:
+                        self.tokens -= tokens
+                        return
+                    delay = (tokens - self.tokens) / self.rate
+                self.total_wait += delay
+                await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (e.g. after a FloodWaitError)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.updated = self.blocked_until
@@ -1,9 +1,17 @@
 # src/run_yolo.py
 import os
-import json
-from ultralytics import YOLO
+import psycopg2
 from pathlib import Path
 
+from detection_backends import create_backend
+from detection_engine import DetectionEngine, ShardedDetectionEngine, list_images
+from detection_sinks import (PredictionFileSink, AnnotatedImageSink, PostgresSink, BackgroundWriter,
+                             add_bytes_written)
+from enrichment_manifest import EnrichmentManifest, ManifestSink, model_signature
+from phash_cache import PerceptualHashCache
+from instrumentation import StageTracker
+from file_lock import locked
+
 # ----------------------------
 # Paths
 # ----------------------------
@@ -11,44 +19,122 @@ IMAGE_ROOT = Path("data/raw/images")
 OUTPUT_ROOT = Path("output/yolo")
 ANNOTATED_DIR = OUTPUT_ROOT / "annotated"
 PRED_DIR = OUTPUT_ROOT / "predictions"
-
-ANNOTATED_DIR.mkdir(parents=True, exist_ok=True)
-PRED_DIR.mkdir(parents=True, exist_ok=True)
+MANIFEST_PATH = OUTPUT_ROOT / "manifest_run_yolo.json"  # images already processed, per model + conf
+PHASH_CACHE_PATH = OUTPUT_ROOT / "phash_cache.json"      # detections of images we have seen, by perceptual hash
 
 # ----------------------------
-# Load YOLO model
+# Inference settings
 # ----------------------------
-model = YOLO("yolov8n.pt")
-print("YOLOv8n model loaded successfully!")
+MODEL_WEIGHTS = os.getenv("YOLO_WEIGHTS", "yolov8n.pt")
+CONF_THRESHOLD = float(os.getenv("YOLO_CONF", "0.25"))
+IOU_THRESHOLD = float(os.getenv("YOLO_IOU", "0.7"))           # NMS, same for both backends
+BATCH_SIZE = int(os.getenv("YOLO_BATCH_SIZE", "16"))          # images per model call
+DECODE_WORKERS = int(os.getenv("YOLO_DECODE_WORKERS", "4"))   # threads reading/decoding ahead
+PREFETCH_BATCHES = int(os.getenv("YOLO_PREFETCH_BATCHES", "2"))  # decoded batches kept ready
+IMGSZ = int(os.getenv("YOLO_IMGSZ", "640"))
 
-# ----------------------------
-# Run inference
-# ----------------------------
-for channel_dir in IMAGE_ROOT.iterdir():
-    if not channel_dir.is_dir():
-        continue
-
-    channel_name = channel_dir.name
-    print(f"Processing channel: {channel_name}")
-
-    for img_path in channel_dir.glob("*.jpg"):
-        results = model(img_path, conf=0.25)
-
-        # Save annotated image
-        annotated_path = ANNOTATED_DIR / f"{channel_name}_{img_path.name}"
-        results[0].save(filename=str(annotated_path))
-
-        # Save predictions
-        detections = []
-        for box in results[0].boxes:
-            detections.append({
-                "class_id": int(box.cls),
-                "confidence": float(box.conf),
-                "bbox": box.xyxy[0].tolist()
-            })
-
-        pred_file = PRED_DIR / f"{channel_name}_{img_path.stem}.json"
-        with open(pred_file, "w") as f:
-            json.dump(detections, f, indent=2)
-
-print("Done!")
+# ultralytics (PyTorch) or onnx (ONNX Runtime on CPU; exports <weights>.onnx on first use)
+BACKEND = os.getenv("YOLO_BACKEND", "ultralytics")
+
+# Worker processes, each with its own model on a shard of the images (1 = run in this process)
+WORKERS = int(os.getenv("YOLO_WORKERS", "1"))
+THREADS_PER_WORKER = int(os.getenv("YOLO_THREADS_PER_WORKER", "0"))  # 0 = cores / workers
+
+# Also write detections straight to Postgres in the same pass (YOLO_DB_SINK=1)
+WRITE_TO_DB = os.getenv("YOLO_DB_SINK", "0") == "1"
+
+# Reprocess everything, ignoring the manifest (YOLO_FORCE=1)
+FORCE = os.getenv("YOLO_FORCE", "0") == "1"
+
+# Perceptual-hash detection cache for reposted images (YOLO_PHASH_CACHE=0 to disable)
+USE_PHASH_CACHE = os.getenv("YOLO_PHASH_CACHE", "1") == "1"
+PHASH_CACHE_SIZE = int(os.getenv("YOLO_PHASH_CACHE_SIZE", "50000"))
+PHASH_MAX_DISTANCE = int(os.getenv("YOLO_PHASH_MAX_DISTANCE", "5"))  # differing bits out of 64 (max 7)
+
+# Annotated images: all | sample | none (production runs rarely need them)
+ANNOTATE = os.getenv("YOLO_ANNOTATE", "all")
+ANNOTATE_SAMPLE_RATE = float(os.getenv("YOLO_ANNOTATE_SAMPLE_RATE", "0.05"))
+
+# Background writer stage: threads and queue size between the model and the disk
+WRITER_THREADS = int(os.getenv("YOLO_WRITER_THREADS", "2"))
+WRITER_QUEUE_SIZE = int(os.getenv("YOLO_WRITER_QUEUE", "64"))
+
+
+def build_phash_cache(signature):
+    if not USE_PHASH_CACHE:
+        return None
+    return PerceptualHashCache(str(PHASH_CACHE_PATH), signature,
+                               max_entries=PHASH_CACHE_SIZE, max_distance=PHASH_MAX_DISTANCE)
+
+
+def build_engine(sinks, signature):
+    cache = build_phash_cache(signature)
+    if WORKERS > 1:
+        return ShardedDetectionEngine(BACKEND, MODEL_WEIGHTS, sinks, conf=CONF_THRESHOLD, workers=WORKERS,
+                                      threads_per_worker=THREADS_PER_WORKER or None, batch_size=BATCH_SIZE,
+                                      imgsz=IMGSZ, cache=cache, iou=IOU_THRESHOLD)
+    backend = create_backend(BACKEND, MODEL_WEIGHTS, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD,
+                             threads=THREADS_PER_WORKER or None, imgsz=IMGSZ)
+    print(f"{MODEL_WEIGHTS} model loaded successfully! ({BACKEND} backend)")
+    return DetectionEngine(backend, sinks, batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS,
+                           prefetch_batches=PREFETCH_BATCHES, cache=cache)
+
+
+def main(channels=None):
+    # channels: only images under data/raw/images/<channel> for these channels (default: all)
+    # Only new or changed images (or everything, if the weights/threshold/backend changed)
+    # One run at a time per manifest and detection cache, whatever the orchestrator allows
+    with locked(MANIFEST_PATH, PHASH_CACHE_PATH):
+        signature = model_signature(MODEL_WEIGHTS, CONF_THRESHOLD, BACKEND, IOU_THRESHOLD)
+        manifest = EnrichmentManifest(str(MANIFEST_PATH), signature)
+        images = list_images(IMAGE_ROOT, channels)
+        if not FORCE:
+            images = manifest.filter(images)
+
+        # Outputs are written off the inference thread, in order for each image. The manifest marks an
+        # image once everything it gets is stored: after its files, or with YOLO_DB_SINK=1 once the
+        # upsert holding its rows is committed (a crash before the flush leaves it to the next run).
+        file_sinks = [PredictionFileSink(PRED_DIR)]
+        if ANNOTATE == "all":
+            file_sinks.append(AnnotatedImageSink(ANNOTATED_DIR))
+        elif ANNOTATE == "sample":
+            file_sinks.append(AnnotatedImageSink(ANNOTATED_DIR, sample_rate=ANNOTATE_SAMPLE_RATE))
+
+        conn = None
+        if WRITE_TO_DB:
+            from load_yolo_to_postgres import DB_CONFIG, DB_BATCH_SIZE
+
+            conn = psycopg2.connect(**DB_CONFIG)
+            file_sinks.append(PostgresSink(conn, batch_size=DB_BATCH_SIZE,
+                                           on_commit=lambda paths: [manifest.mark(p) for p in paths]))
+        else:
+            file_sinks.append(ManifestSink(manifest))
+        sinks = [BackgroundWriter(file_sinks, max_queue=WRITER_QUEUE_SIZE, threads=WRITER_THREADS)]
+
+        # ----------------------------
+        # Run batched inference, once per image
+        # ----------------------------
+        engine = build_engine(sinks, signature)
+        try:
+            with StageTracker("yolo", unit="images") as tracker:
+                stats = engine.run(tracker.count(images))
+                add_bytes_written(tracker, sinks)  # prediction files, annotated images, raw_yolo_json rows
+                tracker.set(backend=BACKEND, workers=WORKERS, cache_hits=stats["cache_hits"],
+                            model_images_per_second=stats["model_images_per_second"])
+        finally:
+            manifest.save()
+            if conn is not None:
+                conn.close()
+
+        print(f"Done! {stats['images']} images in {stats['elapsed_seconds']}s: "
+              f"{stats['images_per_second']} img/s end-to-end, "
+              f"{stats['model_images_per_second']} img/s in the model (batch size {BATCH_SIZE})")
+        print(f"Skipped {manifest.skipped} unchanged images already processed")
+        if USE_PHASH_CACHE:
+            print(f"Detection cache: {stats['cache_hits']} of {stats['images']} images "
+                  f"({stats['cache_hit_rate']:.1%}) reused detections of a near-duplicate")
+        return stats
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# src/scrape_state.py
+# Persisted per-channel high-water marks so scrapes only ask Telegram for new messages.
+
+import os
+import json
+from datetime import datetime
+
+STATE_PATH = "data/raw/state/scrape_state.json"
+
+
+class ScrapeState:
+    """Small JSON store: {channel: {last_message_id, last_date, oldest_message_id, ...}}.
+
+    - last_message_id / last_date: newest message we have (incremental scrapes use it as min_id)
+    - oldest_message_id: oldest message we have (backfill walks older history from here)
+    - backfill_complete: True once a backfill chunk came back short (start of channel reached)
+    """
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.channels = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.channels = json.load(f)
+
+    def get(self, channel):
+        return dict(self.channels.get(channel, {}))
+
+    def advance(self, channel, messages, backfill_complete=None):
+        """Move the channel's marks to cover `messages` (dicts with message_id and date)."""
+        entry = self.channels.setdefault(channel, {})
+        if messages:
+            newest = max(messages, key=lambda m: m["message_id"])
+            oldest = min(m["message_id"] for m in messages)
+            if newest["message_id"] > entry.get("last_message_id", 0):
+                entry["last_message_id"] = newest["message_id"]
+                entry["last_date"] = newest["date"]
+            if "oldest_message_id" not in entry or oldest < entry["oldest_message_id"]:
+                entry["oldest_message_id"] = oldest
+        if backfill_complete is not None:
+            entry["backfill_complete"] = backfill_complete
+        entry["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        return dict(entry)
+
+    def save(self):
+        # Write to a temp file and swap it in so a crash never leaves half a state file
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.channels, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -5,20 +5,28 @@
 # Beginner-friendly: Run this script to scrape Telegram medical channels and save to data lake
 
 import os
-import json
+import time
 from datetime import datetime
 from telethon.sync import TelegramClient
-from telethon.errors import SessionPasswordNeededError
+from telethon.errors import SessionPasswordNeededError, FloodWaitError
 from dotenv import load_dotenv
 from tqdm import tqdm
-import pandas as pd
 import asyncio
 
+from rate_limiter import TokenBucket
+from scrape_state import ScrapeState, STATE_PATH
+from stream_writer import NDJSONWriter, CSVWriter, StreamingSink
+from parquet_lake import ParquetLakeWriter, LAKE_DIR, MANIFEST_NAME
+from file_lock import locked
+from instrumentation import StageTracker
+
 # Load secrets from .env
 load_dotenv()
-api_id = int(os.getenv("API_ID"))
+# Read here, used when main() runs, so the module can be imported (e.g. by the Dagster pipeline) without them
+api_id = os.getenv("API_ID")
 api_hash = os.getenv("API_HASH")
 phone = os.getenv("PHONE")
+SESSION_NAME = "session_name"  # Telethon keeps the login in <SESSION_NAME>.session
 
 # Folders
 RAW_JSON_DIR = "data/raw/json"
@@ -36,79 +44,326 @@ channels = [
     "tikvahpharma"
 ]
 
-async def scrape_channel(client, channel_username, limit=500):
-    print(f"Scraping channel: {channel_username} (max {limit} messages)")
-    
+# Concurrency: how many channels are scraped at the same time (1 = one after another)
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "4"))
+
+# Shared rate limit for the single TelegramClient (API requests per second + burst)
+SCRAPE_REQUESTS_PER_SECOND = float(os.getenv("SCRAPE_REQUESTS_PER_SECOND", "2"))
+SCRAPE_BURST = int(os.getenv("SCRAPE_BURST", "5"))
+
+# History is requested in pages of this many messages (one API request, one limiter token each)
+PAGE_SIZE = 100
+
+# Give up on a channel after this many FloodWaitErrors in a row
+MAX_FLOOD_RETRIES = 5
+
+# Scrape mode:
+#   incremental - only messages newer than the channel's high-water mark (default)
+#   backfill    - walk older history below the oldest message we have, in resumable chunks
+#   full        - ignore saved state and take the newest `limit` messages
+SCRAPE_MODE = os.getenv("SCRAPE_MODE", "incremental")
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", "1000"))
+BACKFILL_MAX_CHUNKS = int(os.getenv("BACKFILL_MAX_CHUNKS", "10"))  # per channel per run
+
+# Streaming output: flush to disk every N messages, start a new file by size or age
+FLUSH_EVERY = int(os.getenv("SCRAPE_FLUSH_EVERY", "500"))
+ROTATE_MAX_BYTES = int(os.getenv("SCRAPE_ROTATE_MAX_MB", "64")) * 1024 * 1024
+ROTATE_MAX_AGE_SECONDS = int(os.getenv("SCRAPE_ROTATE_MAX_SECONDS", "3600"))
+CSV_COLUMNS = ['message_id', 'date', 'text', 'views', 'forwards', 'media_type', 'channel_username']
+
+# Also write the partitioned Parquet lake (data/lake/messages/channel=.../message_date=...)
+WRITE_PARQUET_LAKE = os.getenv("SCRAPE_PARQUET_LAKE", "1") == "1"
+
+async def call_with_flood_wait(limiter, channel_username, func, *args, **kwargs):
+    for attempt in range(MAX_FLOOD_RETRIES + 1):
+        await limiter.acquire()
+        try:
+            return await func(*args, **kwargs)
+        except FloodWaitError as e:
+            if attempt == MAX_FLOOD_RETRIES:
+                raise
+            print(f"FloodWait on {channel_username}: sleeping {e.seconds}s")
+            limiter.pause(e.seconds)
+            await asyncio.sleep(e.seconds)
+
+
+def message_to_dict(message, channel_username):
+    return {
+        'message_id': message.id,
+        'date': message.date.isoformat() if message.date else None,
+        'text': message.message or "",
+        'views': message.views or 0,
+        'forwards': message.forwards or 0,
+        'media_type': message.media.__class__.__name__ if message.media else "None",
+        'channel_username': channel_username
+    }
+
+async def fetch_messages(client, entity, channel_username, limiter, stats, sink,
+                         limit=None, offset_id=0, reverse=False):
+    # Streams messages into `sink` and returns (count, id of the last message seen).
+    # Default order is newest-first below offset_id; reverse=True walks oldest-first
+    # above offset_id, so an interrupted incremental run never leaves a gap behind it.
+    count = 0
+    flood_retries = 0
+
+    while limit is None or count < limit:
+        page_limit = PAGE_SIZE if limit is None else min(PAGE_SIZE, limit - count)
+        page_count = 0
+        # One token per page request; wait_time=0 leaves all pacing to the shared limiter
+        await limiter.acquire()
+        try:
+            async for message in client.iter_messages(
+                entity, limit=page_limit, offset_id=offset_id, reverse=reverse, wait_time=0
+            ):
+                sink.write(message_to_dict(message, channel_username))
+                count += 1
+                page_count += 1
+                offset_id = message.id  # the next page (or a FloodWait resume) starts after it
+        except FloodWaitError as e:
+            stats["flood_waits"] += 1
+            flood_retries += 1
+            if flood_retries > MAX_FLOOD_RETRIES:
+                print(f"Too many FloodWaits on {channel_username}, keeping {count} messages")
+                stats["error"] = f"FloodWaitError x{flood_retries}"
+                break
+            print(f"FloodWait on {channel_username}: sleeping {e.seconds}s, resuming after id {offset_id}")
+            limiter.pause(e.seconds)
+            await asyncio.sleep(e.seconds)
+            continue
+        flood_retries = 0
+        if page_count < page_limit:
+            break  # short page: nothing more in this direction
+
+    return count, offset_id
+
+async def scrape_channel(client, channel_username, sink, limit=500, limiter=None,
+                         channel_state=None, mode=SCRAPE_MODE, held_marks=None):
+    channel_state = channel_state or {}
+    held_marks = held_marks if held_marks is not None else {}
+    limiter = limiter or TokenBucket(SCRAPE_REQUESTS_PER_SECOND, SCRAPE_BURST)
+    start_time = time.perf_counter()
+    stats = {"channel": channel_username, "mode": mode, "messages": 0, "flood_waits": 0,
+             "error": None, "backfill_complete": None}
+
     try:
-        entity = await client.get_entity(channel_username)
+        entity = await call_with_flood_wait(limiter, channel_username, client.get_entity, channel_username)
     except Exception as e:
         print(f"Error getting entity for {channel_username}: {e}")
-        return []
-
-    messages = []
-    async for message in client.iter_messages(entity, limit=limit):
-        msg_data = {
-            'message_id': message.id,
-            'date': message.date.isoformat() if message.date else None,
-            'text': message.message or "",
-            'views': message.views or 0,
-            'forwards': message.forwards or 0,
-            'media_type': message.media.__class__.__name__ if message.media else "None",
-            'channel_username': channel_username
-        }
-        messages.append(msg_data)
-    
-    print(f"Scraped {len(messages)} messages from {channel_username}")
-    return messages
-
-async def main():
-    client = TelegramClient('session_name', api_id, api_hash)
-    
-    try:
-        await client.start(phone=phone)
-        print("Logged in successfully!")
-    except SessionPasswordNeededError:
-        password = input("Two-step verification enabled. Please enter password: ")
-        await client.sign_in(password=password)
-        print("Logged in with password!")
-    except Exception as e:
-        print(f"Login error: {e}")
-        return
-
-    all_messages = []
-
-    for channel in tqdm(channels, desc="Scraping channels"):
-        messages = await scrape_channel(client, channel, limit=500)  # adjust limit for more data
-        all_messages.extend(messages)
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    # Save raw JSON
-    json_path = os.path.join(RAW_JSON_DIR, f"telegram_raw_{timestamp}.json")
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(all_messages, f, ensure_ascii=False, indent=2)
-    print(f"Saved raw JSON: {json_path}")
-
-    # Save flattened CSV
-    df = pd.DataFrame(all_messages)
-    csv_path = os.path.join(RAW_CSV_DIR, f"telegram_flat_{timestamp}.csv")
-    df.to_csv(csv_path, index=False, encoding='utf-8')
-    print(f"Saved CSV: {csv_path}")
-
-    # Log summary
-    summary = {
-        "timestamp": timestamp,
-        "total_messages": len(all_messages),
-        "channels_scraped": channels,
-        "json_file": json_path,
-        "csv_file": csv_path
-    }
-    log_path = os.path.join(LOGS_DIR, f"scrape_summary_{timestamp}.json")
-    with open(log_path, 'w') as f:
-        json.dump(summary, f, indent=2)
-    print(f"Log saved: {log_path}")
+        stats["error"] = str(e)
+        stats["elapsed_seconds"] = round(time.perf_counter() - start_time, 2)
+        stats["messages_per_second"] = 0.0
+        return stats
+
+    last_id = channel_state.get("last_message_id")
+    total = 0
+
+    if mode == "backfill":
+        # Walk older history below the oldest message we have, chunk by chunk
+        if channel_state.get("backfill_complete"):
+            print(f"Backfill already complete for {channel_username}")
+        else:
+            offset_id = channel_state.get("oldest_message_id", 0)
+            print(f"Backfilling {channel_username} below id {offset_id or 'newest'} "
+                  f"({BACKFILL_MAX_CHUNKS} x {BACKFILL_CHUNK_SIZE} messages)")
+            stats["backfill_complete"] = False
+            for _ in range(BACKFILL_MAX_CHUNKS):
+                count, offset_id = await fetch_messages(client, entity, channel_username, limiter, stats,
+                                                        sink, limit=BACKFILL_CHUNK_SIZE, offset_id=offset_id)
+                total += count
+                if stats["error"]:
+                    break
+                if count < BACKFILL_CHUNK_SIZE:
+                    stats["backfill_complete"] = True
+                    break
+    elif mode == "incremental" and last_id:
+        print(f"Scraping channel: {channel_username} (new messages after id {last_id})")
+        total, _ = await fetch_messages(client, entity, channel_username, limiter, stats, sink,
+                                        offset_id=last_id, reverse=True)
+    elif last_id:
+        # Full mode over a channel we already have: newest-first, so the high-water mark may
+        # only move once the fetch has reached back to it, otherwise the gap would be skipped
+        print(f"Scraping channel: {channel_username} (max {limit} messages)")
+        hold = held_marks.setdefault(channel_username, HeldMarks())
+        total, oldest_seen = await fetch_messages(client, entity, channel_username, limiter, stats, sink,
+                                                  limit=limit)
+        reached = not stats["error"] and (total < limit or oldest_seen <= last_id)
+        hold.release(reached)
+        if not reached:
+            print(f"{channel_username}: did not reach id {last_id}, keeping the high-water mark")
+    else:
+        # First run of a channel we have no state for (older history is left to backfill)
+        print(f"Scraping channel: {channel_username} (max {limit} messages)")
+        total, _ = await fetch_messages(client, entity, channel_username, limiter, stats, sink,
+                                        limit=limit)
+
+    elapsed = time.perf_counter() - start_time
+    stats["messages"] = total
+    stats["elapsed_seconds"] = round(elapsed, 2)
+    stats["messages_per_second"] = round(total / elapsed, 2) if elapsed > 0 else 0.0
+    print(f"Scraped {total} messages from {channel_username} "
+          f"in {elapsed:.1f}s ({stats['messages_per_second']} msg/s)")
+    return stats
+
+async def scrape_all(client, channel_list, state, sink, limit=500, concurrency=SCRAPE_CONCURRENCY,
+                     mode=SCRAPE_MODE, held_marks=None):
+    # One limiter for the one client: channels run together but share the request budget
+    limiter = TokenBucket(SCRAPE_REQUESTS_PER_SECOND, SCRAPE_BURST)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    progress = tqdm(total=len(channel_list), desc="Scraping channels")
+
+    async def run_one(channel):
+        async with semaphore:
+            try:
+                return await scrape_channel(client, channel, sink, limit=limit, limiter=limiter,
+                                            channel_state=state.get(channel), mode=mode,
+                                            held_marks=held_marks)
+            finally:
+                progress.update(1)
+
+    results = await asyncio.gather(*(run_one(channel) for channel in channel_list))
+    progress.close()
+    return results
+
+class HeldMarks:
+    """Records of a newest-first fetch, kept out of the state until the fetch is known to be complete."""
+
+    def __init__(self):
+        self.records = []
+        self.reached = None  # None while fetching, then whether the fetch reached the old mark
+        self.state = self.channel = None
+
+    def add(self, state, channel, records):
+        if self.reached is None:
+            self.state, self.channel = state, channel
+            self.records.extend(records)
+        elif self.reached:
+            state.advance(channel, records)
+
+    def release(self, reached):
+        self.reached = reached
+        if reached and self.records:
+            self.state.advance(self.channel, self.records)
+            self.state.save()
+        self.records = []
+
+
+def advance_state(state, batch, held_marks=None):
+    # Called by the sink once a batch is on disk: only then move the high-water marks
+    held_marks = held_marks or {}
+    by_channel = {}
+    for record in batch:
+        by_channel.setdefault(record["channel_username"], []).append(record)
+    for channel, records in by_channel.items():
+        if channel in held_marks:
+            held_marks[channel].add(state, channel, records)
+        else:
+            state.advance(channel, records)
+    state.save()
+
+async def main(channel_list=None):
+    # channel_list: scrape only these channels (default: all of `channels`)
+    channel_list = channel_list or channels
+    # One run at a time per state file and Telegram session, whatever the orchestrator allows
+    with locked(STATE_PATH, SESSION_NAME + ".session", os.path.join(LAKE_DIR, MANIFEST_NAME)):
+        client = TelegramClient(SESSION_NAME, int(api_id), api_hash)
+        # Started before login, so failed runs are recorded in the stage metrics too
+        tracker = StageTracker("scrape", unit="messages").start()
+
+        try:
+            await client.start(phone=phone)
+            print("Logged in successfully!")
+        except SessionPasswordNeededError:
+            password = input("Two-step verification enabled. Please enter password: ")
+            await client.sign_in(password=password)
+            print("Logged in with password!")
+        except Exception as e:
+            print(f"Login error: {e}")
+            tracker.set(error=f"login: {e}")
+            tracker.finish("failed")
+            return
+
+        run_start = time.perf_counter()
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        state = ScrapeState()
+        held_marks = {}  # channel -> HeldMarks, for newest-first fetches over existing state
+
+        # Messages are streamed to NDJSON + CSV as they arrive (flat memory, crash-safe)
+        rotation = {"max_bytes": ROTATE_MAX_BYTES, "max_age_seconds": ROTATE_MAX_AGE_SECONDS}
+        json_writer = NDJSONWriter(RAW_JSON_DIR, "telegram_raw", timestamp, **rotation)
+        csv_writer = CSVWriter(RAW_CSV_DIR, "telegram_flat", timestamp, CSV_COLUMNS, **rotation)
+        writers = [json_writer, csv_writer]
+        if WRITE_PARQUET_LAKE:
+            lake_writer = ParquetLakeWriter(timestamp)
+            writers.append(lake_writer)
+        log_path = os.path.join(LOGS_DIR, f"scrape_summary_{timestamp}.json")
+        sink = StreamingSink(
+            writers,
+            summary_path=log_path,
+            batch_size=FLUSH_EVERY,
+            on_flush=lambda batch: advance_state(state, batch, held_marks),
+            summary_extra={"timestamp": timestamp, "channels_scraped": channel_list,
+                           "mode": SCRAPE_MODE, "concurrency": SCRAPE_CONCURRENCY},
+        )
+
+        try:
+            channel_stats = await scrape_all(client, channel_list, state, sink,
+                                             limit=500,  # adjust limit for more data
+                                             held_marks=held_marks)
+        except BaseException as e:
+            # Write out and close every writer (the lake buffers) before giving up
+            sink.close(status="failed", error=repr(e))
+            for channel, count in sink.records_per_channel.items():
+                tracker.add(items=count, channel=channel)
+            tracker.add(bytes_written=sum(w.bytes_written for w in writers))
+            tracker.set(mode=SCRAPE_MODE, error=repr(e))
+            tracker.finish("failed")
+            raise
+        finally:
+            # Whatever happens, flush what we have so the next run resumes from it
+            sink.flush()
+
+        run_elapsed = time.perf_counter() - run_start
+        print("\nPer-channel throughput:")
+        for stats in channel_stats:
+            print(f"  {stats['channel']:<20} {stats['messages']:>6} msgs  "
+                  f"{stats['elapsed_seconds']:>7.1f}s  {stats['messages_per_second']:>7.2f} msg/s  "
+                  f"floodwaits={stats['flood_waits']}")
+        print(f"Total: {sink.total_records} messages in {run_elapsed:.1f}s "
+              f"(mode={SCRAPE_MODE}, concurrency={SCRAPE_CONCURRENCY})")
+
+        for stats in channel_stats:
+            if stats["backfill_complete"] is not None:
+                state.advance(stats["channel"], [], backfill_complete=stats["backfill_complete"])
+        state.save()
+
+        sink.close(elapsed_seconds=round(run_elapsed, 2), channel_stats=channel_stats)
+
+        # Bytes are known per run (writers hold every channel), messages and time per channel
+        for stats in channel_stats:
+            tracker.add(items=stats["messages"], channel=stats["channel"])
+            tracker.channel_time(stats["channel"], stats["elapsed_seconds"])
+        tracker.add(bytes_written=sum(w.bytes_written for w in writers))
+        failed_channels = [s["channel"] for s in channel_stats if s["error"]]
+        tracker.set(mode=SCRAPE_MODE, flood_waits=sum(s["flood_waits"] for s in channel_stats),
+                    failed_channels=failed_channels)
+        tracker.finish("failed" if failed_channels and len(failed_channels) == len(channel_stats) else "ok")
+
+        print(f"Saved raw NDJSON: {', '.join(json_writer.files) or '(no new messages)'}")
+        print(f"Saved CSV: {', '.join(csv_writer.files) or '(no new messages)'}")
+        if WRITE_PARQUET_LAKE:
+            print(f"Parquet lake: {len(lake_writer.files)} new part files under {LAKE_DIR}")
+        print(f"Log saved: {log_path}")
+
+        print("Task 1 complete! Data lake populated in data/raw/")
+        return channel_stats
+
 
-    print("Task 1 complete! Data lake populated in data/raw/")
+def run(channel_list=None):
+    """Scrape from other Python code (the pipeline). Returns per-channel stats."""
+    channel_stats = asyncio.run(main(channel_list))
+    if channel_stats is None:
+        raise RuntimeError("Telegram login failed")
+    return channel_stats
 
 # Run the script
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+# src/stream_writer.py
+# Streaming, constant-memory output for the scraper.
+# Records are buffered in small batches and appended to disk as they arrive,
+# so memory stays flat and a crash only loses the last unflushed batch.
+
+import os
+import csv
+import json
+import time
+from datetime import datetime
+
+
+class RotatingFileWriter:
+    """Appends batches to `<directory>/<prefix>_<run_id>_<seq><suffix>`.
+
+    A new file is started when the current one grows past `max_bytes` or is
+    older than `max_age_seconds`. Subclasses implement `_write_batch`.
+    """
+
+    suffix = ""
+
+    def __init__(self, directory, prefix, run_id, max_bytes=64 * 1024 * 1024, max_age_seconds=3600):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.run_id = run_id
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.files = []
+        self.bytes_written = 0
+        self._file = None
+        self._opened_at = 0.0
+        self._seq = 0
+
+    def _needs_rotation(self):
+        if self._file is None:
+            return True
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            return True
+        return bool(self.max_age_seconds) and time.monotonic() - self._opened_at >= self.max_age_seconds
+
+    def _rotate(self):
+        self.close()
+        self._seq += 1
+        path = os.path.join(self.directory, f"{self.prefix}_{self.run_id}_{self._seq:04d}{self.suffix}")
+        self._file = open(path, "a", encoding="utf-8", newline="")
+        self._opened_at = time.monotonic()
+        self.files.append(path)
+        self._on_open()
+
+    def _on_open(self):
+        pass
+
+    def _write_batch(self, records):
+        raise NotImplementedError
+
+    def write_batch(self, records):
+        if not records:
+            return
+        if self._needs_rotation():
+            self._rotate()
+        start = self._file.tell()
+        self._write_batch(records)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.bytes_written += self._file.tell() - start
+
+    def flush(self):
+        # write_batch already fsyncs every batch
+        pass
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class NDJSONWriter(RotatingFileWriter):
+    """One JSON object per line - appendable and readable line by line."""
+
+    suffix = ".ndjson"
+
+    def _write_batch(self, records):
+        self._file.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+
+
+class CSVWriter(RotatingFileWriter):
+    """Flat CSV with a header at the top of every rotated file."""
+
+    suffix = ".csv"
+
+    def __init__(self, directory, prefix, run_id, fieldnames, **kwargs):
+        super().__init__(directory, prefix, run_id, **kwargs)
+        self.fieldnames = fieldnames
+        self._writer = None
+
+    def _on_open(self):
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, extrasaction="ignore")
+        if self._file.tell() == 0:
+            self._writer.writeheader()
+
+    def _write_batch(self, records):
+        self._writer.writerows(records)
+
+
+class StreamingSink:
+    """Fans records out to several writers, flushing every `batch_size` records.
+
+    Every writer is flushed before `on_flush(records)` is called, so the batch
+    is durable in all of them (writers that buffer, like the Parquet lake,
+    write out what they hold); the scraper uses it to advance its high-water
+    marks, which makes runs restartable after a crash. The summary file is
+    rewritten on every flush.
+    """
+
+    def __init__(self, writers, summary_path, batch_size=500, on_flush=None, summary_extra=None):
+        self.writers = writers
+        self.summary_path = summary_path
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.summary_extra = dict(summary_extra or {})
+        self.buffer = []
+        self.total_records = 0
+        self.records_per_channel = {}
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        for writer in self.writers:
+            writer.write_batch(batch)
+            writer.flush()
+        self.total_records += len(batch)
+        for record in batch:
+            channel = record.get("channel_username")
+            self.records_per_channel[channel] = self.records_per_channel.get(channel, 0) + 1
+        if self.on_flush:
+            self.on_flush(batch)
+        self.write_summary(status="running")
+
+    def write_summary(self, status, **extra):
+        self.summary_extra.update(extra)
+        summary = {
+            "status": status,
+            "started_at": self.started_at,
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "total_messages": self.total_records,
+            "messages_per_channel": self.records_per_channel,
+            "files": {type(w).__name__: w.files for w in self.writers},
+            "bytes_written": sum(w.bytes_written for w in self.writers),
+            **self.summary_extra,
+        }
+        tmp_path = self.summary_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp_path, self.summary_path)
+
+    def close(self, status="complete", **extra):
+        self.flush()
+        for writer in self.writers:
+            writer.close()
+        self.write_summary(status=status, **extra)
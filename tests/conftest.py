@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The pipeline scripts import each other as siblings from src/. Appended, not prepended:
+# src/api.py must not shadow the api package at the repository root.
+if str(ROOT / "src") not in sys.path:
+    sys.path.append(str(ROOT / "src"))
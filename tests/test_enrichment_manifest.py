@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from enrichment_manifest import EnrichmentManifest, model_signature
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "1.jpg"
+    path.write_bytes(b"jpeg bytes")
+    return path
+
+
+def manifest_at(tmp_path, signature="sig"):
+    return EnrichmentManifest(str(tmp_path / "manifest.json"), signature)
+
+
+def test_new_input_needs_processing_until_marked(tmp_path, image):
+    manifest = manifest_at(tmp_path)
+    assert manifest.needs_processing(image)
+    manifest.mark(image)
+    assert not manifest.needs_processing(image)
+    assert manifest.skipped == 1
+
+
+def test_marks_survive_a_reload(tmp_path, image):
+    manifest = manifest_at(tmp_path)
+    manifest.mark(image)
+    manifest.save()
+    assert not manifest_at(tmp_path).needs_processing(image)
+
+
+def test_signature_change_invalidates_everything(tmp_path, image):
+    manifest = manifest_at(tmp_path)
+    manifest.mark(image)
+    manifest.save()
+    assert manifest_at(tmp_path, signature="other weights").needs_processing(image)
+
+
+def test_touched_but_unchanged_file_is_skipped_by_hash(tmp_path, image):
+    manifest = manifest_at(tmp_path)
+    manifest.mark(image)
+    stat = os.stat(image)
+    os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert not manifest.needs_processing(image)
+    assert manifest.entries[str(image)]["mtime_ns"] == stat.st_mtime_ns + 10**9
+
+
+def test_changed_content_needs_processing(tmp_path, image):
+    manifest = manifest_at(tmp_path)
+    manifest.mark(image)
+    stat = os.stat(image)
+    image.write_bytes(b"JPEG BYTES")  # same size, new hash
+    os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert manifest.needs_processing(image)
+    image.write_bytes(b"longer jpeg bytes")
+    assert manifest.needs_processing(image)
+
+
+def test_filter_yields_only_inputs_to_process(tmp_path, image):
+    other = tmp_path / "2.jpg"
+    other.write_bytes(b"other")
+    manifest = manifest_at(tmp_path)
+    manifest.mark(image)
+    items = [("chan", image), ("chan", other)]
+    assert list(manifest.filter(items)) == [("chan", other)]
+
+
+def test_signature_covers_backend_and_non_default_iou():
+    assert model_signature("missing.pt", 0.25) == "missing.pt|conf=0.25"
+    assert model_signature("missing.pt", 0.25, "onnx") != model_signature("missing.pt", 0.25)
+    assert model_signature("missing.pt", 0.25, iou=0.5) != model_signature("missing.pt", 0.25)
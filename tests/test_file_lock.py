@@ -0,0 +1,39 @@
+import threading
+import time
+
+from file_lock import locked
+
+
+def test_second_holder_waits_for_the_first(tmp_path):
+    path = tmp_path / "state.json"
+    events = []
+
+    def second():
+        with locked(path, poll_seconds=0.01):
+            events.append("second")
+
+    with locked(path):
+        thread = threading.Thread(target=second)
+        thread.start()
+        time.sleep(0.1)
+        events.append("first done")
+    thread.join(timeout=5)
+
+    assert events == ["first done", "second"]
+
+
+def test_locks_are_taken_in_sorted_order(tmp_path):
+    a, b = tmp_path / "a.json", tmp_path / "b.json"
+    done = []
+
+    def other_order():
+        with locked(b, a, poll_seconds=0.01):
+            done.append(True)
+
+    with locked(a, b):
+        thread = threading.Thread(target=other_order)
+        thread.start()
+    thread.join(timeout=5)
+
+    assert done == [True]
+    assert (tmp_path / "a.json.lock").exists() and (tmp_path / "b.json.lock").exists()
@@ -0,0 +1,50 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi import HTTPException  # noqa: E402
+
+# src/api.py shares its module name with the api package, so load it under another name
+_spec = importlib.util.spec_from_file_location(
+    "raw_api", Path(__file__).resolve().parent.parent / "src" / "api.py")
+raw_api = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(raw_api)
+
+
+@pytest.mark.parametrize("values, types", [
+    ([123, "CheMed123"], (int, str)),   # /messages: (message_id, channel_username)
+    ([0.87, 42], (float, int)),         # /image-detections: (confidence, id)
+    ([1, 42], (float, int)),
+    ([5, "ቅናሽ"], (int, str)),
+])
+def test_cursor_round_trip(values, types):
+    cursor = raw_api.encode_cursor(values)
+    assert cursor.isascii() and "/" not in cursor and "+" not in cursor  # safe in a query string
+    assert raw_api.decode_cursor(cursor, types) == values
+
+
+def test_no_cursor_means_first_page():
+    assert raw_api.decode_cursor(None, (int, str)) is None
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    raw_api.encode_cursor({"id": 1}),
+    raw_api.encode_cursor([1]),
+    raw_api.encode_cursor(["123", "CheMed123"]),     # message_id as a string
+    raw_api.encode_cursor([123, ["CheMed123"]]),     # nested list
+    raw_api.encode_cursor([123, None]),
+    raw_api.encode_cursor([True, "CheMed123"]),
+    raw_api.encode_cursor([1.5, "CheMed123"]),
+])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        raw_api.decode_cursor(cursor, (int, str))
+    assert error.value.status_code == 400
+
+
+def test_detection_cursor_needs_a_number_and_an_id():
+    with pytest.raises(HTTPException):
+        raw_api.decode_cursor(raw_api.encode_cursor(["0.87", 42]), (float, int))
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+import phash_cache
+from phash_cache import PerceptualHashCache, dhash
+
+KEY = 0x0F0F_0F0F_0F0F_0F0F  # 32 bits set: informative
+DETECTIONS = [{"class_id": 39, "confidence": 0.9, "bbox": [0.1, 0.2, 0.5, 0.6]}]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = PerceptualHashCache(str(tmp_path / "phash.json"), "sig", max_distance=5)
+    cache.merge([(KEY, DETECTIONS)])
+    return cache
+
+
+def lookup_with_hash(cache, monkeypatch, key, size=(100, 200)):
+    monkeypatch.setattr(phash_cache, "dhash", lambda image: key)
+    return cache.lookup(np.zeros(size + (3,), dtype=np.uint8))
+
+
+def flip_bits(key, count):
+    # one bit in each of `count` different bands
+    for band in range(count):
+        key ^= 1 << (band * phash_cache.BAND_BITS)
+    return key
+
+
+@pytest.mark.parametrize("distance", [0, 1, 5])
+def test_hashes_within_max_distance_match(cache, monkeypatch, distance):
+    detections = lookup_with_hash(cache, monkeypatch, flip_bits(KEY, distance))
+    # bboxes come back in the pixels of the looked-up image (200 wide, 100 high)
+    assert detections == [{"class_id": 39, "confidence": 0.9, "bbox": [20.0, 20.0, 100.0, 60.0]}]
+
+
+def test_hashes_beyond_max_distance_miss(cache, monkeypatch):
+    assert lookup_with_hash(cache, monkeypatch, flip_bits(KEY, 6)) is None
+    assert cache.misses == 1
+
+
+def test_uninformative_hashes_never_match(cache, monkeypatch):
+    cache.merge([(0b111, DETECTIONS)])
+    assert lookup_with_hash(cache, monkeypatch, 0b111) is None
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = PerceptualHashCache(str(tmp_path / "phash.json"), "sig", max_entries=2)
+    others = [KEY << 1 & (2 ** 64 - 1), KEY << 2 & (2 ** 64 - 1)]
+    cache.merge([(KEY, DETECTIONS), (others[0], DETECTIONS), (others[1], DETECTIONS)])
+    assert list(cache.entries) == others
+    assert all(KEY not in keys for band in cache.bands for keys in band.values())
+
+
+def test_cache_is_dropped_when_the_model_changes(tmp_path, cache):
+    cache.save()
+    assert len(PerceptualHashCache(cache.path, "sig").entries) == 1
+    assert len(PerceptualHashCache(cache.path, "other-model").entries) == 0
+
+
+def test_resized_image_hashes_close_to_the_original():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, (64, 64, 3), dtype=np.uint8).repeat(4, axis=0).repeat(4, axis=1)
+    resized = image[::2, ::2]
+    assert phash_cache.hamming(dhash(image), dhash(resized)) <= 5
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+from query_cache import QueryCache
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, value="result"):
+        self.calls += 1
+        return value
+
+
+def test_hit_until_ttl_expires():
+    cache, compute = QueryCache(ttl=0.05), Counter()
+    assert cache.get_or_compute(("report",), compute) == "result"
+    assert cache.get_or_compute(("report",), compute) == "result"
+    assert compute.calls == 1
+
+    time.sleep(0.06)
+    cache.get_or_compute(("report",), compute)
+    assert compute.calls == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache, compute = QueryCache(maxsize=2), Counter()
+    cache.get_or_compute(("a",), compute)
+    cache.get_or_compute(("b",), compute)
+    cache.get_or_compute(("a",), compute)  # a is now the most recently used
+    cache.get_or_compute(("c",), compute)
+
+    assert cache.evictions == 1
+    assert compute.calls == 3
+    cache.get_or_compute(("a",), compute)
+    assert compute.calls == 3
+    cache.get_or_compute(("b",), compute)
+    assert compute.calls == 4
+
+
+def test_concurrent_misses_share_one_computation():
+    cache, compute = QueryCache(), Counter()
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return compute()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute(("report",), slow)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)  # let every thread reach the cache
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["result"] * 5
+    assert compute.calls == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_concurrent_async_misses_share_one_computation():
+    cache, compute = QueryCache(), Counter()
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return compute()
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute_async(("report",), slow) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["result"] * 5
+    assert compute.calls == 1
+
+
+def test_result_of_a_query_overlapping_invalidate_is_not_stored():
+    cache, compute = QueryCache(), Counter()
+
+    def invalidated_while_running():
+        cache.invalidate()
+        return compute()
+
+    cache.get_or_compute(("report",), invalidated_while_running)
+    cache.get_or_compute(("report",), compute)
+    assert compute.calls == 2
+
+
+def test_invalidate_by_name():
+    cache, compute = QueryCache(), Counter()
+    cached_report = cache.cached("report")(lambda db, day: compute(day))
+    cached_other = cache.cached("other")(lambda db: compute())
+    cached_report(None, "2025-01-01")
+    cached_other(None)
+
+    assert cache.invalidate("report") == 1
+    cached_other(None)
+    assert compute.calls == 2
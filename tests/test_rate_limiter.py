@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from rate_limiter import TokenBucket
+
+
+def test_burst_is_served_without_waiting():
+    async def run():
+        bucket = TokenBucket(rate=1, capacity=5)
+        for _ in range(5):
+            await bucket.acquire()
+        return bucket
+
+    bucket = asyncio.run(run())
+    assert bucket.total_wait == 0.0
+
+
+def test_requests_beyond_the_burst_are_paced_at_the_rate():
+    async def run():
+        bucket = TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return bucket, time.monotonic() - start
+
+    bucket, elapsed = asyncio.run(run())
+    # 2 tokens from the burst, then 2 more at 20/s
+    assert 0.08 <= elapsed < 0.5
+    assert bucket.total_wait > 0.08
+
+
+def test_pause_blocks_every_caller():
+    async def run():
+        bucket = TokenBucket(rate=100, capacity=10)
+        bucket.pause(0.1)
+        start = time.monotonic()
+        await asyncio.gather(bucket.acquire(), bucket.acquire())
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.1
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from parquet_lake import ParquetLakeWriter, load_manifest, read_messages
+from scrape_state import ScrapeState
+from stream_writer import NDJSONWriter, StreamingSink
+
+
+def make_records(channel, ids):
+    return [{"message_id": i, "date": "2025-12-01T10:00:00+00:00", "text": f"msg {i}", "views": i,
+             "forwards": 0, "media_type": "None", "channel_username": channel} for i in ids]
+
+
+@pytest.fixture
+def scrape(tmp_path):
+    state = ScrapeState(str(tmp_path / "state.json"))
+    lake_dir = str(tmp_path / "lake")
+    writers = [NDJSONWriter(str(tmp_path / "json"), "raw", "run1"), ParquetLakeWriter("run1", lake_dir)]
+
+    def on_flush(batch):
+        for record in batch:
+            state.advance(record["channel_username"], [record])
+        state.save()
+
+    sink = StreamingSink(writers, str(tmp_path / "summary.json"), batch_size=500, on_flush=on_flush)
+    return sink, state, lake_dir
+
+
+def test_lake_holds_everything_the_state_covers_after_a_mid_run_exception(tmp_path, scrape):
+    sink, state, lake_dir = scrape
+    with pytest.raises(RuntimeError):
+        try:
+            for record in make_records("chan", range(1, 11)):
+                sink.write(record)
+            raise RuntimeError("connection lost")
+        except BaseException as e:
+            # What scraper.main does on failure
+            sink.close(status="failed", error=repr(e))
+            raise
+
+    assert ScrapeState(state.path).get("chan")["last_message_id"] == 10
+    assert sum(p["rows"] for p in load_manifest(lake_dir)["partitions"].values()) == 10
+    assert sorted(read_messages(["message_id"], lake_dir=lake_dir)["message_id"]) == list(range(1, 11))
+    with open(tmp_path / "summary.json", encoding="utf-8") as f:
+        assert json.load(f)["status"] == "failed"
+
+
+def test_every_flush_writes_the_lake_buffer_before_marks_move(scrape):
+    sink, state, lake_dir = scrape
+    for record in make_records("chan", range(1, 4)):
+        sink.write(record)
+    sink.flush()
+
+    lake_writer = sink.writers[1]
+    assert lake_writer.buffered_rows == 0
+    assert state.get("chan")["last_message_id"] == 3
+    assert len(read_messages(["message_id"], channels=["chan"], lake_dir=lake_dir)) == 3
@@ -0,0 +1,46 @@
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+
+jinja2 = pytest.importorskip("jinja2")
+
+MACRO = Path(__file__).resolve().parent.parent / "medical_warehouse" / "macros" / "surrogate_key.sql"
+
+
+def surrogate_key(columns):
+    module = jinja2.Environment(undefined=jinja2.StrictUndefined).from_string(MACRO.read_text()).make_module({})
+    return str(module.surrogate_key(columns))
+
+
+def expected_key(*values):
+    """What the macro computes: first 64 bits of md5 over the '|'-joined values, as a signed bigint."""
+    text = "|".join("" if v is None else str(v) for v in values)
+    return int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:8], "big", signed=True)
+
+
+def test_rendered_sql_is_stable():
+    assert surrogate_key(["channel_name"]) == (
+        "('x' || left(md5(concat_ws('|', coalesce(channel_name::text, ''))), 16))::bit(64)::bigint"
+    )
+    assert surrogate_key(["a", "b"]) == (
+        "('x' || left(md5(concat_ws('|', coalesce(a::text, ''), coalesce(b::text, ''))), 16))::bit(64)::bigint"
+    )
+
+
+def test_keys_are_pinned():
+    # Keys already stored in incremental facts: changing the macro must not change them
+    assert expected_key("CheMed123") == 981804614413899894
+    assert expected_key("a", None, "b") == -8195618128568603118
+
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_DSN"), reason="set TEST_DATABASE_DSN to run against Postgres")
+def test_postgres_computes_the_pinned_keys():
+    psycopg2 = pytest.importorskip("psycopg2")
+
+    with psycopg2.connect(os.environ["TEST_DATABASE_DSN"]) as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT {surrogate_key(['%(channel)s'])}", {"channel": "CheMed123"})
+        assert cur.fetchone()[0] == expected_key("CheMed123")
+        cur.execute(f"SELECT {surrogate_key(['%(a)s', 'NULL::text', '%(b)s'])}", {"a": "a", "b": "b"})
+        assert cur.fetchone()[0] == expected_key("a", None, "b")